@@ -0,0 +1,400 @@
+"""
+analysis_matrices.py
+Sparse count matrices + group membership for the statistics / charts.
+
+Built once from the token store (step 3 fused) and the dataset metadata:
+
+    analysis_matrices/
+        labels.txt, vocab.txt           column names (same ids as token_store)
+        label_counts.npz    CSR [n_songs, n_labels]   token count per label
+        token_counts.npz    CSR [n_songs, n_vocab]    token count per word
+        years.txt / year_codes.npy      int32 [n_songs] index into years, -1 = missing
+        periods.txt / period_codes.npy  int32 [n_songs] index into PERIOD_ORDER, -1 = missing
+        genres.txt / genre_members.npz          CSR 0/1 [n_songs, n_genres]
+        composers.txt / composer_members.npz    CSR 0/1 [n_songs, n_composers]
+        key.json            content hashes of the token store and dataset CSV built from
+
+Every chart of analysis.ipynb / calculate.ipynb is then a bincount or a
+product members.T @ values, instead of per-row .apply + groupby / explode.
+The analyses keep the notebooks' definitions: phiên âm is grouped like the
+dataset's num_foreign_* columns (FOREIGN_GROUPS + other), the analysis.ipynb
+charts use every year, the calculate.ipynb RQ charts drop years > MAX_YEAR.
+
+Usage:
+    key = matrices_key(TOKEN_STORE_DIR, DATASET_CSV)
+    mats = load_matrices(MATRICES_DIR, key)     # None when missing or built from other inputs
+    if mats is None:
+        mats = build_matrices(store, df)        # df: lyrics, year, period, genres, composers
+        mats.save(MATRICES_DIR, key)
+
+    language_share_by_period(mats)          # chart 1
+    presence_by_group(mats, "genre")        # % of songs with English per genre
+"""
+
+import json
+import os
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from token_index import parse_list
+from token_store import TokenStore, _read_lines, _write_lines, files_digest, store_digest
+
+PERIOD_ORDER = ["1990-2000", "2000-2010", "2010-2015", "2015-2020", "2020-2025"]
+MAX_YEAR = 2025     # calculate.ipynb drops later years (typos in the crawled metadata)
+MATRICES_FORMAT = 2     # part of key.json: matrices saved by an older build are rebuilt
+
+# num_foreign_japanese / _korean / _chinese of the dataset; every other FOREIGN_* label is "other"
+FOREIGN_GROUPS = {
+    "japanese": ['FOREIGN_JAPAN'],
+    "korean": ['FOREIGN_SOUTH_KOREA'],
+    "chinese": ['FOREIGN_CHINESE'],
+}
+
+GROUPS = ("year", "period", "genre", "composer")
+
+LABEL_COUNTS_FILE = "label_counts.npz"
+TOKEN_COUNTS_FILE = "token_counts.npz"
+KEY_FILE = "key.json"
+
+
+# =========================
+# BUILD
+# =========================
+def count_matrices(store: TokenStore) -> Tuple[sparse.csr_matrix, sparse.csr_matrix]:
+    """(songs x labels, songs x vocab) token counts straight from the store arrays"""
+    n_songs = len(store)
+    song_ids = store.song_index()
+    ones = np.ones(len(song_ids), dtype=np.int32)
+    label_counts = sparse.csr_matrix(
+        (ones, (song_ids, np.asarray(store.label_ids, dtype=np.int64))),
+        shape=(n_songs, len(store.labels)))
+    token_counts = sparse.csr_matrix(
+        (ones, (song_ids, np.asarray(store.token_ids, dtype=np.int64))),
+        shape=(n_songs, len(store.vocab)))
+    label_counts.sum_duplicates()
+    token_counts.sum_duplicates()
+    return label_counts, token_counts
+
+
+def year_codes(years) -> Tuple[List[int], np.ndarray]:
+    y = pd.to_numeric(pd.Series(years), errors="coerce")
+    values = np.sort(y.dropna().astype(int).unique())
+    codes = np.full(len(y), -1, dtype=np.int32)
+    mask = y.notna().to_numpy()
+    codes[mask] = np.searchsorted(values, y[mask].astype(int).to_numpy())
+    return values.tolist(), codes
+
+
+def period_codes(periods) -> np.ndarray:
+    cat = pd.Categorical(pd.Series(periods), categories=PERIOD_ORDER)
+    return np.asarray(cat.codes, dtype=np.int32)
+
+
+def member_matrix(values) -> Tuple[List[str], sparse.csr_matrix]:
+    """0/1 songs x groups matrix from list columns (genres / composers)"""
+    names: Dict[str, int] = {}
+    rows, cols = [], []
+    for row, x in enumerate(values):
+        for name in {str(v).strip() for v in parse_list(x)}:
+            if not name:
+                continue
+            col = names.get(name)
+            if col is None:
+                col = names[name] = len(names)
+            rows.append(row)
+            cols.append(col)
+    members = sparse.csr_matrix(
+        (np.ones(len(rows), dtype=np.int32), (rows, cols)), shape=(len(values), len(names)))
+    return list(names), members
+
+
+def codes_matrix(codes: np.ndarray, n_groups: int) -> sparse.csr_matrix:
+    """0/1 songs x groups matrix from a code vector (-1 = no group)"""
+    rows = np.flatnonzero(codes >= 0)
+    return sparse.csr_matrix(
+        (np.ones(len(rows), dtype=np.int32), (rows, codes[rows])), shape=(len(codes), n_groups))
+
+
+class AnalysisMatrices:
+    def __init__(self, labels: List[str], vocab: List[str],
+                 label_counts: sparse.csr_matrix, token_counts: sparse.csr_matrix,
+                 years: List[int], year_codes: np.ndarray, period_codes: np.ndarray,
+                 genres: List[str], genre_members: sparse.csr_matrix,
+                 composers: List[str], composer_members: sparse.csr_matrix):
+        self.labels = labels
+        self.vocab = vocab
+        self.label_counts = label_counts
+        self.token_counts = token_counts
+        self.years = years
+        self.year_codes = year_codes
+        self.periods = list(PERIOD_ORDER)
+        self.period_codes = period_codes
+        self.genres = genres
+        self.genre_members = genre_members
+        self.composers = composers
+        self.composer_members = composer_members
+        self.label_index = {label: i for i, label in enumerate(labels)}
+
+    def __len__(self) -> int:
+        return self.label_counts.shape[0]
+
+    # =========================
+    # SAVE / OPEN
+    # =========================
+    def save(self, out_dir: str, key: Optional[dict] = None):
+        os.makedirs(out_dir, exist_ok=True)
+        key_path = os.path.join(out_dir, KEY_FILE)
+        if os.path.exists(key_path):
+            # key.json is written last: a save cut halfway leaves no key, so it is never loaded
+            os.remove(key_path)
+        _write_lines(os.path.join(out_dir, "labels.txt"), self.labels)
+        _write_lines(os.path.join(out_dir, "vocab.txt"), self.vocab)
+        _write_lines(os.path.join(out_dir, "years.txt"), [str(y) for y in self.years])
+        _write_lines(os.path.join(out_dir, "periods.txt"), self.periods)
+        _write_lines(os.path.join(out_dir, "genres.txt"), self.genres)
+        _write_lines(os.path.join(out_dir, "composers.txt"), self.composers)
+        sparse.save_npz(os.path.join(out_dir, LABEL_COUNTS_FILE), self.label_counts)
+        sparse.save_npz(os.path.join(out_dir, TOKEN_COUNTS_FILE), self.token_counts)
+        sparse.save_npz(os.path.join(out_dir, "genre_members.npz"), self.genre_members)
+        sparse.save_npz(os.path.join(out_dir, "composer_members.npz"), self.composer_members)
+        np.save(os.path.join(out_dir, "year_codes.npy"), self.year_codes)
+        np.save(os.path.join(out_dir, "period_codes.npy"), self.period_codes)
+        if key is not None:
+            with open(key_path, "w", encoding="utf-8") as f:
+                json.dump(key, f)
+
+    @classmethod
+    def open(cls, out_dir: str) -> "AnalysisMatrices":
+        def path(name):
+            return os.path.join(out_dir, name)
+        periods = _read_lines(path("periods.txt"))
+        if periods != PERIOD_ORDER:
+            raise ValueError(f"{out_dir} was built with periods {periods}, expected {PERIOD_ORDER}")
+        return cls(
+            labels=_read_lines(path("labels.txt")),
+            vocab=_read_lines(path("vocab.txt")),
+            label_counts=sparse.load_npz(path(LABEL_COUNTS_FILE)).tocsr(),
+            token_counts=sparse.load_npz(path(TOKEN_COUNTS_FILE)).tocsr(),
+            years=[int(y) for y in _read_lines(path("years.txt"))],
+            year_codes=np.load(path("year_codes.npy")),
+            period_codes=np.load(path("period_codes.npy")),
+            genres=_read_lines(path("genres.txt")),
+            genre_members=sparse.load_npz(path("genre_members.npz")).tocsr(),
+            composers=_read_lines(path("composers.txt")),
+            composer_members=sparse.load_npz(path("composer_members.npz")).tocsr(),
+        )
+
+    # =========================
+    # ACCESS
+    # =========================
+    def count(self, label: str) -> np.ndarray:
+        """Token count of one label per song (zeros if the label never occurs)"""
+        lid = self.label_index.get(label)
+        if lid is None:
+            return np.zeros(len(self), dtype=np.int64)
+        return self.label_counts[:, lid].toarray().ravel().astype(np.int64)
+
+    def foreign_labels(self) -> List[str]:
+        return [label for label in self.labels if label.startswith('FOREIGN_')]
+
+    def foreign_groups(self) -> Tuple[List[str], np.ndarray]:
+        """(japanese, korean, chinese, other) phiên âm token counts per song, [n_songs, 4]"""
+        grouped = {label for labels in FOREIGN_GROUPS.values() for label in labels}
+        groups = {**FOREIGN_GROUPS, "other": [label for label in self.foreign_labels() if label not in grouped]}
+        counts = np.column_stack([
+            sum((self.count(label) for label in labels), np.zeros(len(self), dtype=np.int64))
+            for labels in groups.values()])
+        return list(groups), counts
+
+    def non_punct(self) -> np.ndarray:
+        return np.asarray(self.label_counts.sum(axis=1)).ravel() - self.count('PUNCT')
+
+    def group_names(self, by: str) -> list:
+        return {"year": self.years, "period": self.periods,
+                "genre": self.genres, "composer": self.composers}[by]
+
+    def members(self, by: str) -> sparse.csr_matrix:
+        """0/1 songs x groups matrix for year / period / genre / composer"""
+        if by == "year":
+            return codes_matrix(self.year_codes, len(self.years))
+        if by == "period":
+            return codes_matrix(self.period_codes, len(self.periods))
+        if by == "genre":
+            return self.genre_members
+        if by == "composer":
+            return self.composer_members
+        raise ValueError(f"Unknown group {by!r}, expected one of {GROUPS}")
+
+    def group_mean(self, by: str, values, mask: Optional[np.ndarray] = None) -> pd.DataFrame:
+        """
+        Mean of per-song values ([n_songs] or [n_songs, k]) per group, NaN values
+        skipped (like DataFrame.groupby().mean()); columns n_records + values
+        """
+        values = np.asarray(values, dtype=np.float64)
+        if values.ndim == 1:
+            values = values[:, None]
+        valid = np.isfinite(values)
+        if mask is not None:
+            valid &= np.asarray(mask, dtype=bool)[:, None]
+        members_t = self.members(by).T.tocsr()
+        sums = members_t @ np.where(valid, values, 0.0)
+        counts = members_t @ valid.astype(np.float64)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means = sums / counts
+        n_records = members_t @ (np.ones(len(self)) if mask is None else np.asarray(mask, dtype=np.float64))
+        out = pd.DataFrame(means, index=pd.Index(self.group_names(by), name=by))
+        out.insert(0, "n_records", n_records.astype(np.int64))
+        return out
+
+    def top_tokens(self, by: str, group, k: int = 20) -> pd.Series:
+        """Most frequent tokens of one year / period / genre / composer"""
+        col = self.group_names(by).index(group)
+        songs = self.members(by)[:, col].T.tocsr()
+        totals = np.asarray((songs @ self.token_counts).todense()).ravel()
+        top = np.argsort(totals)[::-1][:k]
+        return pd.Series(totals[top], index=[self.vocab[i] for i in top], name="count")
+
+
+def build_matrices(store: TokenStore, df: pd.DataFrame) -> AnalysisMatrices:
+    """df rows must be the songs of the store, in the same order (checked on the lyrics when df has them)"""
+    if "lyrics" in df.columns:
+        store.check_alignment(df["lyrics"])
+    elif len(df) != len(store):
+        raise ValueError(f"Dataset has {len(df):,} rows but the token store has {len(store):,} songs")
+
+    def col(name):
+        return df[name].tolist() if name in df.columns else [None] * len(df)
+
+    label_counts, token_counts = count_matrices(store)
+    years, ycodes = year_codes(col("year"))
+    genres, genre_members = member_matrix(col("genres"))
+    composers, composer_members = member_matrix(col("composers"))
+    mats = AnalysisMatrices(
+        labels=list(store.labels), vocab=list(store.vocab),
+        label_counts=label_counts, token_counts=token_counts,
+        years=years, year_codes=ycodes, period_codes=period_codes(col("period")),
+        genres=genres, genre_members=genre_members,
+        composers=composers, composer_members=composer_members,
+    )
+    print(f"✅ Matrices: {len(mats):,} songs | {label_counts.nnz:,} label cells | "
+          f"{token_counts.nnz:,} token cells | {len(genres):,} genres | {len(composers):,} composers")
+    return mats
+
+
+def matrices_key(store_dir: str, dataset_path: str) -> dict:
+    """Content hashes of the inputs the matrices are built from"""
+    return {"format": MATRICES_FORMAT, "token_store": store_digest(store_dir), "dataset": files_digest([dataset_path])}
+
+
+def load_matrices(out_dir: str, key: dict) -> Optional[AnalysisMatrices]:
+    """Saved matrices, or None when missing / built from a different token store or dataset"""
+    key_path = os.path.join(out_dir, KEY_FILE)
+    if not os.path.exists(key_path):
+        return None
+    with open(key_path, "r", encoding="utf-8") as f:
+        if json.load(f) != key:
+            return None
+    return AnalysisMatrices.open(out_dir)
+
+
+# =========================
+# ANALYSES
+# =========================
+def _share(counts: np.ndarray, total: np.ndarray) -> np.ndarray:
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return counts / total
+
+
+def language_share_by_period(mats: AnalysisMatrices) -> pd.DataFrame:
+    """Mean share of Vietnamese / Hán-Việt / English / other foreign tokens per period"""
+    non_punct = mats.non_punct()
+    foreign = mats.foreign_groups()[1].sum(axis=1)
+    values = np.column_stack([
+        _share(mats.count('VIETNAMESE'), non_punct),
+        _share(mats.count('HANVIET'), non_punct),
+        _share(mats.count('ENGLISH'), non_punct),
+        _share(foreign, non_punct),
+    ])
+    out = mats.group_mean("period", values)
+    out.columns = ["n_records", "vietnamese", "hanviet", "english", "foreign_other"]
+    return out
+
+
+def non_vietnamese_by_period(mats: AnalysisMatrices) -> Tuple[pd.Series, pd.DataFrame]:
+    """
+    (mean share of non-Vietnamese tokens on the whole lyrics per period,
+     composition of the non-Vietnamese part normalized to 100%);
+    like analysis.ipynb both are averaged over the songs with a non-Vietnamese part
+    """
+    non_punct = mats.non_punct()
+    names, foreign = mats.foreign_groups()
+    by_name = dict(zip(names, foreign.T))
+    parts = ["korean", "japanese", "chinese", "other"]
+    counts = np.column_stack([mats.count('HANVIET'), mats.count('ENGLISH')]
+                             + [by_name[name] for name in parts]).astype(np.float64)
+    non_vi = counts.sum(axis=1)
+
+    share = mats.group_mean("period", _share(non_vi, non_punct), mask=non_vi > 0)[0] \
+        .rename("pct_non_vietnamese_on_total")
+    composition = mats.group_mean("period", _share(counts, non_vi[:, None]), mask=non_vi > 0)
+    composition.columns = ["n_records", "hanviet", "english"] + parts
+    return share, composition
+
+
+def presence_by_year(mats: AnalysisMatrices, label: str = 'ENGLISH',
+                     min_n: int = 50, window: int = 3) -> pd.DataFrame:
+    """Share of songs with at least one token of label per year (+ centered rolling mean)"""
+    out = mats.group_mean("year", mats.count(label) > 0)
+    out.columns = ["n_records", "pct_present"]
+    out = out[out["n_records"] >= min_n].copy()
+    out[f"pct_roll{window}"] = out["pct_present"].rolling(window, center=True).mean()
+    return out
+
+
+def presence_by_group(mats: AnalysisMatrices, by: str = "genre", label: str = 'ENGLISH',
+                      min_n: int = 200, top: int = 15) -> pd.DataFrame:
+    """Share of songs with label in the top genres / composers by number of songs"""
+    out = mats.group_mean(by, mats.count(label) > 0)
+    out.columns = ["n_records", "pct_present"]
+    out = out[out["n_records"] >= min_n]
+    return out.sort_values("n_records", ascending=False).head(top)
+
+
+def phien_am_presence(mats: AnalysisMatrices, by: Optional[str] = None) -> pd.DataFrame:
+    """Songs with phiên âm per language (Vietnamese left out, as in analysis.ipynb):
+    counts overall (by=None) or share per group"""
+    labels = [label for label in mats.foreign_labels() if label != 'FOREIGN_VIETNAMESE']
+    names = [label.replace('FOREIGN_', '').lower() for label in labels]
+    present = np.column_stack([mats.count(label) > 0 for label in labels]) if labels \
+        else np.zeros((len(mats), 0), dtype=bool)
+    if by is None:
+        return pd.Series(present.sum(axis=0), index=names, name="n_songs").sort_values(ascending=False)
+    out = mats.group_mean(by, present)
+    out.columns = ["n_records"] + names
+    return out
+
+
+def foreign_by_year(mats: AnalysisMatrices) -> pd.DataFrame:
+    """
+    RQ1-RQ3 and RQ5 of calculate.ipynb per year (years > MAX_YEAR dropped):
+    share of each foreign group within the foreign tokens (songs with any),
+    mean foreign tokens per song, share of songs with any and mean Hán-Việt percentage
+    """
+    names, foreign = mats.foreign_groups()
+    parts = ["hanviet", "english", "proper_noun"] + names
+    counts = np.column_stack([mats.count('HANVIET'), mats.count('ENGLISH'), mats.count('PROPER_NOUN'),
+                              foreign]).astype(np.float64)
+    total = counts.sum(axis=1)
+    has_foreign = total > 0
+
+    ratios = mats.group_mean("year", _share(counts, total[:, None]), mask=has_foreign)
+    ratios.columns = ["n_foreign"] + [p + "_ratio" for p in parts]
+    summary = mats.group_mean("year", np.column_stack([
+        total, has_foreign, _share(mats.count('HANVIET'), mats.non_punct()) * 100,
+    ]))
+    summary.columns = ["n_records", "total_foreign", "has_foreign", "pct_hanviet"]
+    out = summary.join(ratios)
+    return out[out.index <= MAX_YEAR]
@@ -0,0 +1,129 @@
+"""
+dict_bundle.py
+Precompiled dictionary bundles keyed by a content hash of their sources.
+
+Building the labeler means reading every thuvien CSV with pandas, loading the
+NLTK words corpus and building the phrase tries. A bundle stores the built
+object once (pickle) under thuvien/.bundles/<name>-<hash>.pkl, where <hash>
+covers the bytes of every source file. Later runs only hash the sources and
+unpickle; the bundle is rebuilt automatically when a source CSV changes.
+The labeler also downloads Viet74K at build time: its URL is part of the
+hash, and a labeler built from the local vietnamese.csv fallback (download
+failed) is used for that run only, never saved, so the next run retries.
+
+Usage:
+    from dict_bundle import load_labeler_bundle
+    labeler = load_labeler_bundle(THUVIEN_DIR)
+"""
+
+import glob
+import hashlib
+import os
+import pickle
+import time
+from typing import Callable, List, Optional
+
+import fused_labeler
+from fused_labeler import (
+    ENGLISH_FILE, HANVIET_FILE, LLM_LABELS_FILE, NLTK_DATA_DIR, PHIEN_AM_FILE, PROPER_NOUN_FILE,
+    THUVIEN_DIR, URL_VIETNAMESE_DICT, VIETNAMESE_FILE, FusedLabeler, load_labeler,
+)
+
+# bump when the pickled structures change shape
+BUNDLE_FORMAT = 2
+BUNDLE_DIR_NAME = ".bundles"
+
+
+def hash_sources(paths: List[Optional[str]], extra: str = "") -> str:
+    """sha256 over the name + bytes of every source (missing files count too)"""
+    h = hashlib.sha256(f"{BUNDLE_FORMAT}|{extra}".encode("utf-8"))
+    for path in paths:
+        if not path:
+            continue
+        h.update(b"\0" + os.path.basename(path).encode("utf-8") + b"\0")
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    h.update(block)
+        else:
+            h.update(b"<missing>")
+    return h.hexdigest()[:16]
+
+
+def load_bundle(name: str, sources: List[Optional[str]], build: Callable[[], object],
+                bundle_dir: str, extra: str = "", rebuild: bool = False,
+                keep: Optional[Callable[[object], bool]] = None):
+    """Return the cached object for these sources, building it on a miss (saved unless keep(obj) is False)"""
+    digest = hash_sources(sources, extra)
+    path = os.path.join(bundle_dir, f"{name}-{digest}.pkl")
+
+    if not rebuild and os.path.exists(path):
+        start = time.time()
+        with open(path, "rb") as f:
+            obj = pickle.load(f)
+        print(f"✅ Loaded bundle {os.path.basename(path)} in {time.time() - start:.2f}s")
+        return obj
+
+    print(f"🔨 Building bundle '{name}' (sources changed or no bundle yet)...")
+    obj = build()
+    if keep is not None and not keep(obj):
+        print(f"⚠️ Bundle '{name}' was built from fallback sources: used for this run, not saved")
+        return obj
+
+    os.makedirs(bundle_dir, exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+    # keep only the current version of this bundle
+    for old in glob.glob(os.path.join(bundle_dir, f"{name}-*.pkl")):
+        if old != path:
+            os.remove(old)
+
+    print(f"💾 Saved bundle to: {path}")
+    return obj
+
+
+def nltk_words_path(nltk_data_dir: Optional[str] = NLTK_DATA_DIR) -> Optional[str]:
+    """Path of the NLTK 'words' corpus file, if installed"""
+    try:
+        import nltk
+        if nltk_data_dir and nltk_data_dir not in nltk.data.path:
+            nltk.data.path.append(nltk_data_dir)
+        return str(nltk.data.find("corpora/words/en"))
+    except Exception:
+        return None
+
+
+def labeler_sources(thuvien_dir: str = THUVIEN_DIR,
+                    nltk_data_dir: Optional[str] = NLTK_DATA_DIR) -> List[Optional[str]]:
+    return [
+        os.path.join(thuvien_dir, PHIEN_AM_FILE),
+        os.path.join(thuvien_dir, PROPER_NOUN_FILE),
+        os.path.join(thuvien_dir, HANVIET_FILE),
+        os.path.join(thuvien_dir, VIETNAMESE_FILE),
+        os.path.join(thuvien_dir, ENGLISH_FILE),
+        os.path.join(thuvien_dir, LLM_LABELS_FILE),
+        nltk_words_path(nltk_data_dir),
+        fused_labeler.__file__,
+    ]
+
+
+def load_labeler_bundle(thuvien_dir: str = THUVIEN_DIR, nltk_data_dir: Optional[str] = NLTK_DATA_DIR,
+                        rebuild: bool = False) -> FusedLabeler:
+    """
+    FusedLabeler from the bundle cache.
+    Viet74K is downloaded at build time: its URL is hashed, its content is not,
+    so pass rebuild=True to pick up a new online word list. A labeler built
+    from the vietnamese.csv fallback is not saved.
+    """
+    return load_bundle(
+        "labeler",
+        labeler_sources(thuvien_dir, nltk_data_dir),
+        lambda: load_labeler(thuvien_dir, nltk_data_dir),
+        os.path.join(thuvien_dir, BUNDLE_DIR_NAME),
+        extra=URL_VIETNAMESE_DICT,
+        rebuild=rebuild,
+        keep=lambda labeler: labeler.vietnamese_source == URL_VIETNAMESE_DICT,
+    )
@@ -0,0 +1,509 @@
+"""
+fused_labeler.py
+Single-pass replacement for labeling steps 3A-3E in calculate.ipynb.
+
+Each song is tokenized once and resolved with the same priority as the
+notebook chain:
+    phiên âm -> proper noun (case-sensitive) -> Hán-Việt -> Viet74K -> English
+Phrase dictionaries are matched with word-level tries (longest match first),
+so no candidate phrase is rebuilt per window position. Output tokens and the
+extracted columns are identical to running 3A -> 3E one after another.
+
+Step 3F (optional): tokens still UNLABELED after 3E are looked up in the
+token -> label table written by Local_AI/vocab_labeler.py (thuvien/llm_labels.csv),
+longest phrase first. Without that file the output is unchanged.
+
+Usage (from calculate.ipynb):
+    from fused_labeler import load_labeler, label_dataframe
+    labeler = load_labeler(THUVIEN_DIR)
+    df = label_dataframe(df, labeler)                  # single core
+    df = label_dataframe(df, labeler, workers=8)       # process pool
+"""
+
+import multiprocessing as mp
+import os
+import string
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Set, Tuple
+
+import pandas as pd
+
+# ----------------- CONFIG -----------------
+THUVIEN_DIR = "/Users/copy/Downloads/TDTU/Labeling/thuvien"
+NLTK_DATA_DIR = "/Users/copy/nltk_data"
+URL_VIETNAMESE_DICT = "https://raw.githubusercontent.com/duyet/vietnamese-wordlist/master/Viet74K.txt"
+
+PHIEN_AM_FILE = "phien_am.csv"
+PROPER_NOUN_FILE = "ten_rieng_no_common.csv"
+HANVIET_FILE = "han_viet_filtered.csv"
+VIETNAMESE_FILE = "vietnamese.csv"
+ENGLISH_FILE = "english.csv"
+LLM_LABELS_FILE = "llm_labels.csv"     # step 3F, written by Local_AI/vocab_labeler.py
+
+PHIEN_AM_MAX_WORDS = 10     # step 3A: max words per phiên âm phrase
+PROPER_NOUN_MAX_WORDS = 5   # step 3B: max tokens per proper noun
+LLM_MAX_WORDS = 3           # step 3F: max words per LLM-labeled phrase
+
+CHUNK_SIZE = 500            # songs per task in the process pool
+
+# Common pronouns to exclude (không phải tên riêng)
+COMMON_PRONOUNS = {
+    'anh', 'em', 'tôi', 'ta', 'chị', 'ông', 'bà', 'cô', 'chú',
+    'mình', 'nó', 'họ', 'chúng ta', 'chúng tôi', 'bọn tôi',
+    'tao', 'mày', 'mi', 'bây', 'nàng', 'hắn'
+}
+
+PUNCT_CHARS = string.punctuation + '""''…'
+# ------------------------------------------
+
+# trie node key that holds the label of a complete phrase (never a word)
+_END = None
+
+
+# =========================
+# HELPERS
+# =========================
+def clean_punctuation(word: str) -> Tuple[str, str, str]:
+    """Separate punctuation from word"""
+    leading = ''
+    trailing = ''
+
+    while word and word[0] in PUNCT_CHARS:
+        leading += word[0]
+        word = word[1:]
+
+    while word and word[-1] in PUNCT_CHARS:
+        trailing = word[-1] + trailing
+        word = word[:-1]
+
+    return leading, word, trailing
+
+
+def build_trie(phrases: Dict[str, str]) -> dict:
+    """Word-level trie: phrase 'a b c' -> {'a': {'b': {'c': {_END: label}}}}"""
+    root = {}
+    for phrase, label in phrases.items():
+        node = root
+        for w in phrase.split(' '):
+            node = node.setdefault(w, {})
+        node[_END] = label
+    return root
+
+
+# =========================
+# DICTIONARY LOADERS
+# =========================
+def load_phien_am_dict(path: str) -> Tuple[Dict[str, str], Dict[str, List[str]]]:
+    """phrase (lowercase) -> FOREIGN_<LANG>, plus phrases with conflicting labels"""
+    phien_am_df = pd.read_csv(path)
+
+    phien_am_dict = {}
+    phrase_conflicts = defaultdict(list)
+
+    for col in phien_am_df.columns:
+        clean_col = col.strip().replace(' ', '_').upper()
+        label = f"FOREIGN_{clean_col}"
+
+        values = phien_am_df[col].dropna().astype(str).str.strip()
+        for v in values:
+            v_lower = v.lower()
+            if v_lower and v_lower != 'nan':
+                if v_lower in phien_am_dict:
+                    phrase_conflicts[v_lower].append(phien_am_dict[v_lower])
+                phrase_conflicts[v_lower].append(label)
+                phien_am_dict[v_lower] = label
+
+    conflicts = {word: list(set(labels)) for word, labels in phrase_conflicts.items()
+                 if len(set(labels)) > 1}
+    return phien_am_dict, conflicts
+
+
+def load_proper_nouns(path: str) -> Set[str]:
+    """Case-sensitive proper noun set (common pronouns excluded)"""
+    ten_rieng_df = pd.read_csv(path)
+
+    proper_nouns = set()
+    for v in ten_rieng_df.iloc[:, 0].dropna().astype(str).str.strip():
+        if v and v != 'nan' and v.lower() not in COMMON_PRONOUNS:
+            proper_nouns.add(v)
+    return proper_nouns
+
+
+def load_word_set(path: str) -> Set[str]:
+    """First column of a dictionary CSV as a lowercase set"""
+    word_df = pd.read_csv(path)
+    words = set(word_df.iloc[:, 0].dropna().astype(str).str.lower().str.strip())
+    return {w for w in words if w and w != 'nan'}
+
+
+def load_vietnamese_set(fallback_path: str, url: str = URL_VIETNAMESE_DICT) -> Tuple[Set[str], str]:
+    """Viet74K word list, falling back to the local vietnamese.csv; also returns the source used"""
+    import requests
+    try:
+        response = requests.get(url, timeout=30)
+        response.raise_for_status()
+        return set(w.lower().strip() for w in response.text.strip().split('\n') if w.strip()), url
+    except Exception as e:
+        print(f"  ❌ Could not download Vietnamese dictionary: {e}")
+        print(f"  ⚠️  Trying to load from local {os.path.basename(fallback_path)}...")
+        return load_word_set(fallback_path), fallback_path
+
+
+def load_english_set(custom_path: str, nltk_data_dir: Optional[str] = NLTK_DATA_DIR) -> Set[str]:
+    """NLTK words corpus + custom english.csv (lowercase)"""
+    english_words = set()
+    try:
+        import nltk
+        from nltk.corpus import words as nltk_words
+        if nltk_data_dir:
+            nltk.data.path.append(nltk_data_dir)
+        english_words = set(w.lower() for w in nltk_words.words())
+    except Exception as e:
+        print(f"  ⚠️  NLTK load failed: {e}")
+        print("  ⚠️  Continuing with custom dictionary only...")
+
+    try:
+        english_words.update(load_word_set(custom_path))
+    except Exception as e:
+        print(f"  ⚠️  Could not load {os.path.basename(custom_path)}: {e}")
+
+    return {w for w in english_words if w}
+
+
+def load_llm_labels(path: str) -> Dict[str, str]:
+    """token/phrase (lowercase) -> label from the LLM vocabulary table; empty if it does not exist yet"""
+    if not os.path.exists(path):
+        return {}
+    table = pd.read_csv(path, keep_default_na=False)
+    return {str(t).lower().strip(): str(lbl) for t, lbl in zip(table['token'], table['label'])
+            if str(t).strip() and lbl and lbl != 'UNLABELED'}
+
+
+# =========================
+# FUSED LABELER
+# =========================
+class FusedLabeler:
+    """Labels a song in one pass with the 3A -> 3E priority order."""
+
+    def __init__(self, phien_am_dict: Dict[str, str], proper_nouns: Set[str],
+                 hanviet_set: Set[str], vietnamese_set: Set[str], english_set: Set[str],
+                 llm_labels: Optional[Dict[str, str]] = None, vietnamese_source: str = URL_VIETNAMESE_DICT):
+        self.phien_am_dict = phien_am_dict
+        self.proper_nouns = proper_nouns
+        self.phien_am_trie = build_trie(phien_am_dict)
+        self.proper_noun_trie = build_trie({p: 'PROPER_NOUN' for p in proper_nouns})
+
+        # single-word steps 3C-3E collapse into one lookup; later updates win,
+        # so insert lowest priority first
+        self.word_label = {}
+        for words, label in ((english_set, 'ENGLISH'),
+                             (vietnamese_set, 'VIETNAMESE'),
+                             (hanviet_set, 'HANVIET')):
+            for w in words:
+                self.word_label[w] = label
+        # where vietnamese_set came from: the Viet74K url, or the local fallback file
+        self.vietnamese_source = vietnamese_source
+
+        # 3F: only reached by tokens no dictionary knows
+        self.llm_labels = dict(llm_labels or {})
+        self.llm_trie = build_trie(self.llm_labels)
+
+    def label(self, text: str) -> List[Tuple[str, str]]:
+        """Return [(token, label), ...] exactly as steps 3A-3E would"""
+        if not isinstance(text, str) or not text:
+            return []
+
+        words = text.split()
+        if not words:
+            return []
+
+        # tokenize once: (leading, clean_word, trailing, clean_word.lower())
+        parts = []
+        for w in words:
+            leading, clean_word, trailing = clean_punctuation(w)
+            parts.append((leading, clean_word, trailing, clean_word.lower()))
+
+        tokens = self._match_phien_am(parts)
+        return self._match_rest(tokens)
+
+    def _match_phien_am(self, parts) -> List[Tuple[str, str]]:
+        """Step 3A: longest phiên âm phrase (up to 10 words), else UNLABELED"""
+        output = []
+        n = len(parts)
+        i = 0
+
+        while i < n:
+            leading, clean_word, trailing, _ = parts[i]
+
+            if not clean_word:
+                # Only punctuation
+                if leading:
+                    output.append((leading, 'PUNCT'))
+                if trailing:
+                    output.append((trailing, 'PUNCT'))
+                i += 1
+                continue
+
+            # punctuation-only words inside the window are skipped by the
+            # phrase builder, so they do not advance the trie
+            node = self.phien_am_trie
+            length = 0
+            for j in range(i, min(i + PHIEN_AM_MAX_WORDS, n)):
+                cw_lower = parts[j][3]
+                if cw_lower:
+                    node = node.get(cw_lower)
+                    if node is None:
+                        break
+                if _END in node:
+                    length = j - i + 1
+                    label = node[_END]
+
+            if leading:
+                output.append((leading, 'PUNCT'))
+            if length:
+                phrase_lower = ' '.join(p[3] for p in parts[i:i + length] if p[3])
+                output.append((phrase_lower, label))
+                if trailing and length == 1:
+                    output.append((trailing, 'PUNCT'))
+                i += length
+            else:
+                output.append((clean_word, 'UNLABELED'))
+                if trailing:
+                    output.append((trailing, 'PUNCT'))
+                i += 1
+
+        return output
+
+    def _proper_noun_length(self, tokens: List[Tuple[str, str]], i: int) -> int:
+        """Step 3B: tokens in the longest proper noun starting at i (case-sensitive), 0 if none"""
+        node = self.proper_noun_trie
+        length = 0
+        for j in range(i, min(i + PROPER_NOUN_MAX_WORDS, len(tokens))):
+            t, lbl = tokens[j]
+            if lbl != 'UNLABELED':
+                break
+            node = node.get(t)
+            if node is None:
+                break
+            if _END in node:
+                length = j - i + 1
+        return length
+
+    def _match_rest(self, tokens: List[Tuple[str, str]]) -> List[Tuple[str, str]]:
+        """Steps 3B-3E on the UNLABELED tokens left by step 3A"""
+        updated_tokens = []
+        n = len(tokens)
+        i = 0
+
+        while i < n:
+            token, label = tokens[i]
+
+            if label != 'UNLABELED':
+                updated_tokens.append((token, label))
+                i += 1
+                continue
+
+            # 3B: proper noun over consecutive UNLABELED tokens (case-sensitive)
+            length = self._proper_noun_length(tokens, i)
+            if length:
+                phrase_exact = ' '.join(t for t, _ in tokens[i:i + length])
+                updated_tokens.append((phrase_exact, 'PROPER_NOUN'))
+                i += length
+                continue
+
+            # 3C-3E: Hán-Việt -> Vietnamese -> English
+            word_label = self.word_label.get(token.lower())
+            if word_label is not None or not self.llm_trie:
+                updated_tokens.append((token, word_label or 'UNLABELED'))
+                i += 1
+                continue
+
+            # 3F: LLM vocabulary table over consecutive tokens no dictionary knows;
+            # the phrase never swallows a token where a 3B proper noun starts
+            node = self.llm_trie
+            length = 0
+            for j in range(i, min(i + LLM_MAX_WORDS, n)):
+                t, lbl = tokens[j]
+                if lbl != 'UNLABELED' or (j > i and (t.lower() in self.word_label
+                                                     or self._proper_noun_length(tokens, j))):
+                    break
+                node = node.get(t.lower())
+                if node is None:
+                    break
+                if _END in node:
+                    length = j - i + 1
+                    llm_label = node[_END]
+
+            if length:
+                updated_tokens.append((' '.join(t for t, _ in tokens[i:i + length]), llm_label))
+                i += length
+            else:
+                updated_tokens.append((token, 'UNLABELED'))
+                i += 1
+
+        return updated_tokens
+
+
+def load_labeler(thuvien_dir: str = THUVIEN_DIR, nltk_data_dir: Optional[str] = NLTK_DATA_DIR) -> FusedLabeler:
+    """Load every dictionary used by steps 3A-3E and build the labeler"""
+    print("\n📂 Loading dictionaries...")
+
+    phien_am_dict, conflicts = load_phien_am_dict(os.path.join(thuvien_dir, PHIEN_AM_FILE))
+    print(f"  ✅ Phiên âm phrases: {len(phien_am_dict):,}")
+    if conflicts:
+        print(f"  ⚠️  Found {len(conflicts):,} phrases with multiple language labels")
+
+    proper_nouns = load_proper_nouns(os.path.join(thuvien_dir, PROPER_NOUN_FILE))
+    print(f"  ✅ Proper nouns: {len(proper_nouns):,}")
+
+    hanviet_set = load_word_set(os.path.join(thuvien_dir, HANVIET_FILE))
+    print(f"  ✅ Hán-Việt words: {len(hanviet_set):,}")
+
+    vietnamese_set, vietnamese_source = load_vietnamese_set(os.path.join(thuvien_dir, VIETNAMESE_FILE))
+    print(f"  ✅ Vietnamese words: {len(vietnamese_set):,}")
+
+    english_set = load_english_set(os.path.join(thuvien_dir, ENGLISH_FILE), nltk_data_dir)
+    print(f"  ✅ English entries: {len(english_set):,}")
+
+    llm_labels = load_llm_labels(os.path.join(thuvien_dir, LLM_LABELS_FILE))
+    if llm_labels:
+        print(f"  ✅ LLM vocabulary labels: {len(llm_labels):,}")
+
+    return FusedLabeler(phien_am_dict, proper_nouns, hanviet_set, vietnamese_set, english_set, llm_labels,
+                        vietnamese_source=vietnamese_source)
+
+
+# =========================
+# COLUMN EXTRACTION
+# =========================
+def join_label(tokens: List[Tuple[str, str]], label: str) -> str:
+    words = [token for token, lbl in tokens if lbl == label]
+    return ' | '.join(words) if words else ''
+
+
+def label_dataframe(df: pd.DataFrame, labeler: FusedLabeler, text_col: str = "lyrics",
+                    workers: int = 1, chunk_size: int = CHUNK_SIZE) -> pd.DataFrame:
+    """
+    Label every song and add the same columns as steps 3A-3E:
+    labeled_tokens, phien_am_<lang>, num_unlabeled, proper_nouns,
+    hanviet_words, vietnamese_words, english_words
+    workers > 1 labels chunks in a process pool (row order is preserved).
+    """
+    print(f"\n{'='*70}")
+    print(f"🚀 Starting fused labeling for {len(df):,} rows ({workers} worker(s))...")
+    print(f"{'='*70}\n")
+
+    texts = df[text_col].tolist()
+    start_time = time.time()
+
+    if workers > 1:
+        labeled_results = label_texts_parallel(texts, labeler, workers, chunk_size)
+    else:
+        labeled_results = []
+        progress = Progress(len(texts))
+        for text in texts:
+            labeled_results.append(labeler.label(text))
+            progress.update(1)
+
+    total_time = time.time() - start_time
+
+    add_label_columns(df, labeled_results)
+
+    print(f"\n✨ FUSED LABELING COMPLETE in {total_time:.2f}s")
+    return df
+
+
+class Progress:
+    """rows/s + ETA log lines, printed every log_interval rows"""
+
+    def __init__(self, total: int):
+        self.total = total
+        self.done = 0
+        self.log_interval = min(500, max(1, total // 10))
+        self.next_log = self.log_interval
+        self.start_time = time.time()
+
+    def update(self, n: int):
+        self.done += n
+        if self.done >= self.next_log or self.done == self.total:
+            while self.next_log <= self.done:
+                self.next_log += self.log_interval
+            i, total = self.done, self.total
+            elapsed = time.time() - self.start_time
+            speed = i / elapsed if elapsed > 0 else 0
+            progress = (i / total) * 100
+            eta = (total - i) / speed if speed > 0 else 0
+            print(f"✅ {i:,}/{total:,} ({progress:.1f}%) | {speed:.0f} rows/s | ETA: {eta:.0f}s")
+
+
+# =========================
+# PARALLEL RUNNER
+# =========================
+# Each worker keeps one labeler in this global. With 'fork' it is inherited
+# from the parent for free; otherwise (macOS/Windows 'spawn') it is sent once
+# per worker through the pool initializer, never once per task.
+_WORKER_LABELER: Optional[FusedLabeler] = None
+
+
+def _init_worker(labeler: Optional[FusedLabeler]):
+    global _WORKER_LABELER
+    if labeler is not None:
+        _WORKER_LABELER = labeler
+
+
+def _label_chunk(task: Tuple[int, list]) -> Tuple[int, List[List[Tuple[str, str]]]]:
+    chunk_id, texts = task
+    return chunk_id, [_WORKER_LABELER.label(text) for text in texts]
+
+
+def label_texts_parallel(texts: list, labeler: FusedLabeler, workers: Optional[int] = None,
+                         chunk_size: int = CHUNK_SIZE) -> List[List[Tuple[str, str]]]:
+    """Label texts in a process pool; results come back in input order"""
+    global _WORKER_LABELER
+    workers = workers or os.cpu_count() or 1
+    total = len(texts)
+    tasks = [(chunk_id, texts[start:start + chunk_size])
+             for chunk_id, start in enumerate(range(0, total, chunk_size))]
+
+    if "fork" in mp.get_all_start_methods():
+        ctx = mp.get_context("fork")
+        _WORKER_LABELER = labeler
+        init_arg = None
+    else:
+        ctx = mp.get_context("spawn")
+        init_arg = labeler
+
+    chunks = [None] * len(tasks)
+    progress = Progress(total)
+    try:
+        with ctx.Pool(workers, initializer=_init_worker, initargs=(init_arg,)) as pool:
+            for chunk_id, results in pool.imap_unordered(_label_chunk, tasks):
+                chunks[chunk_id] = results
+                progress.update(len(results))
+    finally:
+        _WORKER_LABELER = None
+
+    return [tokens for chunk in chunks for tokens in chunk]
+
+
+def add_label_columns(df: pd.DataFrame, labeled_results: List[List[Tuple[str, str]]]) -> pd.DataFrame:
+    """Attach labeled_tokens and the per-label extraction columns to df"""
+    df["labeled_tokens"] = labeled_results
+
+    # phien_am_* columns only for languages that actually occur (as in 3A)
+    foreign_labels = set()
+    for tokens in labeled_results:
+        foreign_labels.update(label for _, label in tokens if label.startswith('FOREIGN_'))
+
+    for label in sorted(foreign_labels):
+        language = label.replace('FOREIGN_', '').lower()
+        df[f"phien_am_{language}"] = [join_label(tokens, label) for tokens in labeled_results]
+
+    df['num_unlabeled'] = [sum(1 for _, label in tokens if label == 'UNLABELED')
+                           for tokens in labeled_results]
+    df['proper_nouns'] = [join_label(tokens, 'PROPER_NOUN') for tokens in labeled_results]
+    df['hanviet_words'] = [join_label(tokens, 'HANVIET') for tokens in labeled_results]
+    df['vietnamese_words'] = [join_label(tokens, 'VIETNAMESE') for tokens in labeled_results]
+    df['english_words'] = [join_label(tokens, 'ENGLISH') for tokens in labeled_results]
+    return df
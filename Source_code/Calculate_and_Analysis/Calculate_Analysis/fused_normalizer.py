@@ -0,0 +1,302 @@
+"""
+fused_normalizer.py
+Streaming replacement for steps 1-2 in calculate.ipynb
+(normalize_lyrics -> final_dataset_step1_teencode.csv -> clean_noise).
+
+Both steps run per song in a fixed number of linear passes:
+    NFKC -> confusables (str.translate) -> repeat-collapse -> punctuation noise
+    -> teencode (Aho-Corasick) -> whitespace
+    -> phrase noise (Aho-Corasick) -> word noise (Aho-Corasick) -> whitespace
+The teencode / word-noise regexes are alternations of thousands of keys that
+`re` tries one by one at every position; here one automaton scan finds every
+candidate and the regex rules (leftmost, longest, `(?<!\\w)...(?!\\w)`) are
+applied to the candidates. The dataset is processed in chunks and no
+intermediate CSV is written. Lyrics come out identical to the two steps.
+
+Usage (from calculate.ipynb):
+    from fused_normalizer import load_normalizer, normalize_csv
+    normalizer = load_normalizer(THUVIEN_DIR)
+    normalize_csv(INPUT_CSV, OUTPUT_CSV, normalizer)
+"""
+
+import os
+import re
+import time
+import unicodedata
+from typing import Dict, List, Optional, Tuple
+
+import ahocorasick
+import pandas as pd
+
+# ----------------- CONFIG -----------------
+THUVIEN_DIR = "/Users/copy/Downloads/TDTU/Labeling/thuvien"
+TEENCODE_FILE = "teencode.csv"
+NOISE_FILE = "noise.csv"
+
+CHUNK_SIZE = 5000   # rows per CSV chunk
+
+CONFUSABLE_MAP = {
+    "Σ": "c",
+    "Ɓ": "B",
+    "Ɲ": "N",
+    "Ɛ": "E",
+    "Ɗ": "D",
+    "Ŋ": "N",
+    "Ļ": "L",
+    "Ĭ": "I",
+    "Ƭ": "T",
+    "Ѵ": "V",
+}
+
+# strings pandas reads back as NaN; step 2 re-read step 1's CSV, so a lyric
+# that normalized to one of these reached clean_noise as NaN
+CSV_NA_VALUES = {
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan',
+    '1.#IND', '1.#QNAN', '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a',
+    'nan', 'null'
+}
+# ------------------------------------------
+
+CONFUSABLE_TABLE = str.maketrans(CONFUSABLE_MAP)
+REPEATED_CHARS_RE = re.compile(r'(.)\1{2,}')
+# the three step-1 noise regexes touch disjoint characters -> one alternation
+PUNCT_NOISE_RE = re.compile(r"\.{2,}|[:()\-–—]|,{2,}")
+SPACES_RE = re.compile(r"\s+")
+
+_FOLD_SPECIAL_RE = None
+
+
+def _fold_special_re():
+    """Characters that re.IGNORECASE folds differently from str.lower()"""
+    global _FOLD_SPECIAL_RE
+    if _FOLD_SPECIAL_RE is None:
+        chars = [chr(c) for c in range(0x110000) if chr(c).upper().lower() != chr(c).lower()]
+        _FOLD_SPECIAL_RE = re.compile('[' + ''.join(map(re.escape, chars)) + ']')
+    return _FOLD_SPECIAL_RE
+
+
+def _is_word(ch: str) -> bool:
+    # same definition as re's \w for str patterns
+    return ch.isalnum() or ch == '_'
+
+
+# =========================
+# BOUNDED MULTI-PATTERN MATCHER
+# =========================
+class BoundaryMatcher:
+    """
+    Equivalent of re.compile(r'(?<!\\w)(k1|k2|...)(?!\\w)') with keys sorted
+    longest first, backed by one Aho-Corasick automaton.
+    """
+
+    def __init__(self, keys: List[str], ignore_case: bool = False):
+        self.ignore_case = ignore_case
+        self.regex = re.compile(
+            r'(?<!\w)(' + '|'.join(map(re.escape, sorted(keys, key=len, reverse=True))) + r')(?!\w)',
+            flags=re.UNICODE | (re.IGNORECASE if ignore_case else 0)
+        )
+
+        # with IGNORECASE, keys that re folds specially stay on the regex path
+        self.use_automaton = not (ignore_case and any(
+            len(k.lower()) != len(k) or _fold_special_re().search(k) for k in keys))
+
+        self.automaton = ahocorasick.Automaton()
+        for k in keys:
+            if k:
+                key = k.lower() if ignore_case else k
+                self.automaton.add_word(key, len(key))
+        if len(self.automaton):
+            self.automaton.make_automaton()
+        else:
+            self.use_automaton = False
+
+    def finditer(self, text: str) -> List[Tuple[int, int]]:
+        """Non-overlapping (start, end) spans, same as regex.finditer"""
+        search_text = text
+        if self.ignore_case:
+            search_text = text.lower()
+            if len(search_text) != len(text) or _fold_special_re().search(text):
+                return [m.span() for m in self.regex.finditer(text)]
+
+        if not self.use_automaton:
+            return [m.span() for m in self.regex.finditer(text)]
+
+        n = len(text)
+        longest = {}
+        for end, length in self.automaton.iter(search_text):
+            start = end - length + 1
+            if start > 0 and _is_word(text[start - 1]):
+                continue
+            if end + 1 < n and _is_word(text[end + 1]):
+                continue
+            if length > longest.get(start, 0):
+                longest[start] = length
+
+        spans = []
+        pos = 0
+        for start in sorted(longest):
+            if start >= pos:
+                pos = start + longest[start]
+                spans.append((start, pos))
+        return spans
+
+    def sub(self, text: str, repl) -> str:
+        """repl: replacement string or function(matched_text) -> str"""
+        spans = self.finditer(text)
+        if not spans:
+            return text
+        pieces = []
+        pos = 0
+        for start, end in spans:
+            pieces.append(text[pos:start])
+            pieces.append(repl(text[start:end]) if callable(repl) else repl)
+            pos = end
+        pieces.append(text[pos:])
+        return ''.join(pieces)
+
+
+class OrderedReplacer:
+    """
+    Equivalent of `for p in phrases: text = text.replace(p, " ")`.
+    Only phrases present in the current text change it, so each scan jumps to
+    the next present phrase (in list order) instead of trying all of them.
+    """
+
+    def __init__(self, phrases: List[str], repl: str = " "):
+        self.phrases = phrases
+        self.repl = repl
+        # '' matches everywhere; keep str.replace semantics for it
+        self.always = [i for i, p in enumerate(phrases) if not p]
+        self.automaton = ahocorasick.Automaton()
+        for i, p in enumerate(phrases):
+            if p:
+                self.automaton.add_word(p, i)
+        if len(self.automaton):
+            self.automaton.make_automaton()
+
+    def _next_present(self, text: str, first: int) -> Optional[int]:
+        best = None
+        if len(self.automaton):
+            for _, i in self.automaton.iter(text):
+                if i >= first and (best is None or i < best):
+                    best = i
+        for i in self.always:
+            if i >= first and (best is None or i < best):
+                best = i
+                break
+        return best
+
+    def replace(self, text: str) -> str:
+        i = self._next_present(text, 0)
+        while i is not None:
+            text = text.replace(self.phrases[i], self.repl)
+            i = self._next_present(text, i + 1)
+        return text
+
+
+# =========================
+# FUSED NORMALIZER
+# =========================
+class FusedNormalizer:
+    """normalize_lyrics (step 1) + clean_noise (step 2) in one call."""
+
+    def __init__(self, teencode_map: Dict[str, str], word_noise: List[str], phrase_noise: List[str]):
+        self.teencode_map = teencode_map
+        self.teencode = BoundaryMatcher(list(teencode_map.keys()))
+        self.phrase_noise = OrderedReplacer(phrase_noise)
+        self.word_noise = BoundaryMatcher(word_noise, ignore_case=True)
+
+    def normalize_lyrics(self, text):
+        """Step 1"""
+        if not isinstance(text, str):
+            return text
+
+        text = unicodedata.normalize("NFKC", text)
+        text = text.translate(CONFUSABLE_TABLE)
+        text = REPEATED_CHARS_RE.sub(r'\1', text)
+        text = PUNCT_NOISE_RE.sub(" ", text)
+        text = self.teencode.sub(text, self.teencode_map.__getitem__)
+        return SPACES_RE.sub(" ", text).strip()
+
+    def clean_noise(self, text):
+        """Step 2"""
+        if not isinstance(text, str):
+            return text
+
+        text = self.phrase_noise.replace(text)
+        text = self.word_noise.sub(text, " ")
+        return SPACES_RE.sub(" ", text).strip()
+
+    def normalize(self, text):
+        text = self.normalize_lyrics(text)
+        if isinstance(text, str) and text in CSV_NA_VALUES:
+            return float('nan')
+        return self.clean_noise(text)
+
+
+def split_noise(noise_list: List[str]) -> Tuple[List[str], List[str]]:
+    """Same word / phrase split as step 2"""
+    word_noise = []
+    phrase_noise = []
+
+    for n in noise_list:
+        if len(n.split()) == 1 and len(n) <= 15:
+            word_noise.append(n.lower())
+        else:
+            phrase_noise.append(n)
+
+    return word_noise, phrase_noise
+
+
+def load_normalizer(thuvien_dir: str = THUVIEN_DIR) -> FusedNormalizer:
+    teencode_df = pd.read_csv(os.path.join(thuvien_dir, TEENCODE_FILE))
+    noise_df = pd.read_csv(os.path.join(thuvien_dir, NOISE_FILE))
+
+    mapping = dict(zip(teencode_df["teen_code"], teencode_df["standard"]))
+
+    noise_list = (
+        noise_df["noise"]
+        .dropna()
+        .astype(str)
+        .str.strip()
+        .unique()
+        .tolist()
+    )
+    word_noise, phrase_noise = split_noise(noise_list)
+
+    print(f"✅ Teencode: {len(mapping):,} | Word noise: {len(word_noise):,} | "
+          f"Phrase noise: {len(phrase_noise):,}")
+    return FusedNormalizer(mapping, word_noise, phrase_noise)
+
+
+# =========================
+# STREAMING CSV
+# =========================
+def normalize_csv(input_path: str, output_path: str, normalizer: FusedNormalizer,
+                  text_col: str = "lyrics", chunksize: int = CHUNK_SIZE) -> int:
+    """
+    Read input_path in chunks, normalize text_col and append to output_path.
+    Other columns are read as text and written back unchanged.
+    """
+    print(f"\n{'='*70}")
+    print(f"🚀 STEP 1-2: FUSED NORMALIZATION")
+    print(f"{'='*70}\n")
+
+    tmp_path = output_path + ".tmp"
+    total = 0
+    start_time = time.time()
+
+    for chunk_id, chunk in enumerate(pd.read_csv(input_path, dtype=str, chunksize=chunksize)):
+        chunk[text_col] = [normalizer.normalize(text) for text in chunk[text_col]]
+        chunk.to_csv(tmp_path, mode="w" if chunk_id == 0 else "a",
+                     header=chunk_id == 0, index=False)
+
+        total += len(chunk)
+        elapsed = time.time() - start_time
+        speed = total / elapsed if elapsed > 0 else 0
+        print(f"✅ {total:,} rows | {speed:.0f} rows/s")
+
+    if total:
+        os.replace(tmp_path, output_path)
+    print(f"\n✨ Saved {total:,} rows to: {output_path} in {time.time() - start_time:.2f}s")
+    return total
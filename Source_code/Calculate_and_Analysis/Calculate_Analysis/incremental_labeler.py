@@ -0,0 +1,314 @@
+"""
+incremental_labeler.py
+Relabel only what changed since the last run.
+
+State kept next to the dataset (pickle):
+    song_hashes   md5 of every song's lyrics, by row position
+    song_words    lowercase clean words of every song; inverted on load into
+                  word_index (word -> rows), the reverse index used to find
+                  the songs a dictionary entry could match
+    dictionaries  snapshot of the labeler's phiên âm / proper noun / word / LLM tables
+    labeler_version  hash of the labeling code (fused_labeler.py, dict_bundle.py)
+
+A song is relabeled when it is new, its lyrics changed, or a dictionary entry
+that was added, removed or relabeled could match it (every word of the entry
+occurs in the song, looked up through word_index). When the labeling code
+changed since the last run every song is relabeled. The label columns of
+final_dataset_complete.csv (labeled_tokens, phien_am_*, *_words, num_*) are
+then patched in place for those rows only, and so are their rows of the
+token store (a store that does not match the last run is rebuilt from a
+full relabel). Artifacts derived from the store (token_index.db,
+analysis_matrices/) are deleted in the same step so they get rebuilt. New
+songs from a crawl are expected to be appended at the end of the dataset.
+
+Usage (from calculate.ipynb):
+    from incremental_labeler import update_labels
+    df = pd.read_csv(FINAL_CSV)
+    df = update_labels(df, labeler, STATE_PATH, store_dir=TOKEN_STORE_DIR,
+                       invalidate=[TOKEN_INDEX_PATH, MATRICES_DIR])
+    df.to_csv(FINAL_CSV, index=False)
+"""
+
+import hashlib
+import os
+import pickle
+import shutil
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+import pandas as pd
+
+import dict_bundle
+import fused_labeler
+from dict_bundle import hash_sources
+from fused_labeler import FusedLabeler, add_label_columns, clean_punctuation
+from token_store import TokenStore, load_labeled, song_keys
+
+STATE_FORMAT = 1
+# code the labels depend on, besides the dictionaries
+LABELER_CODE = [fused_labeler.__file__, dict_bundle.__file__]
+
+# count columns that can be recomputed from the tokens (patched when present)
+NUM_COLUMNS = {
+    'num_unlabeled': 'UNLABELED',
+    'num_proper_noun': 'PROPER_NOUN',
+    'num_hanviet': 'HANVIET',
+    'num_vietnamese': 'VIETNAMESE',
+    'num_english': 'ENGLISH',
+}
+
+
+def lyrics_hash(text) -> str:
+    if not isinstance(text, str):
+        return ''
+    return hashlib.md5(text.encode('utf-8')).hexdigest()
+
+
+def song_words(text) -> Set[str]:
+    """Lowercase clean words of a song (the keys every dictionary lookup uses)"""
+    if not isinstance(text, str):
+        return set()
+    words = set()
+    for w in text.split():
+        clean_word = clean_punctuation(w)[1].lower()
+        if clean_word:
+            words.add(clean_word)
+    return words
+
+
+def labeler_version() -> str:
+    return hash_sources(LABELER_CODE)
+
+
+def dictionary_snapshot(labeler: FusedLabeler) -> Dict[str, dict]:
+    return {
+        'phien_am': dict(labeler.phien_am_dict),
+        'proper_noun': {p: 'PROPER_NOUN' for p in labeler.proper_nouns},
+        'word': dict(labeler.word_label),
+        'llm': dict(labeler.llm_labels),
+    }
+
+
+def changed_entries(old: Dict[str, dict], new: Dict[str, dict]) -> Set[str]:
+    """Entries added, removed or relabeled in any dictionary"""
+    changed = set()
+    for name in new:
+        before, after = old.get(name, {}), new[name]
+        for key in before.keys() | after.keys():
+            if before.get(key) != after.get(key):
+                changed.add(key)
+    return changed
+
+
+class LabelState:
+    """Per-song hashes and word sets + dictionary snapshot and labeler version of the last run"""
+
+    def __init__(self):
+        self.song_hashes: List[str] = []
+        self.song_words: List[Set[str]] = []
+        self.dictionaries: Dict[str, dict] = {}
+        self.labeler_version: Optional[str] = None
+        self.word_index: Dict[str, Set[int]] = defaultdict(set)
+
+    @classmethod
+    def load(cls, path: str) -> "LabelState":
+        state = cls()
+        if not os.path.exists(path):
+            return state
+        with open(path, 'rb') as f:
+            data = pickle.load(f)
+        if data.get('format') != STATE_FORMAT:
+            return state
+        state.song_hashes = data['song_hashes']
+        state.song_words = data['song_words']
+        state.dictionaries = data['dictionaries']
+        state.labeler_version = data.get('labeler_version')    # missing in older states: full relabel
+        for row, words in enumerate(state.song_words):
+            for w in words:
+                state.word_index[w].add(row)
+        return state
+
+    def save(self, path: str):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({
+                'format': STATE_FORMAT,
+                'song_hashes': self.song_hashes,
+                'song_words': self.song_words,
+                'dictionaries': self.dictionaries,
+                'labeler_version': self.labeler_version,
+            }, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    def songs_matching(self, entry: str) -> Set[int]:
+        """Rows that contain every word of a dictionary entry"""
+        rows = None
+        for w in entry.lower().split(' '):
+            if not w:
+                continue
+            postings = self.word_index.get(w)
+            if not postings:
+                return set()
+            rows = set(postings) if rows is None else rows & postings
+            if not rows:
+                return set()
+        return rows or set()
+
+    def set_song(self, row: int, song_hash: str, text):
+        """Replace the hash / words of one row (appending new rows)"""
+        while len(self.song_hashes) <= row:
+            self.song_hashes.append('')
+            self.song_words.append(set())
+        for w in self.song_words[row]:
+            self.word_index[w].discard(row)
+        words = song_words(text)
+        for w in words:
+            self.word_index[w].add(row)
+        self.song_hashes[row] = song_hash
+        self.song_words[row] = words
+
+    def truncate(self, n_rows: int):
+        """Forget rows removed from the end of the dataset"""
+        for row in range(n_rows, len(self.song_hashes)):
+            for w in self.song_words[row]:
+                self.word_index[w].discard(row)
+        del self.song_hashes[n_rows:]
+        del self.song_words[n_rows:]
+
+
+def find_dirty_rows(df: pd.DataFrame, labeler: FusedLabeler, state: LabelState,
+                    text_col: str = "lyrics",
+                    version: Optional[str] = None) -> Tuple[List[int], List[str], Dict[str, dict]]:
+    """Row positions to relabel, the new song hashes and the new dictionary snapshot"""
+    new_hashes = [lyrics_hash(text) for text in df[text_col]]
+    new_dicts = dictionary_snapshot(labeler)
+
+    if not state.dictionaries:
+        return list(range(len(df))), new_hashes, new_dicts
+    if state.labeler_version != (version or labeler_version()):
+        print("  ⚠️ Labeling code changed since the last run: relabeling every row")
+        return list(range(len(df))), new_hashes, new_dicts
+
+    dirty = set()
+    old_hashes = state.song_hashes
+    for row, h in enumerate(new_hashes):
+        if row >= len(old_hashes) or old_hashes[row] != h:
+            dirty.add(row)
+
+    entries = changed_entries(state.dictionaries, new_dicts)
+    for entry in entries:
+        dirty.update(r for r in state.songs_matching(entry) if r < len(df))
+
+    print(f"  📝 Songs new/edited: {sum(1 for r in dirty if r >= len(old_hashes) or old_hashes[r] != new_hashes[r]):,}")
+    print(f"  📚 Dictionary entries changed: {len(entries):,}")
+    return sorted(dirty), new_hashes, new_dicts
+
+
+def store_in_sync(store: Optional[TokenStore], state: LabelState) -> bool:
+    """True when the token store holds the songs of the last run (same lyrics, same rows)"""
+    if store is None or store.song_keys is None or not state.dictionaries:
+        return False
+    old_keys = np.asarray([int(h[:16], 16) if h else 0 for h in state.song_hashes], dtype=np.uint64)
+    return np.array_equal(old_keys, store.song_keys)
+
+
+def invalidate_paths(paths: Sequence[str]):
+    """Delete artifacts built from the old labels (files or directories)"""
+    for path in paths:
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+        else:
+            continue
+        print(f"  🗑️ Invalidated {path}")
+
+
+def update_labels(df: pd.DataFrame, labeler: FusedLabeler, state_path: str,
+                  text_col: str = "lyrics", store_dir: Optional[str] = None,
+                  invalidate: Sequence[str] = ()) -> pd.DataFrame:
+    """
+    Relabel new/edited/affected songs and patch their label columns in df,
+    their rows of the token store in store_dir, and delete the invalidate paths
+    """
+    print(f"\n{'='*70}")
+    print(f"🔄 INCREMENTAL RELABELING")
+    print(f"{'='*70}\n")
+
+    start_time = time.time()
+    state = LabelState.load(state_path)
+    version = labeler_version()
+    dirty, new_hashes, new_dicts = find_dirty_rows(df, labeler, state, text_col, version)
+
+    store = None
+    if store_dir is not None:
+        # mmap=False: the store files are overwritten below
+        store = load_labeled(store_dir, mmap=False)
+        if not store_in_sync(store, state):
+            print("  ⚠️ Token store missing or out of sync with the last run: relabeling every row")
+            store = None
+            dirty = list(range(len(df)))
+    print(f"  🎯 Rows to relabel: {len(dirty):,}/{len(df):,}")
+
+    results = []
+    if dirty:
+        texts = df[text_col].iloc[dirty].tolist()
+        results = [labeler.label(text) for text in texts]
+
+        patch = pd.DataFrame(index=df.index[dirty])
+        add_label_columns(patch, results)
+        patch['labeled_tokens'] = [str(tokens) for tokens in results]
+
+        for col, label in NUM_COLUMNS.items():
+            if col in df.columns:
+                patch[col] = [sum(1 for _, lbl in tokens if lbl == label) for tokens in results]
+        foreign_labels = set(labeler.phien_am_dict.values())
+        for col in df.columns:
+            if col.startswith('phien_am_') and col not in patch.columns:
+                # language no longer present in any relabeled row
+                patch[col] = ''
+            if col.startswith('num_foreign_'):
+                label = 'FOREIGN_' + col[len('num_foreign_'):].upper()
+                if label in foreign_labels:
+                    patch[col] = [sum(1 for _, lbl in tokens if lbl == label) for tokens in results]
+        if 'total_non_punct' in df.columns:
+            patch['total_non_punct'] = [sum(1 for _, lbl in tokens if lbl != 'PUNCT') for tokens in results]
+
+        for col in patch.columns:
+            if pd.api.types.is_numeric_dtype(patch[col]):
+                if col not in df.columns:
+                    df[col] = 0
+                df[col] = pd.to_numeric(df[col], errors='coerce').astype('float64')
+                df.loc[patch.index, col] = patch[col]
+                if df[col].notna().all():
+                    df[col] = df[col].astype('int64')
+            else:
+                if col not in df.columns:
+                    # language seen for the first time
+                    df[col] = ''
+                df[col] = df[col].astype(object)
+                df.loc[patch.index, col] = patch[col]
+
+    if store_dir is not None and (store is None or dirty or len(store) != len(df)):
+        if store is None:
+            store = TokenStore.from_labeled(results, texts=df[text_col])
+        else:
+            store = store.replace_songs(dict(zip(dirty, results)), keys=song_keys(df[text_col]))
+        store.save(store_dir)
+        print(f"  💾 Token store: {len(dirty):,} songs patched | {len(store):,} songs in {store_dir}")
+    if dirty or len(df) != len(state.song_hashes):
+        invalidate_paths(invalidate)
+
+    # refresh hashes / reverse index for rows whose lyrics changed
+    state.truncate(len(df))
+    for row, h in enumerate(new_hashes):
+        if row >= len(state.song_hashes) or state.song_hashes[row] != h:
+            state.set_song(row, h, df[text_col].iat[row])
+    state.dictionaries = new_dicts
+    state.labeler_version = version
+    state.save(state_path)
+
+    print(f"\n✨ Relabeled {len(dirty):,} rows in {time.time() - start_time:.2f}s")
+    return df
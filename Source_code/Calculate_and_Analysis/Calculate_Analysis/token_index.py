@@ -0,0 +1,279 @@
+"""
+token_index.py
+On-disk inverted index over the labeled corpus (SQLite).
+
+    tokens(token_id, token)                       lowercase token / phrase
+    postings(token_id, song_id, position, label_id)
+    songs(song_id, title, year, period, genres, composers)
+    song_genres(song_id, genre) / song_composers(song_id, composer)
+
+song_id is the row position in the dataset the index was built from;
+position is the token position inside the song's labeled_tokens
+(PUNCT tokens are not indexed).
+
+Usage:
+    build_index(df, "token_index.db")              # df has labeled_tokens
+    idx = TokenIndex("token_index.db")
+    idx.search("oppa", period="2010-2015", genre="Nhạc Trẻ")
+    idx.search("sa rang he", year_from=2005, composer="Khắc Việt")
+"""
+
+import ast
+import os
+import sqlite3
+import time
+from typing import Iterable, List, Optional, Tuple
+
+import pandas as pd
+
+BATCH_SIZE = 200_000   # postings per executemany
+
+
+def parse_list(x) -> List[str]:
+    """Same parsing as analysis.ipynb (genres / composers are stored as list strings)"""
+    if pd.isna(x): return []
+    if isinstance(x, list): return x
+    s = str(x).strip()
+    try:
+        v = ast.literal_eval(s)
+        return v if isinstance(v, list) else [v]
+    except:
+        return [t.strip() for t in s.split(",") if t.strip()]
+
+
+def parse_labeled_tokens(token_str) -> List[Tuple[str, str]]:
+    if isinstance(token_str, list):
+        return token_str
+    if pd.isna(token_str) or not token_str:
+        return []
+    try:
+        return ast.literal_eval(token_str)
+    except:
+        return []
+
+
+def norm(s) -> str:
+    return str(s).strip().lower()
+
+
+def _to_year(x) -> Optional[int]:
+    y = pd.to_numeric(x, errors="coerce")
+    return None if pd.isna(y) else int(y)
+
+
+# =========================
+# BUILD
+# =========================
+SCHEMA = """
+CREATE TABLE tokens (token_id INTEGER PRIMARY KEY, token TEXT UNIQUE NOT NULL);
+CREATE TABLE labels (label_id INTEGER PRIMARY KEY, label TEXT UNIQUE NOT NULL);
+CREATE TABLE postings (
+    token_id INTEGER NOT NULL,
+    song_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    label_id INTEGER NOT NULL,
+    PRIMARY KEY (token_id, song_id, position)
+) WITHOUT ROWID;
+CREATE TABLE songs (
+    song_id INTEGER PRIMARY KEY,
+    title TEXT, year INTEGER, period TEXT, genres TEXT, composers TEXT
+);
+CREATE TABLE song_genres (song_id INTEGER NOT NULL, genre TEXT NOT NULL);
+CREATE TABLE song_composers (song_id INTEGER NOT NULL, composer TEXT NOT NULL);
+"""
+
+INDEXES = """
+CREATE INDEX idx_songs_year ON songs(year);
+CREATE INDEX idx_songs_period ON songs(period);
+CREATE INDEX idx_song_genres ON song_genres(genre, song_id);
+CREATE INDEX idx_song_composers ON song_composers(composer, song_id);
+"""
+
+
+def build_index(df: pd.DataFrame, db_path: str,
+                labeled_tokens: Optional[Iterable[List[Tuple[str, str]]]] = None) -> str:
+    """
+    Build the index from df (title/year/period/genres/composers columns)
+    and its labeled tokens (df["labeled_tokens"] or e.g. TokenStore.iter_songs()).
+    """
+    print(f"\n{'='*70}")
+    print(f"🔨 BUILDING TOKEN INDEX for {len(df):,} songs")
+    print(f"{'='*70}\n")
+
+    if labeled_tokens is None:
+        labeled_tokens = (parse_labeled_tokens(x) for x in df["labeled_tokens"])
+
+    tmp_path = db_path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    conn = sqlite3.connect(tmp_path)
+    conn.execute("PRAGMA journal_mode=OFF")
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.executescript(SCHEMA)
+
+    start_time = time.time()
+    token_ids = {}
+    label_ids = {}
+    postings = []
+    total = len(df)
+    log_interval = min(5000, max(1, total // 10))
+
+    def col(name):
+        return df[name].tolist() if name in df.columns else [None] * total
+
+    meta = zip(col("title"), col("year"), col("period"), col("genres"), col("composers"))
+
+    for song_id, (tokens, (title, year, period, genres, composers)) in enumerate(zip(labeled_tokens, meta)):
+        genre_list = [norm(g) for g in parse_list(genres) if str(g).strip()]
+        composer_list = [norm(c) for c in parse_list(composers) if str(c).strip()]
+        conn.execute(
+            "INSERT INTO songs VALUES (?, ?, ?, ?, ?, ?)",
+            (song_id, None if pd.isna(title) else str(title), _to_year(year),
+             None if pd.isna(period) else str(period),
+             " | ".join(genre_list), " | ".join(composer_list))
+        )
+        conn.executemany("INSERT INTO song_genres VALUES (?, ?)", [(song_id, g) for g in set(genre_list)])
+        conn.executemany("INSERT INTO song_composers VALUES (?, ?)", [(song_id, c) for c in set(composer_list)])
+
+        for position, (token, label) in enumerate(tokens):
+            if label == 'PUNCT':
+                continue
+            key = token.lower()
+            tid = token_ids.get(key)
+            if tid is None:
+                tid = token_ids[key] = len(token_ids)
+            lid = label_ids.get(label)
+            if lid is None:
+                lid = label_ids[label] = len(label_ids)
+            postings.append((tid, song_id, position, lid))
+
+        if len(postings) >= BATCH_SIZE:
+            conn.executemany("INSERT INTO postings VALUES (?, ?, ?, ?)", postings)
+            postings = []
+
+        i = song_id + 1
+        if i % log_interval == 0 or i == total:
+            elapsed = time.time() - start_time
+            speed = i / elapsed if elapsed > 0 else 0
+            print(f"✅ {i:,}/{total:,} ({i / total * 100:.1f}%) | {speed:.0f} rows/s")
+
+    conn.executemany("INSERT INTO postings VALUES (?, ?, ?, ?)", postings)
+    conn.executemany("INSERT INTO tokens VALUES (?, ?)", ((tid, t) for t, tid in token_ids.items()))
+    conn.executemany("INSERT INTO labels VALUES (?, ?)", ((lid, l) for l, lid in label_ids.items()))
+    conn.executescript(INDEXES)
+    conn.commit()
+    conn.close()
+    os.replace(tmp_path, db_path)
+
+    print(f"\n✨ Index: {len(token_ids):,} distinct tokens | saved to {db_path} "
+          f"in {time.time() - start_time:.2f}s")
+    return db_path
+
+
+# =========================
+# QUERY
+# =========================
+class TokenIndex:
+    def __init__(self, db_path: str):
+        self.conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, check_same_thread=False)
+
+    def close(self):
+        self.conn.close()
+
+    def _token_id(self, token: str) -> Optional[int]:
+        row = self.conn.execute("SELECT token_id FROM tokens WHERE token = ?", (token,)).fetchone()
+        return row[0] if row else None
+
+    def _postings(self, term: str) -> List[Tuple[int, int, int, int]]:
+        """(song_id, position, length, label_id) for a token, or a phrase of consecutive tokens"""
+        term = " ".join(norm(term).split())
+        tid = self._token_id(term)
+        if tid is not None:
+            return [(s, p, 1, l) for s, p, l in self.conn.execute(
+                "SELECT song_id, position, label_id FROM postings WHERE token_id = ?", (tid,))]
+
+        # phrase spread over several tokens: positions must be consecutive
+        words = term.split()
+        if len(words) < 2:
+            return []
+        ids = [self._token_id(w) for w in words]
+        if any(i is None for i in ids):
+            return []
+        hits = {(s, p): l for s, p, l in self.conn.execute(
+            "SELECT song_id, position, label_id FROM postings WHERE token_id = ?", (ids[0],))}
+        for offset, tid in enumerate(ids[1:], start=1):
+            nxt = {(s, p) for s, p in self.conn.execute(
+                "SELECT song_id, position FROM postings WHERE token_id = ?", (tid,))}
+            hits = {k: l for k, l in hits.items() if (k[0], k[1] + offset) in nxt}
+            if not hits:
+                return []
+        return [(s, p, len(ids), l) for (s, p), l in hits.items()]
+
+    def _filter_songs(self, year_from=None, year_to=None, period=None,
+                      genre=None, composer=None) -> Optional[set]:
+        clauses, params = [], []
+        if year_from is not None:
+            clauses.append("year >= ?"); params.append(int(year_from))
+        if year_to is not None:
+            clauses.append("year <= ?"); params.append(int(year_to))
+        if period is not None:
+            clauses.append("period = ?"); params.append(str(period))
+        if genre is not None:
+            clauses.append("song_id IN (SELECT song_id FROM song_genres WHERE genre = ?)")
+            params.append(norm(genre))
+        if composer is not None:
+            clauses.append("song_id IN (SELECT song_id FROM song_composers WHERE composer = ?)")
+            params.append(norm(composer))
+        if not clauses:
+            return None
+        sql = "SELECT song_id FROM songs WHERE " + " AND ".join(clauses)
+        return {row[0] for row in self.conn.execute(sql, params)}
+
+    def search(self, term: str, year_from: Optional[int] = None, year_to: Optional[int] = None,
+               period: Optional[str] = None, genre: Optional[str] = None,
+               composer: Optional[str] = None, label: Optional[str] = None) -> pd.DataFrame:
+        """
+        Songs containing term (token or phrase), one row per song:
+        song_id, title, year, period, genres, composers, count, positions, labels
+        """
+        hits = self._postings(term)
+        allowed = self._filter_songs(year_from, year_to, period, genre, composer)
+        label_names = dict(self.conn.execute("SELECT label_id, label FROM labels"))
+
+        by_song = {}
+        for song_id, position, _, label_id in hits:
+            if allowed is not None and song_id not in allowed:
+                continue
+            if label is not None and label_names[label_id] != label:
+                continue
+            by_song.setdefault(song_id, []).append((position, label_names[label_id]))
+
+        columns = ["song_id", "title", "year", "period", "genres", "composers",
+                   "count", "positions", "labels"]
+        if not by_song:
+            return pd.DataFrame(columns=columns)
+
+        ids = sorted(by_song)
+        meta = {}
+        for start in range(0, len(ids), 900):
+            chunk = ids[start:start + 900]
+            sql = ("SELECT song_id, title, year, period, genres, composers FROM songs "
+                   f"WHERE song_id IN ({','.join('?' * len(chunk))})")
+            for row in self.conn.execute(sql, chunk):
+                meta[row[0]] = row[1:]
+
+        rows = []
+        for song_id in ids:
+            occ = sorted(by_song[song_id])
+            rows.append((song_id, *meta[song_id], len(occ),
+                         [p for p, _ in occ], sorted({l for _, l in occ})))
+        return pd.DataFrame(rows, columns=columns)
+
+    def count_by(self, term: str, by: str = "year", **filters) -> pd.DataFrame:
+        """Number of songs containing term per year / period / genre / composer"""
+        res = self.search(term, **filters)
+        if by in ("genre", "composer"):
+            col = by + "s"
+            res = res.assign(**{by: res[col].str.split(" | ", regex=False)}).explode(by)
+        return res.groupby(by).size().rename("n_songs").reset_index()
@@ -0,0 +1,311 @@
+"""
+token_store.py
+Columnar storage for labeled token streams.
+
+Instead of writing `labeled_tokens` as the repr of a list of tuples into CSV
+(and reading it back with ast.literal_eval), a labeled dataset is stored as:
+
+    token_store/
+        vocab.txt       interned tokens, one per line (line number = token id)
+        labels.txt      label enum, one per line (line number = label id)
+        token_ids.npy   int32  [total_tokens]   token id of every token
+        label_ids.npy   uint8  [total_tokens]   label id of every token
+        offsets.npy     int64  [n_songs + 1]    song i = tokens[offsets[i]:offsets[i+1]]
+        song_keys.npy   uint64 [n_songs]        md5 prefix of each song's lyrics (0 = none)
+        meta.json       dataset_hash (hash of song_keys) of the dataset the store was built from
+
+The .npy arrays are opened with mmap_mode='r', so reading is zero-copy and
+statistics can be computed directly on the arrays. song_keys tie every song
+to a row of the dataset: a CSV whose lyrics hash to the same keys (same
+order) is the one the store was built from.
+
+Usage:
+    store = TokenStore.from_labeled(labeled_results, texts=df["lyrics"])
+    store.save(TOKEN_STORE_DIR)
+
+    store = TokenStore.open(TOKEN_STORE_DIR)
+    store.matches(df["lyrics"])         # built from this dataset?
+    tokens = store.song(0)              # [(token, label), ...]
+    counts = store.label_counts()       # [n_songs, n_labels]
+"""
+
+import hashlib
+import json
+import os
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+# Fixed label ids; FOREIGN_* labels are appended in sorted order when found
+BASE_LABELS = ['PUNCT', 'UNLABELED', 'PROPER_NOUN', 'HANVIET', 'VIETNAMESE', 'ENGLISH']
+
+VOCAB_FILE = "vocab.txt"
+LABELS_FILE = "labels.txt"
+TOKEN_IDS_FILE = "token_ids.npy"
+LABEL_IDS_FILE = "label_ids.npy"
+OFFSETS_FILE = "offsets.npy"
+SONG_KEYS_FILE = "song_keys.npy"
+META_FILE = "meta.json"
+STORE_FILES = (VOCAB_FILE, LABELS_FILE, TOKEN_IDS_FILE, LABEL_IDS_FILE, OFFSETS_FILE, SONG_KEYS_FILE)
+
+
+def _write_lines(path: str, items: List[str]):
+    with open(path, "w", encoding="utf-8") as f:
+        for item in items:
+            f.write(item + "\n")
+
+
+def _read_lines(path: str) -> List[str]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [line.rstrip("\n") for line in f]
+
+
+def song_key(text) -> int:
+    """First 8 bytes of the md5 of a song's lyrics (same md5 as incremental_labeler)"""
+    if not isinstance(text, str):
+        return 0
+    return int(hashlib.md5(text.encode("utf-8")).hexdigest()[:16], 16)
+
+
+def song_keys(texts: Iterable) -> np.ndarray:
+    return np.fromiter((song_key(t) for t in texts), dtype=np.uint64)
+
+
+def dataset_hash(keys: np.ndarray) -> str:
+    """Hash of the song keys in row order (changes when any song is added, removed, edited or moved)"""
+    return hashlib.md5(np.ascontiguousarray(keys, dtype=np.uint64).tobytes()).hexdigest()
+
+
+def files_digest(paths: Iterable[str]) -> str:
+    """md5 over the content of files (missing files count as empty)"""
+    h = hashlib.md5()
+    for path in paths:
+        h.update(os.path.basename(path).encode("utf-8") + b"\0")
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    h.update(block)
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def store_digest(store_dir: str) -> str:
+    """Content hash of a saved store (what derived artifacts are keyed on)"""
+    return files_digest(os.path.join(store_dir, name) for name in STORE_FILES)
+
+
+class TokenStore:
+    """Interned token ids + label ids + per-song offsets."""
+
+    def __init__(self, vocab: List[str], labels: List[str],
+                 token_ids: np.ndarray, label_ids: np.ndarray, offsets: np.ndarray,
+                 song_keys: Optional[np.ndarray] = None):
+        self.vocab = vocab
+        self.labels = labels
+        self.token_ids = token_ids
+        self.label_ids = label_ids
+        self.offsets = offsets
+        self.song_keys = song_keys
+        self.dataset_hash = None if song_keys is None else dataset_hash(song_keys)
+        self.label_index = {label: i for i, label in enumerate(labels)}
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    # =========================
+    # BUILD / SAVE / OPEN
+    # =========================
+    @classmethod
+    def from_labeled(cls, labeled_results: Iterable[List[Tuple[str, str]]],
+                     texts: Optional[Iterable] = None) -> "TokenStore":
+        """Build a store from [(token, label), ...] lists, one per song (texts = their lyrics)"""
+        token_index: Dict[str, int] = {}
+        label_index = {label: i for i, label in enumerate(BASE_LABELS)}
+        token_ids = []
+        label_ids = []
+        offsets = [0]
+
+        for tokens in labeled_results:
+            for token, label in tokens:
+                tid = token_index.get(token)
+                if tid is None:
+                    tid = token_index[token] = len(token_index)
+                lid = label_index.get(label)
+                if lid is None:
+                    lid = label_index[label] = len(label_index)
+                token_ids.append(tid)
+                label_ids.append(lid)
+            offsets.append(len(token_ids))
+
+        # keep FOREIGN_* (and any other extra labels) in a stable, sorted order
+        extra = sorted(label for label in label_index if label not in BASE_LABELS)
+        labels = BASE_LABELS + extra
+        remap = np.zeros(len(label_index), dtype=np.uint8)
+        for label, old_id in label_index.items():
+            remap[old_id] = labels.index(label)
+
+        return cls(
+            vocab=list(token_index),
+            labels=labels,
+            token_ids=np.asarray(token_ids, dtype=np.int32),
+            label_ids=remap[np.asarray(label_ids, dtype=np.int64)],
+            offsets=np.asarray(offsets, dtype=np.int64),
+            song_keys=None if texts is None else song_keys(texts),
+        )
+
+    def replace_songs(self, labeled: Dict[int, List[Tuple[str, str]]],
+                      keys: Optional[np.ndarray] = None) -> "TokenStore":
+        """
+        New store with the songs in labeled (row -> [(token, label), ...])
+        replaced or appended; keys = song keys of the resulting rows (their
+        count sets the number of songs, so rows removed from the end are dropped)
+        """
+        n_songs = len(keys) if keys is not None else max(len(self), max(labeled, default=-1) + 1)
+        vocab = list(self.vocab)
+        token_index = {token: i for i, token in enumerate(vocab)}
+        label_set = set(self.labels)
+        for tokens in labeled.values():
+            label_set.update(label for _, label in tokens)
+        extra = sorted(label for label in label_set if label not in BASE_LABELS)
+        labels = BASE_LABELS + extra
+        label_index = {label: i for i, label in enumerate(labels)}
+        remap = np.asarray([label_index[label] for label in self.labels], dtype=np.uint8)
+
+        token_parts, label_parts, lengths = [], [], []
+        for i in range(n_songs):
+            if i in labeled:
+                tokens = labeled[i]
+                tids = []
+                for token, _ in tokens:
+                    tid = token_index.get(token)
+                    if tid is None:
+                        tid = token_index[token] = len(vocab)
+                        vocab.append(token)
+                    tids.append(tid)
+                token_parts.append(np.asarray(tids, dtype=np.int32))
+                label_parts.append(np.asarray([label_index[label] for _, label in tokens], dtype=np.uint8))
+            elif i < len(self):
+                start, end = self.offsets[i], self.offsets[i + 1]
+                token_parts.append(np.asarray(self.token_ids[start:end]))
+                label_parts.append(remap[self.label_ids[start:end]])
+            else:
+                raise ValueError(f"Song {i} is neither in the store ({len(self):,} songs) nor relabeled")
+            lengths.append(len(token_parts[-1]))
+
+        return TokenStore(
+            vocab=vocab,
+            labels=labels,
+            token_ids=np.concatenate(token_parts) if token_parts else np.zeros(0, dtype=np.int32),
+            label_ids=np.concatenate(label_parts) if label_parts else np.zeros(0, dtype=np.uint8),
+            offsets=np.concatenate([[0], np.cumsum(lengths, dtype=np.int64)]).astype(np.int64),
+            song_keys=keys,
+        )
+
+    def save(self, store_dir: str):
+        os.makedirs(store_dir, exist_ok=True)
+        _write_lines(os.path.join(store_dir, VOCAB_FILE), self.vocab)
+        _write_lines(os.path.join(store_dir, LABELS_FILE), self.labels)
+        np.save(os.path.join(store_dir, TOKEN_IDS_FILE), self.token_ids)
+        np.save(os.path.join(store_dir, LABEL_IDS_FILE), self.label_ids)
+        np.save(os.path.join(store_dir, OFFSETS_FILE), self.offsets)
+        keys_path = os.path.join(store_dir, SONG_KEYS_FILE)
+        meta = {"n_songs": len(self), "dataset_hash": self.dataset_hash}
+        if self.song_keys is not None:
+            np.save(keys_path, self.song_keys)
+        elif os.path.exists(keys_path):
+            os.remove(keys_path)
+        with open(os.path.join(store_dir, META_FILE), "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+
+    @classmethod
+    def open(cls, store_dir: str, mmap: bool = True) -> "TokenStore":
+        mode = 'r' if mmap else None
+        keys_path = os.path.join(store_dir, SONG_KEYS_FILE)
+        store = cls(
+            vocab=_read_lines(os.path.join(store_dir, VOCAB_FILE)),
+            labels=_read_lines(os.path.join(store_dir, LABELS_FILE)),
+            token_ids=np.load(os.path.join(store_dir, TOKEN_IDS_FILE), mmap_mode=mode),
+            label_ids=np.load(os.path.join(store_dir, LABEL_IDS_FILE), mmap_mode=mode),
+            offsets=np.load(os.path.join(store_dir, OFFSETS_FILE), mmap_mode=mode),
+            song_keys=np.load(keys_path) if os.path.exists(keys_path) else None,
+        )
+        meta_path = os.path.join(store_dir, META_FILE)
+        if os.path.exists(meta_path):
+            with open(meta_path, "r", encoding="utf-8") as f:
+                store.dataset_hash = json.load(f).get("dataset_hash")
+        return store
+
+    # =========================
+    # DATASET ALIGNMENT
+    # =========================
+    def matches(self, texts) -> bool:
+        """True when the store was built from exactly these lyrics, in this order"""
+        if self.dataset_hash is None or len(texts) != len(self):
+            return False
+        return dataset_hash(song_keys(texts)) == self.dataset_hash
+
+    def check_alignment(self, texts):
+        """Raise ValueError unless row i of the dataset is song i of the store"""
+        if len(texts) != len(self):
+            raise ValueError(f"Dataset has {len(texts):,} rows but the token store has {len(self):,} songs")
+        if self.song_keys is None:
+            raise ValueError("Token store has no song keys (built before they existed); rebuild it")
+        moved = np.flatnonzero(song_keys(texts) != self.song_keys)
+        if len(moved):
+            raise ValueError(f"{len(moved):,} rows of the dataset do not match the token store "
+                             f"(first: row {moved[0]}); rebuild it or relabel with update_labels")
+
+    # =========================
+    # ACCESS
+    # =========================
+    def song(self, i: int) -> List[Tuple[str, str]]:
+        """Decode song i back to [(token, label), ...]"""
+        start, end = self.offsets[i], self.offsets[i + 1]
+        vocab, labels = self.vocab, self.labels
+        return [(vocab[t], labels[l]) for t, l in
+                zip(self.token_ids[start:end].tolist(), self.label_ids[start:end].tolist())]
+
+    def iter_songs(self):
+        for i in range(len(self)):
+            yield self.song(i)
+
+    def song_index(self) -> np.ndarray:
+        """Song id of every token (same length as token_ids)"""
+        return np.repeat(np.arange(len(self), dtype=np.int64), np.diff(self.offsets))
+
+    def label_counts(self) -> np.ndarray:
+        """[n_songs, n_labels] token count per label, columns follow self.labels"""
+        n_songs, n_labels = len(self), len(self.labels)
+        flat = self.song_index() * n_labels + self.label_ids
+        return np.bincount(flat, minlength=n_songs * n_labels).reshape(n_songs, n_labels)
+
+    def total_label_counts(self) -> Dict[str, int]:
+        counts = np.bincount(self.label_ids, minlength=len(self.labels))
+        return {label: int(c) for label, c in zip(self.labels, counts)}
+
+    def tokens_with_label(self, i: int, label: str) -> List[str]:
+        lid = self.label_index.get(label)
+        if lid is None:
+            return []
+        start, end = self.offsets[i], self.offsets[i + 1]
+        mask = self.label_ids[start:end] == lid
+        return [self.vocab[t] for t in self.token_ids[start:end][mask].tolist()]
+
+    def to_labeled_tokens(self) -> List[List[Tuple[str, str]]]:
+        """Decode everything (for the optional CSV export)"""
+        return list(self.iter_songs())
+
+
+def save_labeled(labeled_results: List[List[Tuple[str, str]]], store_dir: str,
+                 texts: Optional[Iterable] = None) -> TokenStore:
+    store = TokenStore.from_labeled(labeled_results, texts=texts)
+    store.save(store_dir)
+    print(f"✅ Token store: {len(store):,} songs | {len(store.token_ids):,} tokens | "
+          f"{len(store.vocab):,} distinct | saved to {store_dir}")
+    return store
+
+
+def load_labeled(store_dir: str, mmap: bool = True) -> Optional[TokenStore]:
+    if not os.path.exists(os.path.join(store_dir, OFFSETS_FILE)):
+        return None
+    return TokenStore.open(store_dir, mmap=mmap)
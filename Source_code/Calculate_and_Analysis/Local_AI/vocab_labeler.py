@@ -0,0 +1,221 @@
+"""
+vocab_labeler.py
+Vocabulary-level labeling with the local model (word_classify_LLM.ipynb, CELL 4).
+
+ask_local_ai / ask_group_1 / ask_group_2 run one generate() per song over the
+whole lyrics, although most tokens are already labeled by the thuvien
+dictionaries and the same unknown words repeat across thousands of songs.
+Here the model only sees what the dictionaries could not label:
+
+    1. collect_unknown(): every distinct UNLABELED token left by the fused
+       labeler (Calculate_Analysis/fused_labeler.py), plus 2..MAX_NGRAM-word
+       runs of consecutive UNLABELED tokens (not across punctuation) seen at
+       least NGRAM_MIN_COUNT times, each with its corpus count and one short
+       context snippet
+    2. label_vocab(): one short prompt per item ("which label is this word?"),
+       prompts sorted by token length and generated BATCH_SIZE at a time with
+       left padding, so a batch holds prompts of about the same length and
+       almost no padding; greedy decoding, a few new tokens per item
+    3. every answer is appended to the token -> label table
+       thuvien/llm_labels.csv (token,label,count). The table is also the
+       done-set: a stopped run continues with the items not in it yet, and
+       FusedLabeler applies it as step 3F on the next labeling run.
+
+Work grows with the number of distinct unknown words, not with the number of songs.
+
+Usage (notebook, after CELL 1 loaded tokenizer/model):
+    labeled = [labeler.label(text) for text in df[target_col]]
+    items = collect_unknown(labeled)
+    label_vocab(items, tokenizer, model, TABLE_PATH, foreign_labels=sorted(set(labeler.phien_am_dict.values())))
+"""
+
+import csv
+import os
+import re
+import time
+from collections import Counter
+from typing import Dict, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+MAX_NGRAM = 3           # cùng giới hạn với fused_labeler.LLM_MAX_WORDS
+NGRAM_MIN_COUNT = 3     # cụm từ chỉ được hỏi khi lặp lại ít nhất ngần này lần
+CONTEXT_WORDS = 4       # số từ mỗi bên trong đoạn ngữ cảnh
+BATCH_SIZE = 32
+MAX_NEW_TOKENS = 8
+TABLE_FIELDS = ["token", "label", "count"]
+
+SYSTEM_PROMPT = "Bạn là chuyên gia ngôn ngữ học tiếng Việt. Chỉ trả lời đúng 1 nhãn, không giải thích."
+
+USER_PROMPT = """Phân loại từ/cụm từ sau trong lời bài hát Việt Nam.
+
+NHÃN:
+- eng: tiếng Anh hoặc slang (baby, chill, flex, homie)
+- hanviet: từ Hán-Việt (chân thành, duyên phận, vô thường)
+- ten_rieng: tên người, nghệ danh, địa danh, thương hiệu (Sài Gòn, Jombie, BTS)
+{foreign}- viet: tiếng Việt thông thường, viết tắt, sai chính tả
+- khac: không xác định
+
+Từ: "{item}"
+Ngữ cảnh: "{context}"
+Nhãn:"""
+
+# nhãn trả lời -> nhãn của FusedLabeler
+ANSWER_LABELS = {
+    "eng": "ENGLISH",
+    "hanviet": "HANVIET",
+    "ten_rieng": "PROPER_NOUN",
+    "viet": "VIETNAMESE",
+    "khac": "UNLABELED",
+}
+ANSWER_PATTERN = re.compile(r"[a-z_]+")
+
+
+class VocabItem(NamedTuple):
+    text: str       # lowercase, words joined by one space
+    count: int
+    context: str
+
+
+# =========================
+# 1. COLLECT
+# =========================
+def collect_unknown(labeled_results: Sequence[List[Tuple[str, str]]], max_ngram: int = MAX_NGRAM,
+                    ngram_min_count: int = NGRAM_MIN_COUNT, skip: Optional[Set[str]] = None) -> List[VocabItem]:
+    """Distinct UNLABELED tokens / n-grams of the corpus, most frequent first (items in skip are left out)"""
+    skip = skip or set()
+    counts = Counter()
+    contexts: Dict[str, str] = {}
+
+    for tokens in labeled_results:
+        i, n = 0, len(tokens)
+        while i < n:
+            if tokens[i][1] != 'UNLABELED':
+                i += 1
+                continue
+            # maximal run of UNLABELED tokens [i, j); punctuation ends a run, as in step 3F
+            j = i
+            while j < n and tokens[j][1] == 'UNLABELED':
+                j += 1
+            run = [t.lower() for t, _ in tokens[i:j]]
+            for start in range(len(run)):
+                for size in range(1, min(max_ngram, len(run) - start) + 1):
+                    item = ' '.join(run[start:start + size])
+                    counts[item] += 1
+                    if item not in contexts:
+                        lo = max(0, i + start - CONTEXT_WORDS)
+                        hi = min(n, i + start + size + CONTEXT_WORDS)
+                        contexts[item] = ' '.join(t for t, _ in tokens[lo:hi])
+            i = j
+
+    items = [VocabItem(item, c, contexts[item]) for item, c in counts.items()
+             if item not in skip and any(ch.isalpha() for ch in item)
+             and (' ' not in item or c >= ngram_min_count)]
+    items.sort(key=lambda it: (-it.count, it.text))
+    print(f"🔎 {len(items):,} từ/cụm từ chưa có nhãn "
+          f"({sum(1 for it in items if ' ' not in it.text):,} từ đơn, {len(skip):,} đã có trong bảng)")
+    return items
+
+
+# =========================
+# 2. TABLE
+# =========================
+def load_table(path: str) -> Dict[str, str]:
+    """token -> label already written (including 'khac' = UNLABELED)"""
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        return {row["token"]: row["label"] for row in csv.DictReader(f) if row.get("token")}
+
+
+def answer_labels(foreign_labels: Sequence[str]) -> Dict[str, str]:
+    labels = dict(ANSWER_LABELS)
+    for label in foreign_labels:
+        labels["phien_am_" + label.replace("FOREIGN_", "").lower()] = label
+    return labels
+
+
+def build_prompt(tokenizer, item: VocabItem, foreign_labels: Sequence[str]) -> str:
+    foreign = "".join(f"- phien_am_{label.replace('FOREIGN_', '').lower()}: tiếng "
+                      f"{label.replace('FOREIGN_', '').title()} phiên âm sang chữ Việt\n" for label in foreign_labels)
+    messages = [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": USER_PROMPT.format(foreign=foreign, item=item.text, context=item.context)},
+    ]
+    return tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+
+
+def parse_answer(response: str, labels: Dict[str, str]) -> Optional[str]:
+    """first label-looking word of the answer, None when the model answered something else"""
+    for word in ANSWER_PATTERN.findall(response.lower()):
+        if word in labels:
+            return labels[word]
+    return None
+
+
+# =========================
+# 3. BATCHED GENERATION
+# =========================
+def length_buckets(lengths: Sequence[int], batch_size: int) -> List[List[int]]:
+    """indices sorted by length, cut into batches: each batch pads to about its own length"""
+    order = sorted(range(len(lengths)), key=lambda k: lengths[k])
+    return [order[k:k + batch_size] for k in range(0, len(order), batch_size)]
+
+
+def label_vocab(items: Sequence[VocabItem], tokenizer, model, table_path: str,
+                foreign_labels: Sequence[str] = (), batch_size: int = BATCH_SIZE,
+                max_new_tokens: int = MAX_NEW_TOKENS) -> Dict[str, str]:
+    """Label every item not yet in the table; returns the whole table"""
+    import torch
+
+    table = load_table(table_path)
+    todo = [it for it in items if it.text not in table]
+    if not todo:
+        print("✅ Bảng từ vựng đã đủ, không cần chạy model")
+        return table
+
+    labels = answer_labels(foreign_labels)
+    prompts = [build_prompt(tokenizer, it, foreign_labels) for it in todo]
+    lengths = [len(ids) for ids in tokenizer(prompts, add_special_tokens=False)["input_ids"]]
+    batches = length_buckets(lengths, batch_size)
+
+    # left padding: mọi prompt trong batch kết thúc cùng vị trí, token mới sinh thẳng hàng
+    tokenizer.padding_side = "left"
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+
+    new_file = not os.path.exists(table_path)
+    done, failed = 0, 0
+    start_time = time.time()
+    with open(table_path, "a", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=TABLE_FIELDS)
+        if new_file:
+            writer.writeheader()
+
+        for b, batch in enumerate(batches):
+            inputs = tokenizer([prompts[k] for k in batch], return_tensors="pt", padding=True,
+                               add_special_tokens=False).to(model.device)
+            with torch.inference_mode():
+                generated = model.generate(
+                    **inputs,
+                    max_new_tokens=max_new_tokens,
+                    do_sample=False,
+                    pad_token_id=tokenizer.pad_token_id,
+                )
+            responses = tokenizer.batch_decode(generated[:, inputs["input_ids"].shape[1]:], skip_special_tokens=True)
+
+            for k, response in zip(batch, responses):
+                label = parse_answer(response, labels)
+                if label is None:
+                    failed += 1     # không ghi: lần chạy sau hỏi lại
+                    continue
+                item = todo[k]
+                writer.writerow({"token": item.text, "label": label, "count": item.count})
+                table[item.text] = label
+            f.flush()
+
+            done += len(batch)
+            elapsed = time.time() - start_time
+            print(f"[*] Batch {b + 1}/{len(batches)} | {done:,}/{len(todo):,} từ | "
+                  f"{done / elapsed:.1f} từ/s | độ dài {lengths[batch[-1]]} token")
+
+    print(f"✅ Gán nhãn {done - failed:,} từ/cụm từ ({failed:,} trả lời không hợp lệ) -> {table_path}")
+    return table
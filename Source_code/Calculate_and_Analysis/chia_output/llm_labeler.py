@@ -0,0 +1,456 @@
+"""
+llm_labeler.py
+Concurrent, batched lyrics labeling client for lyrics_classification.ipynb.
+
+Same task and output columns as the old one-song-per-request loop
+(eng / nuoc_ngoai_phien_am / ten_rieng per song), but:
+
+    - many requests are in flight at once (asyncio, one aiohttp session to an
+      OpenAI-compatible /chat/completions endpoint, Groq by default)
+    - every model has its own request/minute and token/minute budget (token
+      buckets); a request goes to the first model in MODEL_LIST whose budget
+      and cooldown allow it, instead of switch_model() + retry + sleep(2)
+    - a 429 puts only that model on cooldown (Retry-After), the batch is re-queued
+    - short lyrics are packed into one prompt (up to PACK_MAX_SONGS songs /
+      PACK_MAX_CHARS characters), each marked with an id; the JSON answer is
+      split back per song by id. Songs missing from the answer are retried alone.
+    - every answer is stored in a SQLite cache keyed by
+      (sha256 of the lyrics, model, PROMPT_VERSION): reruns and duplicate lyrics
+      cost nothing, and a stopped run resumes from the cache, not from the
+      number of lines in the output CSV.
+    - the output CSV is appended to as songs finish (OutputCSV); rows already
+      in it, including a CSV written by the old loop, seed the cache
+      (LabelCache.seed) and are not sent again.
+
+Base URL and key come from the constructor or env (LLM_BASE_URL, GROQ_API_KEY),
+so the client can be pointed at a local mock of the chat-completions endpoint.
+
+Needs ../../token_bucket.py; to run it outside the repo (Colab), copy
+token_bucket.py into the same folder as this file.
+
+Usage:
+    cache = LabelCache("labels_cache.db")
+    out = OutputCSV("output_labeling.csv")
+    cache.seed(out.rows.values())
+    results = asyncio.run(label_many(lyrics_list, cache=cache))
+    # results[i] = {"eng": [...], "nuoc_ngoai_phien_am": [...], "ten_rieng": [...], "model": ...} or None
+"""
+
+import ast
+import asyncio
+import csv
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+import sqlite3
+import sys
+import time
+from typing import Callable, Dict, List, Optional, Sequence
+
+import aiohttp
+
+try:
+    from token_bucket import TokenBucket
+except ImportError:     # launched from inside the repo: token_bucket.py lives in Source_code/
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+    from token_bucket import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+BASE_URL = os.environ.get("LLM_BASE_URL", "https://api.groq.com/openai/v1")
+API_KEY = os.environ.get("GROQ_API_KEY", "")
+
+MODEL_LIST = [
+    "llama-3.1-8b-instant",
+    "llama-3.3-70b-versatile",
+    "openai/gpt-oss-120b",
+    "openai/gpt-oss-20b",
+    "meta-llama/llama-4-maverick-17b-128e-instruct",
+    "meta-llama/llama-4-scout-17b-16e-instruct",
+    "qwen/qwen3-32b"
+]
+# (requests/phút, tokens/phút) mỗi model; model không có trong bảng dùng DEFAULT_LIMITS
+MODEL_LIMITS = {
+    "llama-3.1-8b-instant": (30, 6000),
+    "llama-3.3-70b-versatile": (30, 12000),
+}
+DEFAULT_LIMITS = (30, 6000)
+
+MAX_IN_FLIGHT = 8       # số request đồng thời (tổng mọi model)
+PACK_MAX_SONGS = 8      # số bài tối đa trong 1 prompt
+PACK_MAX_CHARS = 4000   # tổng độ dài lyrics tối đa trong 1 prompt; bài dài hơn đi riêng
+MAX_ATTEMPTS = 4        # số lần thử 1 bài (lỗi khác rate limit) trước khi bỏ qua
+REQUEST_TIMEOUT = 120
+CHARS_PER_TOKEN = 3     # ước lượng cho tiếng Việt, chỉ dùng để trừ token budget
+OUTPUT_TOKENS_PER_SONG = 150
+TEMPERATURE = 0.2
+
+LABEL_KEYS = ["eng", "nuoc_ngoai_phien_am", "ten_rieng"]
+PROMPT_VERSION = "batch-v1"   # đổi prompt => đổi version, cache cũ không còn khớp
+OUTPUT_FIELDS = ["index_goc", "lyrics"] + LABEL_KEYS
+SEED_MODEL = "output-csv"     # "model" của nhãn lấy lại từ file output có sẵn
+
+SYSTEM_PROMPT = "Bạn là chuyên gia ngôn ngữ. Nhiệm vụ: Trích xuất tên riêng, tiếng Anh và từ phiên âm."
+
+USER_PROMPT = """Phân tích từng đoạn lyrics dưới đây và trích xuất từ vựng vào JSON.
+
+MỤC TIÊU: Tập trung vào:
+- Tiếng Anh & Slang
+- Phiên âm tiếng nước ngoài
+- Tên riêng
+
+CẤU TRÚC JSON: {{"songs": [{{"id": ..., "eng": [...], "nuoc_ngoai_phien_am": [...], "ten_rieng": [...]}}, ...]}}
+Mỗi đoạn lyrics có đúng 1 phần tử trong "songs", cùng "id" với đoạn đó.
+
+{songs}"""
+
+SONG_BLOCK = """### id: {id}
+---------------------
+{lyrics}
+---------------------
+"""
+
+
+def lyrics_hash(text: str) -> str:
+    return hashlib.sha256(text.strip().encode("utf-8")).hexdigest()
+
+
+def build_prompt(batch: Sequence[str]) -> str:
+    """batch[i] gets id "s{i}" """
+    return USER_PROMPT.format(songs="\n".join(SONG_BLOCK.format(id=f"s{i}", lyrics=t) for i, t in enumerate(batch)))
+
+
+def split_answer(content: str, n: int) -> Dict[int, dict]:
+    """{batch position: labels} for every song the model answered with a known id"""
+    try:
+        data = json.loads(content)
+    except (TypeError, ValueError):
+        return {}
+    if isinstance(data, dict) and "songs" not in data and n == 1 and any(k in data for k in LABEL_KEYS):
+        data = {"songs": [{**data, "id": "s0"}]}   # 1 bài: model đôi khi bỏ lớp "songs"
+    songs = data.get("songs") if isinstance(data, dict) else None
+    out = {}
+    for song in songs if isinstance(songs, list) else []:
+        if not isinstance(song, dict):
+            continue
+        m = re.fullmatch(r"s?(\d+)", str(song.get("id", "")).strip())
+        if m and int(m.group(1)) < n:
+            out[int(m.group(1))] = {k: song.get(k, "") for k in LABEL_KEYS}
+    return out
+
+
+def estimate_tokens(batch: Sequence[str]) -> int:
+    prompt = len(SYSTEM_PROMPT) + len(USER_PROMPT) + sum(len(t) + 40 for t in batch)
+    return prompt // CHARS_PER_TOKEN + OUTPUT_TOKENS_PER_SONG * len(batch)
+
+
+def pack(items: Sequence[tuple], max_songs: int = PACK_MAX_SONGS, max_chars: int = PACK_MAX_CHARS) -> List[list]:
+    """(key, lyrics) -> batches of consecutive short songs; a long song is its own batch"""
+    batches, current, size = [], [], 0
+    for key, text in items:
+        if current and (len(current) >= max_songs or size + len(text) > max_chars):
+            batches.append(current)
+            current, size = [], 0
+        current.append((key, text))
+        size += len(text)
+    if current:
+        batches.append(current)
+    return batches
+
+
+class LabelCache:
+    """(lyrics hash, model, prompt version) -> labels JSON, SQLite"""
+
+    def __init__(self, path: str, prompt_version: str = PROMPT_VERSION):
+        self.prompt_version = prompt_version
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+        CREATE TABLE IF NOT EXISTS labels (
+            hash TEXT,
+            model TEXT,
+            prompt_version TEXT,
+            result TEXT,
+            created_at REAL,
+            PRIMARY KEY (hash, model, prompt_version)
+        )""")
+        self.conn.commit()
+
+    def get(self, h: str, models: Sequence[str] = MODEL_LIST) -> Optional[dict]:
+        """labels of this lyrics from any model (MODEL_LIST order) for the current prompt version"""
+        rows = dict(self.conn.execute("SELECT model, result FROM labels WHERE hash=? AND prompt_version=?",
+                                      (h, self.prompt_version)).fetchall())
+        for model in list(models) + sorted(set(rows) - set(models)):
+            if model in rows:
+                return {**json.loads(rows[model]), "model": model}
+        return None
+
+    def put_many(self, items: Sequence[tuple], model: str):
+        """items: (hash, labels)"""
+        now = time.time()
+        self.conn.executemany(
+            "REPLACE INTO labels(hash, model, prompt_version, result, created_at) VALUES (?, ?, ?, ?, ?)",
+            [(h, model, self.prompt_version, json.dumps(labels, ensure_ascii=False), now) for h, labels in items])
+        self.conn.commit()
+
+    def seed(self, rows) -> int:
+        """
+        Labels of output CSV rows (dicts of OUTPUT_FIELDS) under SEED_MODEL, for lyrics
+        the cache has no answer for. Rows with every label empty are skipped: the old
+        loop wrote those for failed requests too, so they are sent again.
+        """
+        items = {}
+        for row in rows:
+            text = row.get("lyrics", "")
+            labels = {k: parse_label(row.get(k, "")) for k in LABEL_KEYS}
+            if text == "SKIP" or not any(labels.values()):
+                continue
+            h = lyrics_hash(text)
+            if h not in items and self.get(h, []) is None:
+                items[h] = labels
+        if items:
+            self.put_many(list(items.items()), SEED_MODEL)
+        return len(items)
+
+    def close(self):
+        self.conn.close()
+
+
+def parse_label(value):
+    """A label cell as written to the CSV: str(list) back to a list, anything else as is"""
+    if isinstance(value, str) and value.strip().startswith("["):
+        try:
+            return ast.literal_eval(value.strip())
+        except (ValueError, SyntaxError):
+            pass
+    return value
+
+
+class OutputCSV:
+    """
+    Output CSV appended one row at a time (flushed), so a stopped run keeps every
+    finished song. rows = index_goc -> row already in the file; a torn last row
+    (run killed while writing) is cut off on open. compact() rewrites the file
+    in input order, one row per index_goc (the last one written wins).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.rows: Dict[int, dict] = {}
+        if os.path.exists(path):
+            self._recover()
+        self.file = open(path, "a", encoding="utf-8-sig", newline="")
+        self.writer = csv.DictWriter(self.file, fieldnames=OUTPUT_FIELDS)
+        if self.file.tell() == 0:
+            self.writer.writeheader()
+            self.file.flush()
+
+    def _recover(self):
+        with open(self.path, "r", encoding="utf-8-sig", newline="") as f:
+            text = f.read()
+        consumed = good = 0
+
+        def lines():
+            nonlocal consumed
+            for line in io.StringIO(text, newline=""):
+                consumed += len(line)
+                yield line
+
+        header = None
+        try:
+            for r in csv.reader(lines(), strict=True):
+                record = text[good:consumed]
+                if record.count('"') % 2 or not record.endswith("\r\n"):
+                    break
+                if header is None:
+                    header = r
+                elif len(r) == len(header):
+                    row = dict(zip(header, r))
+                    self.rows[int(row["index_goc"])] = row
+                else:
+                    break
+                good = consumed
+        except (csv.Error, KeyError, ValueError):
+            pass
+        if good < len(text):
+            with open(self.path, "rb") as f:
+                bom = 3 if f.read(3) == b"\xef\xbb\xbf" else 0
+            os.truncate(self.path, bom + len(text[:good].encode("utf-8")))
+            logger.warning(f"Bỏ dòng ghi dở ở cuối {self.path}")
+
+    def write(self, index: int, lyrics: str, labels: Optional[dict]):
+        row = {"index_goc": index, "lyrics": lyrics}
+        row.update({k: (labels or {}).get(k, "") for k in LABEL_KEYS})
+        self.writer.writerow(row)
+        self.file.flush()
+        self.rows[index] = {k: str(v) for k, v in row.items()}
+
+    def compact(self):
+        self.file.close()
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8-sig", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=OUTPUT_FIELDS)
+            writer.writeheader()
+            for i in sorted(self.rows):
+                writer.writerow({k: self.rows[i].get(k, "") for k in OUTPUT_FIELDS})
+        os.replace(tmp_path, self.path)
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+
+def per_minute(budget: float) -> TokenBucket:
+    return TokenBucket(budget / 60, budget)
+
+
+class RateLimited(Exception):
+    def __init__(self, retry_after: float):
+        super().__init__(f"rate limited, retry after {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+class LLMLabeler:
+    def __init__(self, base_url: str = BASE_URL, api_key: str = API_KEY, models: Sequence[str] = MODEL_LIST,
+                 limits: Optional[dict] = None, max_in_flight: int = MAX_IN_FLIGHT, timeout: float = REQUEST_TIMEOUT,
+                 cache: Optional[LabelCache] = None):
+        self.url = base_url.rstrip("/") + "/chat/completions"
+        self.api_key = api_key
+        self.models = list(models)
+        limits = {**MODEL_LIMITS, **(limits or {})}
+        # budget/phút: rate = budget/60 mỗi giây, chứa tối đa 1 phút budget
+        # (1 request lớn hơn cả budget/phút chờ đầy bucket rồi gửi)
+        self.requests_budget = {m: per_minute(limits.get(m, DEFAULT_LIMITS)[0]) for m in self.models}
+        self.tokens_budget = {m: per_minute(limits.get(m, DEFAULT_LIMITS)[1]) for m in self.models}
+        self.cooldown_until = {m: 0.0 for m in self.models}
+        self.budget_lock = asyncio.Lock()
+        self.in_flight = asyncio.Semaphore(max_in_flight)
+        self.timeout = timeout
+        self.cache = cache
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.requests = {m: 0 for m in self.models}
+        self.rate_limited = 0
+        self.cache_hits = 0
+
+    async def __aenter__(self) -> "LLMLabeler":
+        self.session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.session.close()
+
+    async def _reserve(self, tokens: int) -> str:
+        """wait until some model can take this request, charge its budgets, return it"""
+        async with self.budget_lock:
+            while True:
+                now = time.monotonic()
+                waits = []
+                for m in self.models:
+                    wait = max(self.cooldown_until[m] - now, self.requests_budget[m].wait_time(1),
+                               self.tokens_budget[m].wait_time(tokens))
+                    if wait <= 0:
+                        self.requests_budget[m].take(1)
+                        self.tokens_budget[m].take(tokens)
+                        return m
+                    waits.append(wait)
+                await asyncio.sleep(min(waits))
+
+    async def _complete(self, model: str, prompt: str) -> str:
+        headers = {"Authorization": f"Bearer {self.api_key}"} if self.api_key else {}
+        payload = {
+            "model": model,
+            "messages": [{"role": "system", "content": SYSTEM_PROMPT}, {"role": "user", "content": prompt}],
+            "temperature": TEMPERATURE,
+            "response_format": {"type": "json_object"},
+        }
+        self.requests[model] += 1
+        async with self.session.post(self.url, json=payload, headers=headers) as r:
+            if r.status == 429:
+                raise RateLimited(float(r.headers.get("Retry-After") or 10))
+            r.raise_for_status()
+            data = await r.json(content_type=None)
+        return data["choices"][0]["message"]["content"]
+
+    async def label_batch(self, batch: Sequence[str]) -> Dict[int, dict]:
+        """{batch position: labels + model}; positions missing = not answered"""
+        prompt = build_prompt(batch)
+        tokens = estimate_tokens(batch)
+        while True:
+            model = await self._reserve(tokens)
+            try:
+                async with self.in_flight:
+                    content = await self._complete(model, prompt)
+            except RateLimited as e:
+                # chỉ model này nghỉ; batch được gửi lại cho model khác / sau cooldown
+                self.rate_limited += 1
+                self.cooldown_until[model] = time.monotonic() + e.retry_after
+                logger.warning(f"[⚠️ RATE LIMIT] {model}: nghỉ {e.retry_after:.0f}s")
+                continue
+            answers = split_answer(content, len(batch))
+            return {i: {**labels, "model": model} for i, labels in answers.items()}
+
+
+async def label_many(lyrics: Sequence[str], cache: Optional[LabelCache] = None,
+                     on_result: Optional[Callable[[int, Optional[dict]], None]] = None,
+                     labeler: Optional[LLMLabeler] = None) -> List[Optional[dict]]:
+    """
+    labels for every lyrics (None = failed after MAX_ATTEMPTS); on_result(i, labels) as each song finishes.
+    Identical lyrics are sent once; cached lyrics are not sent at all.
+    """
+    labeler = labeler or LLMLabeler(cache=cache)
+    cache = labeler.cache if cache is None else cache
+    results: List[Optional[dict]] = [None] * len(lyrics)
+    groups: Dict[str, List[int]] = {}
+    for i, text in enumerate(lyrics):
+        groups.setdefault(lyrics_hash(text), []).append(i)
+
+    def finish(h, labels):
+        for i in groups[h]:
+            results[i] = labels
+            if on_result is not None:
+                on_result(i, labels)
+
+    todo = []
+    for h, rows in groups.items():
+        labels = cache.get(h, labeler.models) if cache is not None else None
+        if labels is not None:
+            labeler.cache_hits += len(rows)
+            finish(h, labels)
+        else:
+            todo.append((h, lyrics[rows[0]]))
+    logger.info(f"📦 {len(lyrics)} bài, {len(groups)} lyrics khác nhau, {len(groups) - len(todo)} có trong cache")
+
+    async def run(batch, attempt):
+        try:
+            answers = await labeler.label_batch([text for _, text in batch])
+        except Exception as e:
+            logger.warning(f"[LỖI API KHÁC] {e}")
+            answers = {}
+        by_model: Dict[str, list] = {}
+        for pos, labels in answers.items():
+            by_model.setdefault(labels["model"], []).append((batch[pos][0], {k: labels[k] for k in LABEL_KEYS}))
+        if cache is not None:
+            for model, items in by_model.items():
+                cache.put_many(items, model)
+        for pos, labels in answers.items():
+            finish(batch[pos][0], labels)
+
+        missing = [item for pos, item in enumerate(batch) if pos not in answers]
+        if not missing:
+            return
+        if attempt + 1 >= MAX_ATTEMPTS:
+            for h, _ in missing:
+                finish(h, None)
+            return
+        # bài bị thiếu trong câu trả lời ghép: gửi lại từng bài riêng
+        await asyncio.gather(*(run([item], attempt + 1) for item in missing))
+
+    async with labeler:
+        await asyncio.gather(*(run(batch, 0) for batch in pack(todo)))
+    logger.info(f"📡 Requests: {labeler.requests} | cache hit: {labeler.cache_hits} bài | "
+                f"rate limit: {labeler.rate_limited}")
+    return results
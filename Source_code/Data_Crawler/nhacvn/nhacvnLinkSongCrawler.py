@@ -1,94 +1,140 @@
 import requests
 from bs4 import BeautifulSoup
-import time
 from urllib.parse import urljoin
 import os
+import sys
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from page_cache import PageCache, cached_get  # noqa: E402
+from rate_limiter import LIMITER  # noqa: E402
 
 # --- Cấu hình ---
 SITEMAP_INDEX_URL = "https://nhac.vn/sitemap.xml"
 OUTPUT_FILE = "all_song_links.txt"
-CHECKPOINT_FILE = "checkpoint.txt"
+CHECKPOINT_FILE = "checkpoint.txt"      # checkpoint cũ, chỉ dùng để import vào frontier lần đầu
+FRONTIER_FILE = "frontier.db"
 HEADERS = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
                   "AppleWebKit/537.36 (KHTML, like Gecko) "
                   "Chrome/91.0.4472.124 Safari/537.36"
 }
-RATE_LIMIT_DELAY = 1  # giây
-
-# ---------------- Checkpoint helpers ----------------
-
-def init_checkpoint():
+ARTIST_WORKERS = 4    # số nghệ sĩ quét song song; vẫn chung 1 rate budget (rate_limiter.LIMITER)
+LIST_MAX_AGE = 24 * 3600  # sitemap / trang danh sách đã lưu: hỏi lại server (ETag / If-Modified-Since) sau 1 ngày
+
+PAGE_CACHE = None  # PageCache (../page_cache.py), mở trong main()
+
+# ---------------- Frontier (SQLite) ----------------
+# Thay cho checkpoint.txt: mỗi bước tiến chỉ là 1 INSERT/UPDATE, không đọc/ghi lại cả file.
+#   sitemaps(url, done)                          sitemap đã mở rộng hay chưa
+#   artists(url, sitemap, next_page, started, done)   con trỏ trang của từng nghệ sĩ
+# Link bài hát được ghi (flush) vào OUTPUT_FILE trước khi next_page tăng, nên
+# bị kill giữa chừng thì chỉ quét lại đúng trang đang dở (link trùng bị lọc bởi
+# seen_urls; trang quét lại đó không bị tính là "không có bài mới").
+
+class Frontier:
+    def __init__(self, path=FRONTIER_FILE):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+        CREATE TABLE IF NOT EXISTS sitemaps (
+            url TEXT PRIMARY KEY,
+            done INTEGER DEFAULT 0
+        )""")
+        self.conn.execute("""
+        CREATE TABLE IF NOT EXISTS artists (
+            url TEXT PRIMARY KEY,
+            sitemap TEXT,
+            next_page INTEGER DEFAULT 1,
+            started INTEGER DEFAULT 0,
+            done INTEGER DEFAULT 0
+        )""")
+        self.conn.commit()
+
+    def is_empty(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM sitemaps").fetchone()[0] == 0
+
+    def add_sitemaps(self, urls, done=0):
+        with self.lock:
+            self.conn.executemany("INSERT OR IGNORE INTO sitemaps(url, done) VALUES (?, ?)",
+                                  [(u, done) for u in urls])
+            self.conn.commit()
+
+    def expand_sitemap(self, url, child_sitemaps, artist_urls):
+        """Lưu con của 1 sitemap và đánh dấu nó xong, trong cùng 1 transaction"""
+        with self.lock:
+            self.conn.executemany("INSERT OR IGNORE INTO sitemaps(url) VALUES (?)",
+                                  [(u,) for u in child_sitemaps])
+            self.conn.executemany("INSERT OR IGNORE INTO artists(url, sitemap) VALUES (?, ?)",
+                                  [(u, url) for u in artist_urls])
+            self.conn.execute("UPDATE sitemaps SET done=1 WHERE url=?", (url,))
+            self.conn.commit()
+
+    def pending_sitemaps(self):
+        with self.lock:
+            return [u for (u,) in self.conn.execute("SELECT url FROM sitemaps WHERE done=0 ORDER BY rowid")]
+
+    def pending_artists(self):
+        with self.lock:
+            return self.conn.execute(
+                "SELECT url, next_page, started FROM artists WHERE done=0 ORDER BY rowid").fetchall()
+
+    def start_artist(self, artist_url):
+        with self.lock:
+            self.conn.execute("UPDATE artists SET started=1 WHERE url=?", (artist_url,))
+            self.conn.commit()
+
+    def advance(self, artist_url, next_page):
+        with self.lock:
+            self.conn.execute("UPDATE artists SET next_page=? WHERE url=?", (next_page, artist_url))
+            self.conn.commit()
+
+    def finish_artist(self, artist_url):
+        with self.lock:
+            self.conn.execute("UPDATE artists SET done=1 WHERE url=?", (artist_url,))
+            self.conn.commit()
+
+    def counts(self):
+        with self.lock:
+            return self.conn.execute(
+                "SELECT (SELECT COUNT(*) FROM sitemaps WHERE done=1), (SELECT COUNT(*) FROM sitemaps), "
+                "(SELECT COUNT(*) FROM artists WHERE done=1), (SELECT COUNT(*) FROM artists)").fetchone()
+
+    def close(self):
+        self.conn.close()
+
+
+def import_legacy_checkpoint(frontier):
+    """Các parent_1 trong [Đã duyệt] của checkpoint.txt cũ được coi là sitemap đã xong"""
     if not os.path.exists(CHECKPOINT_FILE):
-        with open(CHECKPOINT_FILE, "w", encoding="utf-8") as f:
-            f.write("[Đã duyệt]\n\n[Đang duyệt]\n")
-
-def load_checkpoint():
+        return
     completed = []
-    current = {"parent_1": None, "child_1": None, "child_2": None}
-
     section = None
-    if os.path.exists(CHECKPOINT_FILE):
-        with open(CHECKPOINT_FILE, "r", encoding="utf-8") as f:
-            for line in f:
-                line = line.strip()
-                if not line:
-                    continue
-                if line == "[Đã duyệt]":
-                    section = "done"
-                    continue
-                elif line == "[Đang duyệt]":
-                    section = "current"
-                    continue
-
-                if section == "done" and line.startswith("parent_1:"):
-                    completed.append(line.split(":", 1)[1].strip())
-                elif section == "current" and ":" in line:
-                    k, v = line.split(":", 1)
-                    current[k.strip()] = v.strip() or None
-    return completed, current
-
-
-def save_current_checkpoint(parent=None, child1=None, child2=None):
-    completed, current = load_checkpoint()
-    if parent is not None:
-        current["parent_1"] = parent if parent != "" else None
-    if child1 is not None:
-        current["child_1"] = child1 if child1 != "" else None
-    if child2 is not None:
-        current["child_2"] = child2 if child2 != "" else None
-
-    with open(CHECKPOINT_FILE, "w", encoding="utf-8") as f:
-        f.write("[Đã duyệt]\n")
-        for p in completed:
-            f.write(f"parent_1: {p}\n")
-        f.write("\n[Đang duyệt]\n")
-        f.write(f"parent_1: {current['parent_1'] or ''}\n")
-        f.write(f"child_1: {current['child_1'] or ''}\n")
-        f.write(f"child_2: {current['child_2'] or ''}\n")
-
-
-def add_completed_parent(parent_url):
-    completed, current = load_checkpoint()
-    if parent_url not in completed:
-        completed.append(parent_url)
-    # clear current
-    current = {"parent_1": None, "child_1": None, "child_2": None}
-
-    with open(CHECKPOINT_FILE, "w", encoding="utf-8") as f:
-        f.write("[Đã duyệt]\n")
-        for p in completed:
-            f.write(f"parent_1: {p}\n")
-        f.write("\n[Đang duyệt]\n")
-        f.write("parent_1: \nchild_1: \nchild_2: \n")
-
-    print(f"✅ Hoàn tất {parent_url}, ghi vào [Đã duyệt]")
+    with open(CHECKPOINT_FILE, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line == "[Đã duyệt]":
+                section = "done"
+            elif line == "[Đang duyệt]":
+                section = "current"
+            elif section == "done" and line.startswith("parent_1:"):
+                completed.append(line.split(":", 1)[1].strip())
+    if completed:
+        frontier.add_sitemaps(completed, done=1)
+        print(f"📥 Import {len(completed)} sitemap đã duyệt từ {CHECKPOINT_FILE}")
 
 # ---------------- Fetch helpers ----------------
 
 def fetch_content(url):
     try:
-        response = requests.get(url, headers=HEADERS, timeout=15)
-        if response.status_code == 200:
+        response = cached_get(url, headers=HEADERS, timeout=15, cache=PAGE_CACHE, max_age=LIST_MAX_AGE,
+                              limiter=LIMITER)
+        if response is not None and response.status_code == 200:
             try:
                 return BeautifulSoup(response.text, "lxml")
             except Exception:
@@ -99,131 +145,104 @@ def fetch_content(url):
 
 # ---------------- Crawl helpers ----------------
 
-def get_song_urls_from_artist_page(artist_songs_url, resume_url=None, seen_urls=None):
-    song_urls = []
-    if resume_url and "?p=" in resume_url:
-        try:
-            page = int(resume_url.split("?p=")[-1])
-        except Exception:
-            page = 1
-    else:
-        page = 1
-
+class SongSink:
+    """Ghi link bài hát mới vào OUTPUT_FILE (append, flush ngay), lọc trùng bằng seen_urls"""
+
+    def __init__(self, file_handle, seen_urls):
+        self.file_handle = file_handle
+        self.seen_urls = seen_urls
+        self.lock = threading.Lock()
+
+    def add(self, urls):
+        with self.lock:
+            new = [u for u in dict.fromkeys(urls) if u not in self.seen_urls]
+            for u in new:
+                self.file_handle.write(u + "\n")
+                self.seen_urls.add(u)
+            self.file_handle.flush()
+        return len(new)
+
+
+def crawl_artist(artist_songs_url, next_page, started, frontier, sink):
+    """Quét các trang bài hát của 1 nghệ sĩ từ next_page, cập nhật con trỏ sau mỗi trang"""
+    page = next_page
+    total = 0
+    # nghệ sĩ đang dở từ lần chạy trước: trang đầu tiên có thể đã được ghi
+    resumed_page = page if started else None
+    if not started:
+        frontier.start_artist(artist_songs_url)
     while True:
         current_page_url = artist_songs_url if page == 1 else f"{artist_songs_url}?p={page}"
         print(f"   -> Đang quét trang bài hát: {current_page_url}")
-        save_current_checkpoint(child2=current_page_url)
 
         soup = fetch_content(current_page_url)
         if not soup:
+            # lỗi mạng: giữ nguyên con trỏ, lần chạy sau quét lại từ trang này
             print("   -> Không tải được trang, dừng.")
-            break
+            return total
 
         song_links = soup.select("ul.list_song li div.info h3.name a")
         if not song_links:
             print(f"   -> Trang {page} không có bài hát, dừng lại.")
             break
 
-        found_new = False
+        urls = []
         for link in song_links:
             href = link.get("href")
             if href and "/bai-hat/" in href:
-                full_url = urljoin(current_page_url, href)
-                if seen_urls is None or full_url not in seen_urls:
-                    song_urls.append(full_url)
-                    if seen_urls is not None:
-                        seen_urls.add(full_url)
-                    found_new = True
-
-        if not found_new:
+                urls.append(urljoin(current_page_url, href))
+        found_new = sink.add(urls)
+        total += found_new
+
+        if not found_new and page != resumed_page:
             print(f"   -> Không tìm thấy bài hát mới ở trang {page}, dừng lại.")
             break
 
         page += 1
-        time.sleep(RATE_LIMIT_DELAY)
+        frontier.advance(artist_songs_url, page)
 
-    return song_urls
+    frontier.finish_artist(artist_songs_url)
+    if total:
+        print(f"  -> Ghi {total} bài hát của {artist_songs_url} vào file.")
+    return total
 
 
-def dfs_crawler(start_url, visited, file_handle, completed_parents, checkpoint, seen_urls):
-    if start_url in visited:
-        return
-    visited.add(start_url)
-
-    if start_url in completed_parents:
-        print(f"⏩ Bỏ qua {start_url} (đã duyệt trước đó).")
-        return
-
-    print(f"Đang duyệt: {start_url}")
-    soup = fetch_content(start_url)
-    if not soup:
-        return
-
-    loc_tags = soup.find_all("loc")
-    is_leaf_sitemap = True
-
-    # --- Sitemap cha ---
-    for loc in loc_tags:
-        url = loc.get_text(strip=True)
-        if "sitemap" in url and url.endswith(".xml"):
-            is_leaf_sitemap = False
-            if checkpoint.get("parent_1") and url != checkpoint["parent_1"]:
-                print(f"  -> Bỏ qua sitemap cha {url} (chưa đến parent_1).")
+def expand_sitemaps(frontier):
+    """Mở rộng các sitemap chưa duyệt cho đến khi chỉ còn nghệ sĩ"""
+    while True:
+        pending = frontier.pending_sitemaps()
+        if not pending:
+            return
+        for sitemap_url in pending:
+            print(f"Đang duyệt: {sitemap_url}")
+            soup = fetch_content(sitemap_url)
+            if not soup:
                 continue
 
-            save_current_checkpoint(parent=url)
-            time.sleep(RATE_LIMIT_DELAY)
-            dfs_crawler(url, visited, file_handle, completed_parents, checkpoint, seen_urls)
-            add_completed_parent(url)
-
-    # --- Sitemap lá (nghệ sĩ) ---
-    if is_leaf_sitemap:
-        print(f"Đã đến sitemap lá: {start_url}. Bắt đầu lấy link nghệ sĩ...")
-        for loc in loc_tags:
-            url = loc.get_text(strip=True)
-
-
-            if "/nghe-si/" in url:
-                artist_songs_url = url.rstrip("/") + "/bai-hat"
-
-                if checkpoint.get("child_1") and artist_songs_url != checkpoint["child_1"]:
-                    print(f"  -> Bỏ qua nghệ sĩ {artist_songs_url} (chưa đến child_1).")
-                    continue
-
-                print(f"  -> Quét nghệ sĩ: {artist_songs_url}")
-                save_current_checkpoint(child1=artist_songs_url, child2="")
-                resume_page = checkpoint.get("child_2")
-
-                new_songs = get_song_urls_from_artist_page(
-                    artist_songs_url,
-                    resume_url=resume_page,
-                    seen_urls=seen_urls
-                )
-
-                # ✅ Reset cả file lẫn RAM để tiếp tục đúng
-                save_current_checkpoint(child1="", child2="")
-                checkpoint["child_1"] = None
-                checkpoint["child_2"] = None
-
-                if new_songs:
-                    for song_url in new_songs:
-                        file_handle.write(song_url + "\n")
-                    file_handle.flush()
-                    print(f"  -> Ghi {len(new_songs)} bài hát vào file.")
-                else:
-                    print("  -> Không tìm thấy bài hát mới cho nghệ sĩ này.")
-
-                time.sleep(RATE_LIMIT_DELAY)
-
+            locs = [loc.get_text(strip=True) for loc in soup.find_all("loc")]
+            # --- Sitemap cha ---
+            children = [u for u in locs if "sitemap" in u and u.endswith(".xml")]
+            # --- Sitemap lá (nghệ sĩ) ---
+            artists = [] if children else \
+                [u.rstrip("/") + "/bai-hat" for u in locs if "/nghe-si/" in u]
+            frontier.expand_sitemap(sitemap_url, children, artists)
+            if artists:
+                print(f"Đã đến sitemap lá: {sitemap_url}. {len(artists)} nghệ sĩ vào frontier")
+        # lỗi tải trang -> vẫn pending; tránh lặp vô hạn trong cùng 1 lần chạy
+        if frontier.pending_sitemaps() == pending:
+            print("⚠️ Còn sitemap không tải được, sẽ thử lại ở lần chạy sau.")
+            return
 
 # ---------------- Main ----------------
 
 def main():
-    init_checkpoint()
-    visited_urls = set()
-    completed_parents, checkpoint = load_checkpoint()
-    print("Resume từ checkpoint:", checkpoint)
-    print("Đã duyệt:", completed_parents)
+    global PAGE_CACHE
+    PAGE_CACHE = PageCache()
+    frontier = Frontier()
+    if frontier.is_empty():
+        import_legacy_checkpoint(frontier)
+        frontier.add_sitemaps([SITEMAP_INDEX_URL])
+    print("Resume từ frontier: sitemap %d/%d, nghệ sĩ %d/%d" % frontier.counts())
 
     seen_urls = set()
     if os.path.exists(OUTPUT_FILE):
@@ -233,11 +252,22 @@ def main():
                     seen_urls.add(line.strip())
 
     try:
+        expand_sitemaps(frontier)
+        artists = frontier.pending_artists()
+        print(f"🎤 {len(artists)} nghệ sĩ cần quét ({ARTIST_WORKERS} luồng)")
         with open(OUTPUT_FILE, "a", encoding="utf-8") as f:
-            dfs_crawler(SITEMAP_INDEX_URL, visited_urls, f, completed_parents, checkpoint, seen_urls)
+            sink = SongSink(f, seen_urls)
+            with ThreadPoolExecutor(ARTIST_WORKERS) as pool:
+                futures = [pool.submit(crawl_artist, url, next_page, started, frontier, sink)
+                           for url, next_page, started in artists]
+                for fut in futures:
+                    fut.result()
             print(f"\n✅ Hoàn tất (hoặc tạm dừng). File: {OUTPUT_FILE}")
     except IOError as e:
         print(f"Lỗi khi ghi file: {e}")
+    finally:
+        frontier.close()
+        PAGE_CACHE.close()
 
 if __name__ == "__main__":
     main()
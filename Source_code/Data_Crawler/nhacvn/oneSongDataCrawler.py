@@ -1,60 +1,97 @@
 import csv
-import requests
-from bs4 import BeautifulSoup
+import io
+from lxml import etree, html as lxml_html
 import os
+import sqlite3
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from page_cache import PageCache, cached_get  # noqa: E402
+from rate_limiter import LIMITER  # noqa: E402
 
 HEADERS = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
                   "(KHTML, like Gecko) Chrome/128.0.0.0 Safari/537.36"
 }
 
-CHECKPOINT_FILE = "checkpoint2.txt"
+DONE_DB = "songs_done.db"     # done-set: id các bài đã ghi vào CSV (thay cho checkpoint2.txt)
+WORKERS = 8                   # số trang bài hát tải song song (1 Session, pool kết nối dùng chung);
+                              # request thật vẫn theo rate budget chung của nhac.vn (rate_limiter.LIMITER)
+MAX_PENDING = WORKERS * 4     # số link đang chờ / đang tải tối đa
+COMMIT_EVERY = 50             # số bài mỗi lần commit done-set
+FIELDNAMES = ["id", "title", "artist", "composer", "genre", "lyrics"]
 
 
-def fetch_song(url):
-    r = requests.get(url, headers=HEADERS, timeout=20)
-    if r.status_code != 200:
-        print("❌ Error HTTP", r.status_code)
-        return None
-    soup = BeautifulSoup(r.text, "lxml")
+# =========================
+# PARSE (lxml + XPath, một lần parse cho mỗi trang)
+# =========================
+def _has_class(name):
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+# text của element như BeautifulSoup get_text(strip=True): bỏ comment, script/style
+_TEXT_NODES = etree.XPath(".//text()[not(ancestor::script or ancestor::style or ancestor::template)]")
+_LYRIC_TEXT_NODES = etree.XPath(
+    f".//text()[not(ancestor::script or ancestor::style or ancestor::template"
+    f" or ancestor::div[{_has_class('btn-exp-coll')}])]")
+_NAME = etree.XPath(f"(//h1[{_has_class('name_detail')}])[1]")
+_SINGER = etree.XPath(f"(//a[{_has_class('singer')}])[1]")
+# thay cho "ul.detail-info li p span.label:-soup-contains('...')" + find_next(...)
+_LABELS = etree.XPath(f"//ul[{_has_class('detail-info')}]//li//p//span[{_has_class('label')}]")
+# find_next(...) = phần tử đầu tiên sau label theo thứ tự tài liệu (kể cả con của label)
+_NEXT_SPAN_VAL = etree.XPath(f"(descendant::span[{_has_class('val')}] | following::span[{_has_class('val')}])[1]")
+_NEXT_A_VAL = etree.XPath(f"(descendant::a[{_has_class('val')}] | following::a[{_has_class('val')}])[1]")
+_LYRICS = etree.XPath(f"(//div[{_has_class('content_lyrics')} and {_has_class('dsc-body')}])[1]")
+
+_PARSER = lxml_html.HTMLParser(encoding="utf-8")
+
+
+def _text(el, sep=""):
+    return sep.join(t.strip() for t in _TEXT_NODES(el) if t.strip())
+
+
+def _label_value(labels, label, next_val, sep=""):
+    for span in labels:
+        if label in "".join(_TEXT_NODES(span)):
+            val = next_val(span)
+            return _text(val[0], sep) if val else ""
+    return ""
+
+
+def parse_song(html, url):
+    """Dict id/title/artist/composer/genre/lyrics từ HTML của trang bài hát"""
+    try:
+        doc = lxml_html.document_fromstring(html.encode("utf-8", "replace"), parser=_PARSER)
+    except (etree.ParserError, ValueError):
+        doc = lxml_html.document_fromstring("<html></html>")    # trang rỗng -> các field rỗng
 
     song_id = url.split("-")[-1]
 
     title, artist = "", ""
-    h1 = soup.find("h1", class_="name_detail")
+    h1 = _NAME(doc)
     if h1:
-        full_title = h1.get_text(" ", strip=True)
+        full_title = _text(h1[0], " ")
         if " - " in full_title:
             title, artist = full_title.split(" - ", 1)
         else:
             title = full_title
 
-    a_singer = soup.find("a", class_="singer")
+    a_singer = _SINGER(doc)
     if a_singer:
-        artist = a_singer.get_text(strip=True)
-
-    composer = ""
-    composer_tag = soup.select_one("ul.detail-info li p span.label:-soup-contains('Nhạc sĩ:')")
-    if composer_tag:
-        val = composer_tag.find_next("span", class_="val")
-        if val:
-            composer = val.get_text(" ", strip=True)
-
-    genre = ""
-    genre_tag = soup.select_one("ul.detail-info li p span.label:-soup-contains('Thể loại:')")
-    if genre_tag:
-        val = genre_tag.find_next("a", class_="val")
-        if val:
-            genre = val.get_text(strip=True)
+        artist = _text(a_singer[0])
+
+    labels = _LABELS(doc)
+    composer = _label_value(labels, "Nhạc sĩ:", _NEXT_SPAN_VAL, " ")
+    genre = _label_value(labels, "Thể loại:", _NEXT_A_VAL)
 
     lyrics = ""
-    lyric_div = soup.select_one("div.content_lyrics.dsc-body")
+    lyric_div = _LYRICS(doc)
     if lyric_div:
-        for btn in lyric_div.select("div.btn-exp-coll"):
-            btn.decompose()
-        for br in lyric_div.find_all("br"):
-            br.replace_with("\n")
-        lyrics = lyric_div.get_text("\n", strip=True)
+        # bỏ nút "xem thêm/thu gọn" (div.btn-exp-coll), mỗi dòng text là một dòng lyric
+        lyrics = "\n".join(t.strip() for t in _LYRIC_TEXT_NODES(lyric_div[0]) if t.strip())
 
     return {
         "id": song_id,
@@ -66,53 +103,210 @@ def fetch_song(url):
     }
 
 
-def get_last_checkpoint():
-    if os.path.exists(CHECKPOINT_FILE):
-        with open(CHECKPOINT_FILE, "r", encoding="utf-8") as f:
-            return f.read().strip()
-    return None
+def make_session():
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=WORKERS)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
 
 
-def save_checkpoint(url):
-    with open(CHECKPOINT_FILE, "w", encoding="utf-8") as f:
-        f.write(url)
+def song_id(url):
+    return url.split("-")[-1]
 
 
-if __name__ == "__main__":
-    input_file = "all_song_links.txt"
-    output_file = "outputNhacvn.csv"
+def fetch_song(url, cache=None, session=requests):
+    # trang bài hát đi qua raw-page store: đã lưu thì đọc từ đĩa, không tải lại và không tốn rate budget
+    r = cached_get(url, headers=HEADERS, timeout=20, cache=cache, session=session, limiter=LIMITER)
+    if r is None:
+        return None
+    if r.status_code != 200:
+        print("❌ Error HTTP", r.status_code)
+        return None
+    return parse_song(r.text, url)
+
 
-    last_url = get_last_checkpoint()
-    skip = bool(last_url)
+class DoneSet:
+    """
+    Id các bài đã có trong CSV. Ghi CSV (flush) trước, commit id sau, kèm kích
+    thước file CSV lúc commit; khi mở lại, các dòng CSV nằm sau kích thước đó
+    (ghi rồi nhưng chưa kịp commit) được đọc lại và thêm vào done-set. Nhờ vậy
+    bài xong không theo thứ tự vẫn không bị mất hay ghi trùng.
+    """
 
-    with open(output_file, "a", newline="", encoding="utf-8-sig") as csvfile:
-        writer = csv.DictWriter(
-            csvfile, fieldnames=["id", "title", "artist", "composer", "genre", "lyrics"]
-        )
+    def __init__(self, path, csv_path):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS done (id TEXT PRIMARY KEY)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (k TEXT PRIMARY KEY, v TEXT)")
+        self.conn.commit()
+        self.ids = {i for (i,) in self.conn.execute("SELECT id FROM done")}
+        self.pending = []
+        self.csv_path = csv_path
+        self.recover()
+
+    def recover(self):
+        row = self.conn.execute("SELECT v FROM meta WHERE k='csv_size'").fetchone()
+        offset = int(row[0]) if row else 0
+        if not os.path.exists(self.csv_path) or os.path.getsize(self.csv_path) <= offset:
+            return
+        # CSV cũ (crawler tuần tự) hoặc phần đuôi chưa commit
+        with open(self.csv_path, "rb") as f:
+            f.seek(offset)
+            data = f.read()
+        bom = 3 if offset == 0 and data.startswith(b"\xef\xbb\xbf") else 0
+        tail = data[bom:].decode("utf-8", errors="replace")
+
+        # chỉ nhận các bản ghi CSV hoàn chỉnh: đủ cột, dấu " cân bằng và kết thúc bằng
+        # "\r\n" của writer ngoài dấu nháy. Bản ghi cuối bị cắt dở (bị kill lúc đang ghi)
+        # được bỏ đi: strict=True báo lỗi khi file hết giữa trường có nháy, còn bản ghi
+        # thiếu "\r\n" cuối thì không qua được kiểm tra kết thúc.
+        consumed = good = 0
+        ids = []
+
+        def lines():
+            nonlocal consumed
+            for line in io.StringIO(tail, newline=""):
+                consumed += len(line)
+                yield line
+
+        try:
+            for r in csv.reader(lines(), strict=True):
+                record = tail[good:consumed]
+                if len(r) != len(FIELDNAMES) or record.count('"') % 2 or not record.endswith("\r\n"):
+                    break
+                good = consumed
+                if r[0] != "id":
+                    ids.append(r[0])
+        except csv.Error:
+            pass
+        if good < len(tail):
+            size = offset + bom + len(tail[:good].encode("utf-8"))
+            os.truncate(self.csv_path, size)
+            print(f"⚠️ Bỏ dòng CSV ghi dở ở cuối {self.csv_path}")
+        for i in ids:
+            self.add(i)
+        self.commit(os.path.getsize(self.csv_path))
+        print(f"📥 Done-set: thêm {len(ids)} bài từ {self.csv_path}")
+
+    def __contains__(self, i):
+        return i in self.ids
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, i):
+        self.ids.add(i)
+        self.pending.append((i,))
+
+    def commit(self, csv_size):
+        self.conn.executemany("INSERT OR IGNORE INTO done(id) VALUES (?)", self.pending)
+        self.conn.execute("REPLACE INTO meta(k, v) VALUES ('csv_size', ?)", (str(csv_size),))
+        self.conn.commit()
+        self.pending.clear()
+
+    def close(self):
+        self.conn.close()
+
+
+def iter_todo(input_file, done):
+    """Link trong input_file chưa có trong done-set (mỗi id một lần)"""
+    queued = set()
+    with open(input_file, "r", encoding="utf-8") as f:
+        for line in f:
+            url = line.strip()
+            if not url:
+                continue
+            i = song_id(url)
+            if i in done or i in queued:
+                continue
+            queued.add(i)
+            yield url
+
+
+def crawl_songs(input_file, output_file):
+    cache = PageCache()
+    session = make_session()
+    done = DoneSet(DONE_DB, output_file)
+    print(f"▶ Resume: {len(done)} bài đã có trong {output_file}")
+
+    def task(url):
+        try:
+            return url, fetch_song(url, cache, session)
+        except Exception as e:
+            print(f"❌ Error with {url}: {e}")
+            return url, None
+
+    n_ok = n_fail = 0
+    t0 = time.time()
+    with open(output_file, "a", newline="", encoding="utf-8-sig") as csvfile, \
+            ThreadPoolExecutor(WORKERS) as pool:
+        writer = csv.DictWriter(csvfile, fieldnames=FIELDNAMES)
 
         # nếu file rỗng thì ghi header
         if os.stat(output_file).st_size == 0:
             writer.writeheader()
 
-        with open(input_file, "r", encoding="utf-8") as f:
-            for line in f:
-                url = line.strip()
-                if not url:
+        def collect(futures):
+            nonlocal n_ok, n_fail
+            for fut in futures:
+                url, song = fut.result()
+                if not song:
+                    n_fail += 1
                     continue
+                # chỉ luồng chính ghi CSV; kết quả về không theo thứ tự cũng không sao
+                writer.writerow(song)
+                done.add(song["id"])
+                n_ok += 1
+                print(f"✔ {song['title']} - {song['artist']}")
+            if len(done.pending) >= COMMIT_EVERY:
+                csvfile.flush()
+                done.commit(os.fstat(csvfile.fileno()).st_size)
 
-                # bỏ qua link cho đến khi gặp checkpoint
-                if skip:
-                    if url == last_url:
-                        skip = False
-                    continue
+        pending = set()
+        for url in iter_todo(input_file, done):
+            pending.add(pool.submit(task, url))
+            if len(pending) >= MAX_PENDING:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                collect(finished)
+        finished, _ = wait(pending)
+        collect(finished)
+        csvfile.flush()
+        done.commit(os.fstat(csvfile.fileno()).st_size)
+
+    done.close()
+    cache.close()
+    elapsed = time.time() - t0
+    print(f"📊 {n_ok} bài mới, {n_fail} lỗi, {n_ok / max(elapsed, 1e-9):.1f} bài/s")
+
+
+def reparse_from_cache(input_file, output_file):
+    """Parse lại mọi trang đã lưu trong raw-page store (không dùng mạng), ghi ra CSV mới"""
+    cache = PageCache(offline=True)
+    n = 0
+    with open(output_file, "w", newline="", encoding="utf-8-sig") as csvfile, \
+            open(input_file, "r", encoding="utf-8") as f:
+        writer = csv.DictWriter(csvfile, fieldnames=FIELDNAMES)
+        writer.writeheader()
+        for line in f:
+            url = line.strip()
+            page = cache.lookup(url) if url else None
+            if page is None or page.status != 200:
+                continue
+            writer.writerow(parse_song(page.body, url))
+            n += 1
+    cache.close()
+    print(f"✅ Parse lại {n} trang từ raw-page store -> {output_file}")
+
+
+if __name__ == "__main__":
+    input_file = "all_song_links.txt"
+    output_file = "outputNhacvn.csv"
 
-                try:
-                    song = fetch_song(url)
-                    if song:
-                        writer.writerow(song)
-                        save_checkpoint(url)  # lưu checkpoint ngay
-                        print(f"✔ {song['title']} - {song['artist']}")
-                except Exception as e:
-                    print(f"❌ Error with {url}: {e}")
+    # python oneSongDataCrawler.py --reparse : chỉ parse lại các trang đã lưu
+    if "--reparse" in sys.argv:
+        reparse_from_cache(input_file, "outputNhacvn_reparsed.csv")
+        sys.exit(0)
 
+    crawl_songs(input_file, output_file)
     print("✅ Done, dữ liệu đã được lưu vào CSV.")
@@ -0,0 +1,32 @@
+"""
+rate_limiter.py
+Request budget cho nhac.vn, dùng chung bởi nhacvnLinkSongCrawler.py (sitemap,
+trang nghệ sĩ) và oneSongDataCrawler.py (trang bài hát): mọi request thật tới
+nhac.vn đi qua LIMITER, bất kể bao nhiêu luồng đang tải. Trang lấy từ raw-page
+store (../page_cache.py, cached_get(..., limiter=LIMITER)) không tốn budget.
+"""
+
+import threading
+import time
+
+RATE_LIMIT_DELAY = 1  # giây giữa 2 request (tính chung cho mọi luồng)
+
+
+class RateLimiter:
+    """Khoảng cách tối thiểu giữa 2 request, dùng chung cho mọi luồng"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.next_time = 0.0
+
+    def acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            wait = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+
+LIMITER = RateLimiter(RATE_LIMIT_DELAY)
@@ -0,0 +1,224 @@
+"""
+page_cache.py
+Raw-response store shared by the crawlers (tkaraoke, nhacvnLinkSongCrawler,
+oneSongDataCrawler).
+
+Every fetched page body is kept, so a parser fix can be re-run offline on the
+stored pages instead of downloading them again:
+
+    raw_cache/pages.pack    append-only, one zstd frame per distinct body
+    raw_cache/index.db      SQLite index
+        blobs(hash, offset, length, size)     content-addressed: sha256 of the body,
+                                              identical bodies are stored once
+        responses(url, hash, status, etag, last_modified, fetched_at)
+
+By default the store is Data_Crawler/raw_cache (git-ignored); PAGE_CACHE_DIR
+puts it elsewhere, e.g. on a data disk.
+
+Read-through policy (lookup -> fresh / conditional_headers):
+    - younger than max_age seconds (None = never stale): served from the store
+    - older: re-requested with If-None-Match / If-Modified-Since; a 304 only
+      refreshes fetched_at, the stored body is reused
+    - offline=True: never goes to the network, misses return None
+Only 2xx and 404 responses are stored (404 = song id does not exist). 429 and
+5xx are never stored: AsyncFetcher (tkaraoke) retries them with backoff,
+honouring Retry-After, and returns None once the retries run out; the
+requests-based crawlers treat them as a failed fetch, so the page is
+requested again on the next run.
+
+One process writes a store at a time (the pack offsets are not shared
+between processes); threads and asyncio tasks inside that process are fine.
+
+Usage:
+    cache = PageCache("raw_cache")
+    r = cached_get(url, headers=HEADERS, timeout=20, cache=cache)    # requests-based crawlers
+    async with AsyncFetcher(cache=cache) as fetcher: ...             # tkaraoke
+    for url, page in cache.iter_pages("https://nhac.vn/bai-hat/"):  # offline re-extraction
+        ...
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Iterator, NamedTuple, Optional, Tuple
+from urllib.parse import urlencode
+
+import requests
+import zstandard
+
+DEFAULT_ROOT = os.environ.get("PAGE_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "raw_cache"))
+ZSTD_LEVEL = 10
+MAX_AGE = None      # giây; None = trang đã lưu không bao giờ cũ (chỉ revalidate khi đặt max_age)
+
+
+class CachedPage(NamedTuple):
+    url: str
+    status: int
+    body: str
+    etag: Optional[str]
+    last_modified: Optional[str]
+    fetched_at: float
+
+
+def cache_key(url: str, params: Optional[dict] = None) -> str:
+    """URL (+ query params, sorted) identifying a response in the store"""
+    if not params:
+        return url
+    return url + ("&" if "?" in url else "?") + urlencode(sorted((k, str(v)) for k, v in params.items()))
+
+
+def storable(status: int) -> bool:
+    return 200 <= status < 300 or status == 404
+
+
+class PageCache:
+    def __init__(self, root: str = DEFAULT_ROOT, max_age: Optional[float] = MAX_AGE, offline: bool = False):
+        os.makedirs(root, exist_ok=True)
+        self.root = root
+        self.max_age = max_age
+        self.offline = offline
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(os.path.join(root, "index.db"), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+        CREATE TABLE IF NOT EXISTS blobs (
+            hash TEXT PRIMARY KEY,
+            offset INTEGER,
+            length INTEGER,
+            size INTEGER
+        )""")
+        self.conn.execute("""
+        CREATE TABLE IF NOT EXISTS responses (
+            url TEXT PRIMARY KEY,
+            hash TEXT,
+            status INTEGER,
+            etag TEXT,
+            last_modified TEXT,
+            fetched_at REAL
+        )""")
+        self.conn.commit()
+        self.pack_path = os.path.join(root, "pages.pack")
+        self.pack = open(self.pack_path, "ab")
+        self.reader = open(self.pack_path, "rb")
+        self.compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL)
+        self.decompressor = zstandard.ZstdDecompressor()
+        self.hits = 0
+        self.revalidated = 0
+        self.stored = 0
+
+    # =========================
+    # READ
+    # =========================
+    def _read_blob(self, h: str) -> str:
+        offset, length = self.conn.execute("SELECT offset, length FROM blobs WHERE hash=?", (h,)).fetchone()
+        self.reader.seek(offset)
+        return self.decompressor.decompress(self.reader.read(length)).decode("utf-8")
+
+    def lookup(self, url: str) -> Optional[CachedPage]:
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT hash, status, etag, last_modified, fetched_at FROM responses WHERE url=?", (url,)).fetchone()
+            if row is None:
+                return None
+            h, status, etag, last_modified, fetched_at = row
+            return CachedPage(url, status, self._read_blob(h), etag, last_modified, fetched_at)
+
+    def fresh(self, page: CachedPage, max_age: Optional[float] = None) -> bool:
+        """True if the stored page can be served without asking the server (max_age overrides self.max_age)"""
+        max_age = self.max_age if max_age is None else max_age
+        return self.offline or max_age is None or time.time() - page.fetched_at < max_age
+
+    def conditional_headers(self, page: Optional[CachedPage]) -> dict:
+        headers = {}
+        if page is not None and page.etag:
+            headers["If-None-Match"] = page.etag
+        if page is not None and page.last_modified:
+            headers["If-Modified-Since"] = page.last_modified
+        return headers
+
+    def iter_pages(self, prefix: str = "") -> Iterator[Tuple[str, CachedPage]]:
+        """(url, page) for every stored response whose url starts with prefix"""
+        with self.lock:
+            urls = [u for (u,) in self.conn.execute(
+                "SELECT url FROM responses WHERE url >= ? AND url < ? ORDER BY url", (prefix, prefix + "\U0010ffff"))]
+        for url in urls:
+            page = self.lookup(url)
+            if page is not None:
+                yield url, page
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    # =========================
+    # WRITE
+    # =========================
+    def store(self, url: str, status: int, body: str, etag: Optional[str] = None,
+              last_modified: Optional[str] = None):
+        data = body.encode("utf-8")
+        h = hashlib.sha256(data).hexdigest()
+        with self.lock:
+            if self.conn.execute("SELECT 1 FROM blobs WHERE hash=?", (h,)).fetchone() is None:
+                frame = self.compressor.compress(data)
+                offset = self.pack.seek(0, os.SEEK_END)
+                self.pack.write(frame)
+                self.pack.flush()       # blob on disk before the index points to it
+                self.conn.execute("INSERT INTO blobs(hash, offset, length, size) VALUES (?, ?, ?, ?)",
+                                  (h, offset, len(frame), len(data)))
+            self.conn.execute(
+                "REPLACE INTO responses(url, hash, status, etag, last_modified, fetched_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (url, h, status, etag, last_modified, time.time()))
+            self.conn.commit()
+            self.stored += 1
+
+    def touch(self, url: str):
+        """304 Not Modified: the stored body is current again"""
+        with self.lock:
+            self.conn.execute("UPDATE responses SET fetched_at=? WHERE url=?", (time.time(), url))
+            self.conn.commit()
+            self.revalidated += 1
+
+    def close(self):
+        with self.lock:
+            self.pack.close()
+            self.reader.close()
+            self.conn.close()
+
+
+# =========================
+# requests-based crawlers
+# =========================
+class CachedResponse(NamedTuple):
+    """The part of requests.Response the nhacvn crawlers use"""
+    status_code: int
+    text: str
+    from_cache: bool
+
+
+def cached_get(url: str, headers: Optional[dict] = None, timeout: float = 20,
+               cache: Optional[PageCache] = None, max_age: Optional[float] = None,
+               session=requests, limiter=None) -> Optional[CachedResponse]:
+    """
+    requests.get through the store; None when offline and the page was never fetched.
+    limiter.acquire() is called only before a real request, so stored pages cost no rate budget.
+    """
+    page = cache.lookup(url) if cache is not None else None
+    if page is not None and cache.fresh(page, max_age):
+        cache.hits += 1
+        return CachedResponse(page.status, page.body, True)
+    if cache is not None and cache.offline:
+        return None
+
+    if limiter is not None:
+        limiter.acquire()
+    r = session.get(url, headers={**(headers or {}), **(cache.conditional_headers(page) if cache else {})},
+                    timeout=timeout)
+    if r.status_code == 304 and page is not None:
+        cache.touch(url)
+        return CachedResponse(page.status, page.body, True)
+    if cache is not None and storable(r.status_code):
+        cache.store(url, r.status_code, r.text, r.headers.get("ETag"), r.headers.get("Last-Modified"))
+    return CachedResponse(r.status_code, r.text, False)
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""
+parse_bench.py
+Saved-page corpus + parsing benchmark for the crawlers' HTML extractors.
+
+The lxml/XPath extractors (tkaraoke.py: parse_search_page,
+extract_metadata_from_song_page; nhacvn/oneSongDataCrawler.py: parse_song)
+replaced BeautifulSoup versions. The old versions are kept below as the
+reference: `run` parses every saved page with both, reports any field that
+differs and the pages/sec of each; `check` only compares the outputs and fails
+when a kind has no pages or any page differs.
+
+Corpus layout (fixtures/):
+    fixtures/<kind>/<n>.html     kind = tkaraoke_search | tkaraoke_song | nhacvn_song
+    fixtures/<kind>/index.tsv    "<n>.html<TAB><url>" per line
+
+The committed fixtures are small hand-made pages (invented titles, names and
+lyrics) with the markup of each site and its edge cases: fragment / duplicate
+links, nested pagination text, pages without results or content, audio /
+karaoke / sheet markers found via links, classes, text and comments, titles
+with and without " - ", the "xem thêm" button inside the lyrics. `check` needs
+no network. `save` overwrites them with real pages for a larger benchmark.
+
+Usage:
+    python parse_bench.py check
+    python parse_bench.py save --tkaraoke-db tkaraoke/tkaraoke.db --nhacvn-links nhacvn/all_song_links.txt --limit 200
+    python parse_bench.py run
+"""
+
+import argparse
+import os
+import re
+import sys
+import time
+from urllib.parse import urljoin
+
+import requests
+from bs4 import BeautifulSoup
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "tkaraoke"))
+sys.path.insert(0, os.path.join(HERE, "nhacvn"))
+
+import tkaraoke  # noqa: E402
+from oneSongDataCrawler import HEADERS, parse_song  # noqa: E402
+
+FIXTURES_DIR = os.path.join(HERE, "fixtures")
+KINDS = ("tkaraoke_search", "tkaraoke_song", "nhacvn_song")
+SAVE_DELAY = 0.5    # giây giữa 2 request khi tải corpus
+
+
+# =========================
+# REFERENCE (BeautifulSoup, trước khi đổi sang lxml)
+# =========================
+def ref_search_page(html):
+    if not html:
+        return set(), 1
+    soup = BeautifulSoup(html, "html.parser")
+    links = set()
+    for a in soup.find_all("a", href=True):
+        href = a["href"].split('#')[0]
+        if tkaraoke.SONG_URL_PATTERN.search(href):
+            links.add(urljoin(tkaraoke.BASE, href))
+    soup = BeautifulSoup(html, "html.parser")
+    nums = []
+    for a in soup.find_all("a"):
+        txt = a.get_text(strip=True)
+        if txt.isdigit():
+            try:
+                nums.append(int(txt))
+            except ValueError:
+                pass
+    return links, max(nums) if nums else 1
+
+
+def ref_tkaraoke_song(html, url):
+    r = {"title": None, "artist": None, "lyrics": None, "has_audio": 0, "has_karaoke": 0, "has_sheet": 0}
+    if not html:
+        return r
+    soup = BeautifulSoup(html, "html.parser")
+    t = soup.find("h3", class_="h3-title-song")
+    if t:
+        r["title"] = t.get_text(strip=True)
+    a = soup.find("div", class_="div-author")
+    if a:
+        r["artist"] = a.get_text(strip=True)
+    lyrics_div = soup.find("div", class_="div-content-lyric")
+    if lyrics_div:
+        r["lyrics"] = "\n".join([s.strip() for s in lyrics_div.stripped_strings])
+    if soup.find("audio") is not None:
+        r["has_audio"] = 1
+    if soup.find(href=re.compile(r"DownloadMp3\.aspx")):
+        r["has_audio"] = 1
+    if soup.find(href=re.compile(r"KaraokeLyric\.aspx")) or soup.find(string=re.compile(r"Karaoke", re.I)):
+        r["has_karaoke"] = 1
+    if soup.find(href=re.compile(r"ViewMusicSheet\.aspx")) or soup.find(string=re.compile(r"nốt nhạc|nốt nhạc", re.I)):
+        r["has_sheet"] = 1
+    if soup.select_one(".btn-play") or soup.select_one(".play-btn"):
+        r["has_audio"] = 1
+    return r
+
+
+def ref_nhacvn_song(html, url):
+    soup = BeautifulSoup(html, "lxml")
+    song_id = url.split("-")[-1]
+    title, artist = "", ""
+    h1 = soup.find("h1", class_="name_detail")
+    if h1:
+        full_title = h1.get_text(" ", strip=True)
+        if " - " in full_title:
+            title, artist = full_title.split(" - ", 1)
+        else:
+            title = full_title
+    a_singer = soup.find("a", class_="singer")
+    if a_singer:
+        artist = a_singer.get_text(strip=True)
+    composer = ""
+    composer_tag = soup.select_one("ul.detail-info li p span.label:-soup-contains('Nhạc sĩ:')")
+    if composer_tag:
+        val = composer_tag.find_next("span", class_="val")
+        if val:
+            composer = val.get_text(" ", strip=True)
+    genre = ""
+    genre_tag = soup.select_one("ul.detail-info li p span.label:-soup-contains('Thể loại:')")
+    if genre_tag:
+        val = genre_tag.find_next("a", class_="val")
+        if val:
+            genre = val.get_text(strip=True)
+    lyrics = ""
+    lyric_div = soup.select_one("div.content_lyrics.dsc-body")
+    if lyric_div:
+        for btn in lyric_div.select("div.btn-exp-coll"):
+            btn.decompose()
+        for br in lyric_div.find_all("br"):
+            br.replace_with("\n")
+        lyrics = lyric_div.get_text("\n", strip=True)
+    return {"id": song_id, "title": title, "artist": artist,
+            "composer": composer, "genre": genre, "lyrics": lyrics}
+
+
+PARSERS = {
+    # kind: (reference, new)
+    "tkaraoke_search": (lambda html, url: ref_search_page(html),
+                        lambda html, url: tkaraoke.parse_search_page(html)),
+    "tkaraoke_song": (ref_tkaraoke_song, tkaraoke.extract_metadata_from_song_page),
+    "nhacvn_song": (ref_nhacvn_song, parse_song),
+}
+
+
+# =========================
+# CORPUS
+# =========================
+def load_corpus(kind):
+    folder = os.path.join(FIXTURES_DIR, kind)
+    index = os.path.join(folder, "index.tsv")
+    if not os.path.exists(index):
+        return []
+    pages = []
+    with open(index, encoding="utf-8") as f:
+        for line in f:
+            name, url = line.rstrip("\n").split("\t", 1)
+            with open(os.path.join(folder, name), encoding="utf-8") as page:
+                pages.append((url, page.read()))
+    return pages
+
+
+def save_corpus(kind, urls, limit):
+    folder = os.path.join(FIXTURES_DIR, kind)
+    os.makedirs(folder, exist_ok=True)
+    saved = 0
+    with open(os.path.join(folder, "index.tsv"), "w", encoding="utf-8") as index:
+        for url in urls:
+            if saved >= limit:
+                break
+            try:
+                r = requests.get(url, headers=HEADERS, timeout=20)
+            except requests.RequestException as e:
+                print(f"❌ {url}: {e}")
+                continue
+            if r.status_code != 200:
+                print(f"❌ HTTP {r.status_code}: {url}")
+                continue
+            name = f"{saved}.html"
+            with open(os.path.join(folder, name), "w", encoding="utf-8") as f:
+                f.write(r.text)
+            index.write(f"{name}\t{url}\n")
+            saved += 1
+            time.sleep(SAVE_DELAY)
+    print(f"💾 {kind}: {saved} trang -> {folder}")
+
+
+def cmd_save(args):
+    import sqlite3
+    search_urls = [f"{tkaraoke.BASE}{tkaraoke.SEARCH_PATH}?kw={kw}" for kw in tkaraoke.START_KEYS]
+    save_corpus("tkaraoke_search", search_urls, args.limit)
+    if args.tkaraoke_db and os.path.exists(args.tkaraoke_db):
+        conn = sqlite3.connect(args.tkaraoke_db)
+        # trang có nội dung và trang rỗng (404, ID không tồn tại) đều có trong corpus
+        urls = [u for (u,) in conn.execute("SELECT url FROM urls ORDER BY RANDOM() LIMIT ?", (args.limit * 2,))]
+        conn.close()
+        save_corpus("tkaraoke_song", urls, args.limit)
+    if args.nhacvn_links and os.path.exists(args.nhacvn_links):
+        with open(args.nhacvn_links, encoding="utf-8") as f:
+            urls = [line.strip() for line in f if line.strip()]
+        save_corpus("nhacvn_song", urls, args.limit)
+
+
+# =========================
+# BENCHMARK
+# =========================
+def timed(fn, pages, repeat):
+    best, out = None, None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = [fn(html, url) for url, html in pages]
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return out, best
+
+
+def diff_outputs(pages, ref_out, new_out):
+    return [(url, a, b) for (url, _), a, b in zip(pages, ref_out, new_out) if a != b]
+
+
+def print_diffs(diffs, limit=5):
+    for url, a, b in diffs[:limit]:
+        if isinstance(a, dict):
+            fields = [k for k in a if a[k] != b.get(k)]
+            print(f"   ❌ {url}: {fields}")
+        else:
+            print(f"   ❌ {url}")
+
+
+def cmd_run(args):
+    ok = True
+    for kind in KINDS:
+        pages = load_corpus(kind)
+        if not pages:
+            print(f"⚠️  {kind}: chưa có corpus (python parse_bench.py save ...)")
+            continue
+        ref, new = PARSERS[kind]
+        ref_out, ref_t = timed(ref, pages, args.repeat)
+        new_out, new_t = timed(new, pages, args.repeat)
+        diffs = diff_outputs(pages, ref_out, new_out)
+        print(f"📊 {kind}: {len(pages)} trang | bs4 {len(pages) / ref_t:,.0f} trang/s | "
+              f"lxml {len(pages) / new_t:,.0f} trang/s | x{ref_t / new_t:.1f} | khác: {len(diffs)}")
+        print_diffs(diffs)
+        ok = ok and not diffs
+    return 0 if ok else 1
+
+
+def cmd_check(args):
+    """bs4 và lxml cho cùng output trên mọi trang trong fixtures/ (không cần mạng)"""
+    ok = True
+    for kind in KINDS:
+        pages = load_corpus(kind)
+        if not pages:
+            print(f"❌ {kind}: không có trang nào trong {os.path.join(FIXTURES_DIR, kind)}")
+            ok = False
+            continue
+        ref, new = PARSERS[kind]
+        diffs = diff_outputs(pages, [ref(html, url) for url, html in pages], [new(html, url) for url, html in pages])
+        print(f"{'✅' if not diffs else '❌'} {kind}: {len(pages)} trang | khác: {len(diffs)}")
+        print_diffs(diffs, limit=len(diffs))
+        ok = ok and not diffs
+    return 0 if ok else 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[2])
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    save = sub.add_parser("save", help="tải các trang mẫu vào fixtures/")
+    save.add_argument("--tkaraoke-db", default=os.path.join(HERE, "tkaraoke", "tkaraoke.db"))
+    save.add_argument("--nhacvn-links", default=os.path.join(HERE, "nhacvn", "all_song_links.txt"))
+    save.add_argument("--limit", type=int, default=200, help="số trang mỗi loại")
+    run = sub.add_parser("run", help="so sánh output + tốc độ bs4 vs lxml")
+    run.add_argument("--repeat", type=int, default=3)
+    sub.add_parser("check", help="chỉ so sánh output bs4 vs lxml trên fixtures/, lỗi nếu khác")
+    args = parser.parse_args()
+    if args.cmd == "save":
+        cmd_save(args)
+        return 0
+    if args.cmd == "check":
+        return cmd_check(args)
+    return cmd_run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
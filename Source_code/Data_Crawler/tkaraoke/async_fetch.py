@@ -0,0 +1,152 @@
+"""
+async_fetch.py
+asyncio fetch core for tkaraoke.py.
+
+One aiohttp session with a bounded connection pool is shared by every
+request. Politeness is global: each host has one token bucket (rate
+requests/second, burst tokens), so the request rate stays the same no matter
+how many requests are in flight. Waiting for the bucket or for the network
+costs a coroutine, not a thread.
+
+Usage:
+    async with AsyncFetcher(rate=5.0) as fetcher:
+        html = await fetcher.get("https://lyric.tkaraoke.com/SearchResult.aspx", params={"kw": "a"})
+
+429 and 5xx responses, connection errors and timeouts are retried with
+exponential backoff (a Retry-After header, when sent, sets the wait); when
+the retries run out get() returns None, so the caller leaves the page
+unprocessed instead of parsing an error page.
+
+With cache=PageCache(...) (../page_cache.py) every response goes through the
+raw-page store: fresh pages are served from disk, stale ones are re-requested
+with If-None-Match / If-Modified-Since and a 304 reuses the stored body.
+
+Nothing is tied to lyric.tkaraoke.com: point tkaraoke.py at a local stub
+server with TKARAOKE_BASE=http://127.0.0.1:8080 to test the crawl offline.
+"""
+
+import asyncio
+import email.utils
+import os
+import random
+import sys
+import time
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+import aiohttp
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from page_cache import PageCache, cache_key, storable  # noqa: E402
+
+try:
+    from token_bucket import TokenBucket
+except ImportError:     # launched from inside the repo: token_bucket.py lives in Source_code/
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+    from token_bucket import TokenBucket
+
+# ----------------- CONFIG -----------------
+RATE_PER_HOST = 5.0     # requests per second per host, across all in-flight requests
+RATE_BURST = 5          # requests allowed back to back after an idle period
+MAX_CONNECTIONS = 20    # connection pool size
+MAX_IN_FLIGHT = 50      # requests waiting on the bucket or the network at once
+REQUEST_TIMEOUT = 15
+MAX_RETRIES = 3
+MAX_RETRY_AFTER = 120   # cap on the wait a Retry-After header can ask for (seconds)
+# ------------------------------------------
+
+
+def retryable(status: int) -> bool:
+    return status == 429 or status >= 500
+
+
+def retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds to wait from a Retry-After header (delay-seconds or HTTP date)"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+class AsyncFetcher:
+    def __init__(self, rate: float = RATE_PER_HOST, burst: int = RATE_BURST,
+                 max_connections: int = MAX_CONNECTIONS, max_in_flight: int = MAX_IN_FLIGHT,
+                 timeout: float = REQUEST_TIMEOUT, retries: int = MAX_RETRIES,
+                 headers: Optional[dict] = None, cache: Optional[PageCache] = None):
+        self.rate = rate
+        self.burst = burst
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.retries = retries
+        self.headers = headers or {}
+        self.cache = cache
+        self.in_flight = asyncio.Semaphore(max_in_flight)
+        self.buckets: Dict[str, TokenBucket] = {}
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.requests = 0
+        self.failures = 0
+
+    async def __aenter__(self) -> "AsyncFetcher":
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.max_connections),
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+            headers=self.headers,
+        )
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.session.close()
+
+    def bucket(self, url: str) -> TokenBucket:
+        host = urlsplit(url).netloc
+        b = self.buckets.get(host)
+        if b is None:
+            b = self.buckets[host] = TokenBucket(self.rate, self.burst)
+        return b
+
+    async def get(self, url: str, params: Optional[dict] = None, max_age: Optional[float] = None) -> Optional[str]:
+        """Body of the response (404 pages included), None when every attempt failed or got 429 / 5xx"""
+        key = cache_key(url, params)
+        page = self.cache.lookup(key) if self.cache is not None else None
+        if page is not None and self.cache.fresh(page, max_age):
+            self.cache.hits += 1
+            return page.body
+        if self.cache is not None and self.cache.offline:
+            return None
+        headers = self.cache.conditional_headers(page) if self.cache is not None else None
+
+        bucket = self.bucket(url)
+        backoff = 1.0
+        for attempt in range(self.retries):
+            wait = None
+            async with self.in_flight:
+                await bucket.acquire()
+                self.requests += 1
+                try:
+                    async with self.session.get(url, params=params, headers=headers) as resp:
+                        if resp.status == 304 and page is not None:
+                            self.cache.touch(key)
+                            return page.body
+                        if retryable(resp.status):
+                            self.failures += 1
+                            wait = retry_after(resp.headers.get("Retry-After"))
+                        else:
+                            body = await resp.text(errors="replace")
+                            if self.cache is not None and storable(resp.status):
+                                self.cache.store(key, resp.status, body,
+                                                 resp.headers.get("ETag"), resp.headers.get("Last-Modified"))
+                            return body
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    self.failures += 1
+            if attempt == self.retries - 1:
+                break
+            await asyncio.sleep(min(wait, MAX_RETRY_AFTER) if wait is not None else backoff + random.random() * 0.5)
+            backoff *= 2
+        return None
@@ -1,33 +1,98 @@
-import sqlite3
+"""
+converter.py
+Xuất bảng urls của tkaraoke.db ra CSV (hoặc Parquet) cho bước chuẩn hoá.
+
+Streaming: bộ lọc nằm trong câu SQL (last_error không thuộc EXCLUDED_ERRORS)
+và cursor được đọc theo từng lô fetchmany(BATCH_SIZE), nên RAM chỉ giữ một lô
+dù DB lớn đến đâu (trước đây fetchall() nạp cả bảng, kể cả lyrics).
+
+Parquet (cần pyarrow): kiểu cột lấy từ schema SQLite (INTEGER -> int64,
+REAL -> float64, còn lại string), mỗi lô là một row group; pandas đọc lại
+bằng pd.read_parquet() mà không phải parse CSV.
+
+Usage:
+    python converter.py                                  # tkaraoke.db -> tkaraoke_output.csv
+    python converter.py --parquet tkaraoke_output.parquet
+"""
+
+import argparse
 import csv
+import sqlite3
+
+BATCH_SIZE = 5000
+# dòng không có bài hát: trang rỗng / ID không tồn tại, placeholder trùng ID (id sweep)
+EXCLUDED_ERRORS = ("no_content", "dup_id")
 
-def export_to_csv(db_path="tkaraoke.db", table="urls", csv_path="tkaraoke_output.csv"):
-    conn = sqlite3.connect(db_path)
-    cur = conn.cursor()
 
-    # Lấy toàn bộ dữ liệu
-    cur.execute(f"SELECT * FROM {table}")
-    rows = cur.fetchall()
+def iter_batches(conn, table="urls", batch_size=BATCH_SIZE):
+    """(col_names, decl_types) rồi từng lô dòng đã lọc"""
+    decl_types = [(name, (ctype or "").upper()) for _, name, ctype, *_ in conn.execute(f"PRAGMA table_info({table})")]
+    cur = conn.execute(
+        f"SELECT * FROM {table} WHERE last_error IS NULL OR last_error NOT IN ({','.join('?' * len(EXCLUDED_ERRORS))})",
+        EXCLUDED_ERRORS)
+    yield [desc[0] for desc in cur.description], decl_types
+    while True:
+        rows = cur.fetchmany(batch_size)
+        if not rows:
+            break
+        yield rows
 
-    # Lấy tên cột
-    col_names = [desc[0] for desc in cur.description]
+
+def export_to_csv(db_path="tkaraoke.db", table="urls", csv_path="tkaraoke_output.csv", batch_size=BATCH_SIZE):
+    conn = sqlite3.connect(db_path)
+    batches = iter_batches(conn, table, batch_size)
+    col_names, _ = next(batches)
 
     # Ghi ra CSV với UTF-8 BOM (Excel đọc được tiếng Việt)
+    count = 0
     with open(csv_path, "w", newline="", encoding="utf-8-sig") as f:
         writer = csv.writer(f, delimiter=",")
         writer.writerow(col_names)  # header
-
-        # lọc bỏ các dòng chứa "no content"
-        count = 0
-        for row in rows:
-            # nếu bất kỳ cột nào chứa "no content" thì bỏ qua
-            if any(isinstance(col, str) and "no_content" in col.lower() for col in row):
-                continue
-            writer.writerow(row)
-            count += 1
+        for rows in batches:
+            writer.writerows(rows)
+            count += len(rows)
 
     conn.close()
     print(f"✅ Xuất thành công {count} dòng (đã lọc) ra file: {csv_path}")
+    return count
+
+
+def export_to_parquet(db_path="tkaraoke.db", table="urls", parquet_path="tkaraoke_output.parquet",
+                      batch_size=BATCH_SIZE):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise SystemExit("Xuất Parquet cần pyarrow: pip install pyarrow") from e
+
+    conn = sqlite3.connect(db_path)
+    batches = iter_batches(conn, table, batch_size)
+    col_names, decl_types = next(batches)
+    arrow_types = {name: pa.int64() if "INT" in t else pa.float64() if t in ("REAL", "FLOAT", "DOUBLE")
+                   else pa.string() for name, t in decl_types}
+    schema = pa.schema([(name, arrow_types.get(name, pa.string())) for name in col_names])
+
+    count = 0
+    with pq.ParquetWriter(parquet_path, schema, compression="zstd") as writer:
+        for rows in batches:
+            columns = list(zip(*rows))
+            writer.write_batch(pa.record_batch([pa.array(col, type=f.type) for col, f in zip(columns, schema)],
+                                               schema=schema))
+            count += len(rows)
+
+    conn.close()
+    print(f"✅ Xuất thành công {count} dòng (đã lọc) ra file: {parquet_path}")
+    return count
+
 
 if __name__ == "__main__":
-    export_to_csv("tkaraoke.db", "urls", "tkaraoke_output.csv")
+    parser = argparse.ArgumentParser(description="Xuất tkaraoke.db (đã lọc) ra CSV / Parquet")
+    parser.add_argument("--db", default="tkaraoke.db")
+    parser.add_argument("--table", default="urls")
+    parser.add_argument("--csv", default="tkaraoke_output.csv")
+    parser.add_argument("--parquet", help="ghi Parquet ra đường dẫn này thay cho CSV")
+    args = parser.parse_args()
+    if args.parquet:
+        export_to_parquet(args.db, args.table, args.parquet)
+    else:
+        export_to_csv(args.db, args.table, args.csv)
@@ -0,0 +1,169 @@
+"""
+db_writer.py
+Single writer thread for tkaraoke.db.
+
+Crawl code no longer takes a lock and commits once per song. It puts write
+operations on a queue, and one thread owns the write connection:
+
+    - WAL journal + synchronous=NORMAL (readers never block the writer,
+      one fsync per checkpoint instead of per transaction)
+    - queued writes are applied in order and committed as one transaction
+      every BATCH_SIZE operations or FLUSH_INTERVAL seconds
+    - consecutive operations with the same SQL go through executemany, on
+      the connection's cached prepared statement
+    - flush() blocks until everything queued so far is committed; it is
+      called at every crawl checkpoint, so durability is the same as before
+      at checkpoint granularity
+
+Usage:
+    writer = DBWriter(DB_FILE)
+    writer.insert_links(links, "search:ab")
+    writer.flush()
+    writer.close()
+"""
+
+import queue
+import re
+import sqlite3
+import threading
+import time
+from typing import Iterable
+
+BATCH_SIZE = 1000       # operations per transaction
+FLUSH_INTERVAL = 2.0    # seconds before a partial batch is committed
+
+INSERT_LINK_SQL = "INSERT OR IGNORE INTO urls(url, discovered_by, id_num) VALUES (?, ?, ?)"
+INSERT_ID_SQL = ("INSERT OR IGNORE INTO urls(url, discovered_by, processed, last_error, title, artist, "
+                 "lyrics, has_audio, has_karaoke, has_sheet, id_num) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)")
+SAVE_METADATA_SQL = ("UPDATE urls SET processed=1, last_error=NULL, title=?, artist=?, lyrics=?, "
+                     "has_audio=?, has_karaoke=?, has_sheet=? WHERE url=?")
+NO_CONTENT_SQL = "UPDATE urls SET processed=1, last_error=? WHERE url=?"
+ERROR_SQL = "UPDATE urls SET last_error=? WHERE url=?"
+META_SQL = "REPLACE INTO meta(k, v) VALUES (?, ?)"
+
+ID_NUM_PATTERN = re.compile(r"/(\d+)/[^/]+\.html$")
+
+_STOP = object()
+
+
+def url_id_num(url: str):
+    """Song id of a /{id}/{slug}.html url (the same id the ID sweep uses), None otherwise"""
+    m = ID_NUM_PATTERN.search(url)
+    return int(m.group(1)) if m else None
+
+
+def configure(conn: sqlite3.Connection):
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+
+
+class DBWriter(threading.Thread):
+    def __init__(self, db_file: str, batch_size: int = BATCH_SIZE, flush_interval: float = FLUSH_INTERVAL):
+        super().__init__(name="tkaraoke-db-writer", daemon=True)
+        self.db_file = db_file
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.ops = queue.Queue()
+        self.error = None
+        self.start()
+
+    # =========================
+    # WRITE OPERATIONS (any thread)
+    # =========================
+    def execute(self, sql: str, params: tuple):
+        if self.error is not None:
+            raise RuntimeError("DB writer stopped") from self.error
+        self.ops.put((sql, params))
+
+    def insert_links(self, links: Iterable[str], discovered_by: str):
+        for l in links:
+            self.execute(INSERT_LINK_SQL, (l, discovered_by, url_id_num(l)))
+
+    def insert_ids(self, rows: Iterable[tuple]):
+        for row in rows:
+            self.execute(INSERT_ID_SQL, row)
+
+    def save_metadata(self, url: str, meta: dict):
+        self.execute(SAVE_METADATA_SQL, (meta["title"], meta["artist"], meta["lyrics"], meta["has_audio"],
+                                         meta["has_karaoke"], meta["has_sheet"], url))
+
+    def mark_no_content(self, url: str):
+        self.execute(NO_CONTENT_SQL, ("no_content", url))
+
+    def mark_error(self, url: str, error: str):
+        self.execute(ERROR_SQL, (error, url))
+
+    def set_meta(self, k: str, v: str):
+        self.execute(META_SQL, (k, v))
+
+    def flush(self):
+        """Block until every operation queued before this call is committed"""
+        done = threading.Event()
+        self.ops.put(done)
+        while not done.wait(0.5):
+            if not self.is_alive():
+                break
+        if self.error is not None:
+            raise RuntimeError("DB writer stopped") from self.error
+
+    def close(self):
+        self.ops.put(_STOP)
+        self.join()
+        if self.error is not None:
+            raise RuntimeError("DB writer stopped") from self.error
+
+    # =========================
+    # WRITER THREAD
+    # =========================
+    def _commit(self, conn: sqlite3.Connection, pending: list):
+        # same-SQL runs keep their order and share one prepared statement
+        i = 0
+        while i < len(pending):
+            sql = pending[i][0]
+            j = i
+            while j < len(pending) and pending[j][0] == sql:
+                j += 1
+            conn.executemany(sql, [params for _, params in pending[i:j]])
+            i = j
+        conn.commit()
+        pending.clear()
+
+    def run(self):
+        conn = sqlite3.connect(self.db_file)
+        configure(conn)
+        pending = []
+        waiters = []
+        deadline = None
+        try:
+            while True:
+                timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+                try:
+                    op = self.ops.get(timeout=timeout)
+                except queue.Empty:
+                    op = None
+
+                stop = op is _STOP
+                if isinstance(op, threading.Event):
+                    waiters.append(op)
+                elif op is not None and not stop:
+                    pending.append(op)
+                    if deadline is None:
+                        deadline = time.monotonic() + self.flush_interval
+
+                if stop or waiters or len(pending) >= self.batch_size or \
+                        (deadline is not None and time.monotonic() >= deadline):
+                    if pending:
+                        self._commit(conn, pending)
+                    deadline = None
+                    for w in waiters:
+                        w.set()
+                    waiters.clear()
+                if stop:
+                    break
+        except Exception as e:
+            self.error = e
+            for w in waiters:
+                w.set()
+            raise
+        finally:
+            conn.close()
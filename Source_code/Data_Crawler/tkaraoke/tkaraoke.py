@@ -3,29 +3,36 @@
 tkaraoke_harvest.py
 Combine search-prefix crawling + ID sweep + metadata fetching.
 Stores results in SQLite (tkaraoke.db) and can export CSV.
+Every fetched page is also kept in the raw-page store (../page_cache.py), so
+a parser fix can be applied to all stored song pages without the network.
 
 Usage:
     python tkaraoke_harvest.py
+    python tkaraoke_harvest.py --reextract    # re-run extraction on stored pages, then export
 """
 
-import requests
-from bs4 import BeautifulSoup
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from lxml import etree, html as lxml_html
 from urllib.parse import urljoin
 import re
 import time
 import random
 import sqlite3
 import threading
-from concurrent.futures import ThreadPoolExecutor, as_completed
 from collections import deque
 from tqdm import tqdm
 import csv
+import json
 import os
 import sys
 import signal
 
+from async_fetch import AsyncFetcher, PageCache
+from db_writer import DBWriter, configure, url_id_num
+
 # ----------------- CONFIG -----------------
-BASE = "https://lyric.tkaraoke.com"
+BASE = os.environ.get("TKARAOKE_BASE", "https://lyric.tkaraoke.com")  # override to crawl a local stub server
 SEARCH_PATH = "/SearchResult.aspx"
 SONG_URL_PATTERN = re.compile(r"/\d+/.+\.html$")
 # If site uses p for pages, this handles that. Adjust if pagination param different.
@@ -39,10 +46,20 @@ START_KEYS = list("abcdefghijklmnopqrstuvwxyz0123456789")
 EXPAND_THRESHOLD = 30      # if >= results -> expand prefix
 MAX_KEY_ITER = 100000      # stop prefix expansion after this many keywords processed
 MAX_PREFIX_LEN = 5         # max depth of prefix expansion
-SLEEP_BETWEEN_REQ = 0.5    # base delay between requests per worker (randomized)
-CONCURRENCY = 5            # number of worker threads for metadata fetching / ID sweep
-MAX_ID = 120000            # upper bound for ID sweep (adjust to expected range)
-ID_BATCH_SIZE = 1000       # stash IDs in DB in batches
+RATE_PER_SEC = 5.0         # global request budget for the host (token bucket, all requests together)
+CONCURRENCY = 50           # requests in flight (waiting on the rate budget or the network)
+SEARCH_CONCURRENCY = 10    # keywords searched at once
+MAX_CONNECTIONS = 20       # connection pool size
+PARSE_WORKERS = os.cpu_count() or 1   # processes parsing pages off the event loop
+SEARCH_MAX_AGE = 24 * 3600  # stored search pages are revalidated after a day; song pages are kept
+REEXTRACT_CHUNK = 1000      # stored pages per batch sent to the parse pool
+MAX_ID = 120000            # hard upper bound for ID sweep
+ID_BLOCK_SIZE = 500        # ids per block in dense regions
+ID_MAX_BLOCK = 8000        # empty regions are sampled in blocks growing up to this size
+ID_SAMPLES = 20            # unknown ids probed per block to estimate how many songs search missed there
+ID_EMPTY_TAIL = 5000       # stop once this many ids past the highest known song id are empty
+ID_WINDOW = 4              # blocks probed concurrently
+ID_SWEEP_META = "id_sweep"  # meta key of the sweep cursor, saved after every window
 
 # network
 HEADERS = {
@@ -53,10 +70,11 @@ MAX_RETRIES = 3
 # ------------------------------------------
 
 # SQLite helper
-LOCK = threading.Lock()
-
+# All writes go through one DBWriter thread (batched transactions, WAL);
+# this connection is only used to create the schema and for reads.
 def init_db():
     conn = sqlite3.connect(DB_FILE, check_same_thread=False)
+    configure(conn)
     c = conn.cursor()
     # table for urls to process or discovered
     c.execute("""
@@ -74,6 +92,35 @@ def init_db():
         id_num INTEGER
     )
     """)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_urls_id_num ON urls(id_num)")
+    # search-prefix frontier: keywords, result pages already fetched, song ids each keyword returned
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS search_prefixes (
+        kw TEXT PRIMARY KEY,
+        parent TEXT,
+        done INTEGER DEFAULT 0,
+        pages INTEGER,
+        hits INTEGER
+    )
+    """)
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS search_pages (
+        kw TEXT,
+        page INTEGER,
+        PRIMARY KEY (kw, page)
+    )
+    """)
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS search_hits (
+        kw TEXT,
+        id_num INTEGER,
+        PRIMARY KEY (kw, id_num)
+    ) WITHOUT ROWID
+    """)
+    # backfill id_num of links discovered before it was stored with them
+    rows = c.execute("SELECT url FROM urls WHERE id_num IS NULL").fetchall()
+    c.executemany("UPDATE urls SET id_num=? WHERE url=?",
+                  [(url_id_num(u), u) for (u,) in rows if url_id_num(u) is not None])
     # simple meta table
     c.execute("""
     CREATE TABLE IF NOT EXISTS meta (
@@ -85,47 +132,80 @@ def init_db():
     return conn
 
 # network utilities
-session = requests.Session()
-session.headers.update(HEADERS)
+PAGE_CACHE = None   # PageCache, opened in main()
+
+def make_fetcher(concurrency=CONCURRENCY, retry=MAX_RETRIES):
+    """One pooled session + one rate budget for a whole crawl phase"""
+    return AsyncFetcher(rate=RATE_PER_SEC, burst=int(RATE_PER_SEC), max_connections=MAX_CONNECTIONS,
+                        max_in_flight=concurrency, timeout=REQUEST_TIMEOUT, retries=retry, headers=HEADERS,
+                        cache=PAGE_CACHE)
 
 def get_url(url, params=None, retry=MAX_RETRIES):
-    backoff = 1.0
-    for attempt in range(retry):
-        try:
-            resp = session.get(url, params=params, timeout=REQUEST_TIMEOUT)
-            if resp.status_code == 200:
-                return resp.text
-            else:
-                # return body for 404 etc (we handle)
-                return resp.text
-        except Exception as e:
-            time.sleep(backoff + random.random()*0.5)
-            backoff *= 2
-    return None
+    """Blocking single fetch; body for 200/404/..., None if every retry failed"""
+    async def _get():
+        async with make_fetcher(retry=retry) as fetcher:
+            return await fetcher.get(url, params=params)
+    return asyncio.run(_get())
 
 # parsing utilities
-def parse_song_links(html):
-    """Return set of absolute song links found in a search result or listing page."""
+# lxml (C parser) + precompiled XPath: each page is parsed once and every
+# extractor reads the same tree. Text helpers follow BeautifulSoup's
+# get_text(strip=True) / stripped_strings: comments and script/style/template
+# text are not part of an element's text.
+def _has_class(name):
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+_TEXT_NODES = etree.XPath(".//text()[not(ancestor::script or ancestor::style or ancestor::template)]")
+_ALL_STRINGS = etree.XPath("//text() | //comment()")   # what soup.find(string=...) searches
+_ANCHORS = etree.XPath("//a")
+_LINK_HREFS = etree.XPath("//a/@href")
+_HREFS = etree.XPath("//@href")
+_TITLE = etree.XPath(f"(//h3[{_has_class('h3-title-song')}])[1]")
+_AUTHOR = etree.XPath(f"(//div[{_has_class('div-author')}])[1]")
+_LYRICS = etree.XPath(f"(//div[{_has_class('div-content-lyric')}])[1]")
+_AUDIO = etree.XPath(f"//audio | //*[{_has_class('btn-play')} or {_has_class('play-btn')}]")
+
+MP3_HREF = re.compile(r"DownloadMp3\.aspx")
+KARAOKE_HREF = re.compile(r"KaraokeLyric\.aspx")
+SHEET_HREF = re.compile(r"ViewMusicSheet\.aspx")
+KARAOKE_TEXT = re.compile(r"Karaoke", re.I)
+SHEET_TEXT = re.compile(r"nốt nhạc|nốt nhạc", re.I)
+
+_PARSER = lxml_html.HTMLParser(encoding="utf-8")
+
+def parse_html(html):
+    """lxml root of a page, None for empty / unparseable html"""
     if not html:
-        return set()
-    soup = BeautifulSoup(html, "html.parser")
+        return None
+    try:
+        return lxml_html.document_fromstring(html.encode("utf-8", "replace"), parser=_PARSER)
+    except (etree.ParserError, ValueError):
+        return None
+
+def stripped_strings(el):
+    return [t.strip() for t in _TEXT_NODES(el) if t.strip()]
+
+def text_of(el, sep=""):
+    return sep.join(stripped_strings(el))
+
+def song_links(doc):
     links = set()
-    for a in soup.find_all("a", href=True):
-        href = a["href"].split('#')[0]
+    if doc is None:
+        return links
+    for href in _LINK_HREFS(doc):
+        href = href.split('#')[0]
         if SONG_URL_PATTERN.search(href):
             links.add(urljoin(BASE, href))
     return links
 
-def parse_pagination_pages(html):
-    """Try to detect number of pages in search results. Return int >=1."""
-    if not html:
+def pagination_pages(doc):
+    if doc is None:
         return 1
-    soup = BeautifulSoup(html, "html.parser")
     # common patterns: div.pagination a, ul.pagination li a, span.pages, etc.
     # look for numeric links
     nums = []
-    for a in soup.find_all("a"):
-        txt = a.get_text(strip=True)
+    for a in _ANCHORS(doc):
+        txt = text_of(a)
         if txt.isdigit():
             try:
                 nums.append(int(txt))
@@ -133,176 +213,385 @@ def parse_pagination_pages(html):
                 pass
     return max(nums) if nums else 1
 
-def fetch_and_store_links(conn, url, discovered_by="unknown"):
+def parse_song_links(html):
+    """Return set of absolute song links found in a search result or listing page."""
+    return song_links(parse_html(html))
+
+def parse_pagination_pages(html):
+    """Try to detect number of pages in search results. Return int >=1."""
+    return pagination_pages(parse_html(html))
+
+def parse_search_page(html):
+    """(song links, number of result pages) from one parse of a search page"""
+    doc = parse_html(html)
+    return song_links(doc), pagination_pages(doc)
+
+async def run_parse(pool, fn, *args):
+    """Run a parser in the process pool so the event loop keeps fetching (inline if pool is None)"""
+    if pool is None:
+        return fn(*args)
+    return await asyncio.get_running_loop().run_in_executor(pool, fn, *args)
+
+async def flush_writer(writer):
+    """writer.flush() in a thread: the event loop keeps fetching while the writer commits"""
+    await asyncio.get_running_loop().run_in_executor(None, writer.flush)
+
+def fetch_and_store_links(writer, url, discovered_by="unknown"):
     links = set()
     html = get_url(url)
     links |= parse_song_links(html)
-    with LOCK:
-        cur = conn.cursor()
-        for l in links:
-            try:
-                cur.execute("INSERT OR IGNORE INTO urls(url, discovered_by) VALUES (?, ?)", (l, discovered_by))
-            except Exception:
-                pass
-        conn.commit()
+    writer.insert_links(links, discovered_by)
     return links
 
 # SEARCH PREFIX CRAWLER (with pagination)
-def search_prefix_crawl(conn):
-    print("[*] Starting search-prefix crawler")
-    queue = deque(START_KEYS)
-    processed = set()
-    iter_count = 0
+# The frontier lives in tkaraoke.db (search_prefixes / search_pages / search_hits),
+# so a restart continues with the pending keywords and only their missing result
+# pages. A keyword whose results are all among its parent's results is not
+# expanded: its longer prefixes can only return songs that are already known.
+PREFIX_SQL = "INSERT OR IGNORE INTO search_prefixes(kw, parent) VALUES (?, ?)"
+PREFIX_PAGES_SQL = "UPDATE search_prefixes SET pages=? WHERE kw=?"
+PREFIX_DONE_SQL = "UPDATE search_prefixes SET done=1, hits=? WHERE kw=?"
+PAGE_DONE_SQL = "INSERT OR IGNORE INTO search_pages(kw, page) VALUES (?, ?)"
+HIT_SQL = "INSERT OR IGNORE INTO search_hits(kw, id_num) VALUES (?, ?)"
+
+def store_search_page(writer, kw, page, links):
+    writer.insert_links(links, f"search:{kw}")
+    for l in links:
+        writer.execute(HIT_SQL, (kw, url_id_num(l)))
+    writer.execute(PAGE_DONE_SQL, (kw, page))
+
+def keyword_ids(conn, kw):
+    return {i for (i,) in conn.execute("SELECT id_num FROM search_hits WHERE kw=?", (kw,))}
+
+async def crawl_keyword(fetcher, writer, kw, pool=None, pages=None, done_pages=()):
+    """
+    Fetch the result pages of one keyword that are not in done_pages; every page is
+    stored as soon as it is parsed. Returns (song ids found now, total pages), or
+    None if a page failed (the keyword stays pending, finished pages are kept).
+    """
+    ids = set()
+    if 1 not in done_pages:
+        html = await fetcher.get(BASE + SEARCH_PATH, params={"kw": kw}, max_age=SEARCH_MAX_AGE)
+        if html is None:
+            return None
+        links, pages = await run_parse(pool, parse_search_page, html)
+        writer.execute(PREFIX_PAGES_SQL, (pages, kw))
+        store_search_page(writer, kw, 1, links)
+        ids |= {url_id_num(l) for l in links}
+    # remaining result pages are fetched concurrently
+    todo = [p for p in range(2, (pages or 1) + 1) if p not in done_pages]
+    htmls = await asyncio.gather(*(
+        fetcher.get(BASE + SEARCH_PATH, params={"kw": kw, PAGE_PARAM_NAME: p}, max_age=SEARCH_MAX_AGE)
+        for p in todo
+    ))
+    failed = False
+    for p, h in zip(todo, htmls):
+        if h is None:
+            failed = True
+            continue
+        links = await run_parse(pool, parse_song_links, h)
+        store_search_page(writer, kw, p, links)
+        ids |= {url_id_num(l) for l in links}
+    return None if failed else (ids, pages)
 
-    pbar = tqdm(total=MAX_KEY_ITER, desc="search keywords")
+async def search_prefix_crawl_async(conn, writer, concurrency=SEARCH_CONCURRENCY):
+    cur = conn.cursor()
+    if cur.execute("SELECT COUNT(*) FROM search_prefixes").fetchone()[0] == 0:
+        cur.executemany(PREFIX_SQL, [(kw, None) for kw in START_KEYS])
+        conn.commit()
+    # resume: pending keywords in BFS order, with the result pages they already have
+    pending = cur.execute("SELECT kw, parent, pages FROM search_prefixes WHERE done=0 ORDER BY rowid").fetchall()
+    iter_count = cur.execute("SELECT COUNT(*) FROM search_prefixes WHERE done=1").fetchone()[0]
+    done_pages = {}
+    for kw, page in cur.execute("SELECT p.kw, p.page FROM search_pages p JOIN search_prefixes s "
+                                "ON s.kw = p.kw WHERE s.done=0"):
+        done_pages.setdefault(kw, set()).add(page)
+    print(f"[*] Search frontier: {len(pending)} pending keywords, {iter_count} done")
+
+    queue = deque((kw, parent, pages) for kw, parent, pages in pending)
+    parent_ids = {}         # parent keyword -> its song ids, kept while it has children pending
+    children_left = {}
+    tasks = {}
+    pruned = 0
+
+    def ids_of_parent(parent):
+        if parent not in parent_ids:
+            parent_ids[parent] = keyword_ids(conn, parent)
+        return parent_ids[parent]
+
+    def child_finished(parent):
+        if parent in children_left:
+            children_left[parent] -= 1
+            if children_left[parent] <= 0:
+                del children_left[parent]
+                parent_ids.pop(parent, None)
+
+    pbar = tqdm(total=MAX_KEY_ITER, initial=iter_count, desc="search keywords")
+    pool = ProcessPoolExecutor(PARSE_WORKERS)
     try:
-        while queue and iter_count < MAX_KEY_ITER:
-            kw = queue.popleft()
-            if kw in processed:
-                continue
-
-            # get first page
-            params = {"kw": kw}
-            html = get_url(BASE + SEARCH_PATH, params=params)
-            time.sleep(SLEEP_BETWEEN_REQ + random.random()*0.4)
-            if html is None:
-                # network fail -> requeue to try later
-                queue.append(kw)
-                continue
-
-            # collect links from first page and subsequent pages
-            total_pages = parse_pagination_pages(html)
-            links = parse_song_links(html)
-            # if more pages, iterate through them
-            if total_pages > 1:
-                for p in range(2, total_pages+1):
-                    params = {"kw": kw, PAGE_PARAM_NAME: p}
-                    page_html = get_url(BASE + SEARCH_PATH, params=params)
-                    time.sleep(SLEEP_BETWEEN_REQ + random.random()*0.4)
-                    links |= parse_song_links(page_html)
-
-            # store discovered links
-            with LOCK:
-                cur = conn.cursor()
-                for l in links:
-                    cur.execute("INSERT OR IGNORE INTO urls(url, discovered_by) VALUES (?, ?)", (l, f"search:{kw}"))
-                conn.commit()
-
-            hits = len(links)
-            iter_count += 1
-            pbar.update(1)
-
-            # expansion decision
-            if hits >= EXPAND_THRESHOLD and len(kw) < MAX_PREFIX_LEN:
-                for ch in "abcdefghijklmnopqrstuvwxyz0123456789":
-                    newk = kw + ch
-                    if newk not in processed:
-                        queue.append(newk)
-
-            processed.add(kw)
-            # occasional save progress in meta
-            if iter_count % 50 == 0:
-                with LOCK:
-                    conn.execute("REPLACE INTO meta(k, v) VALUES (?, ?)", ("search_iter", str(iter_count)))
-                    conn.commit()
+        async with make_fetcher() as fetcher:
+            while (queue or tasks) and iter_count < MAX_KEY_ITER:
+                # keep up to `concurrency` keywords in flight; the rate budget is shared
+                while queue and len(tasks) < concurrency and not STOP_EVENT.is_set():
+                    kw, parent, pages = queue.popleft()
+                    task = asyncio.ensure_future(
+                        crawl_keyword(fetcher, writer, kw, pool, pages, done_pages.get(kw, set())))
+                    tasks[task] = (kw, parent, pages)
+                if not tasks:
+                    break
+
+                done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    kw, parent, pages = tasks.pop(task)
+                    result = task.result()
+                    if result is None:
+                        # network fail -> requeue to try later (pages already stored are skipped)
+                        await flush_writer(writer)
+                        done_pages[kw] = {p for (p,) in conn.execute(
+                            "SELECT page FROM search_pages WHERE kw=?", (kw,))}
+                        queue.append((kw, parent, pages))
+                        continue
+
+                    ids, pages = result
+                    if done_pages.pop(kw, None):
+                        # resumed keyword: pages of the previous run count too
+                        await flush_writer(writer)
+                        ids |= keyword_ids(conn, kw)
+                    hits = len(ids)
+                    iter_count += 1
+                    pbar.update(1)
+
+                    # expansion decision
+                    covered = parent is not None and ids <= ids_of_parent(parent)
+                    if hits >= EXPAND_THRESHOLD and len(kw) < MAX_PREFIX_LEN:
+                        if covered:
+                            pruned += 1
+                        else:
+                            children = [kw + ch for ch in "abcdefghijklmnopqrstuvwxyz0123456789"]
+                            for newk in children:
+                                writer.execute(PREFIX_SQL, (newk, kw))
+                                queue.append((newk, kw, None))
+                            parent_ids[kw] = ids
+                            children_left[kw] = len(children)
+                    if parent is not None:
+                        child_finished(parent)
+                    writer.execute(PREFIX_DONE_SQL, (hits, kw))
+
+                    # occasional save progress in meta (checkpoint: wait until committed)
+                    if iter_count % 50 == 0:
+                        writer.set_meta("search_iter", str(iter_count))
+                        await flush_writer(writer)
+            for task in tasks:
+                task.cancel()
     finally:
         pbar.close()
+        pool.shutdown()
+        await flush_writer(writer)
+    print(f"[*] Search: {iter_count} keywords done, {pruned} not expanded (results covered by parent)")
+
+def search_prefix_crawl(conn, writer):
+    print("[*] Starting search-prefix crawler")
+    asyncio.run(search_prefix_crawl_async(conn, writer))
     print("[*] Search-prefix crawler finished (or reached limit)")
 
-# ID SWEEP: generate URLs by id and insert into DB
-def id_sweep(conn, start_id=1, end_id=MAX_ID, batch=ID_BATCH_SIZE):
-    print(f"[*] Starting ID sweep {start_id}..{end_id}")
+# ID SWEEP: probe unknown ids, fill in only the ranges where search missed songs
+# Rows from search already carry id_num, so ids that are known are never fetched
+# again. Every block gets ID_SAMPLES probes among its unknown ids:
+#   - a probe finds a song -> all remaining unknown ids of the block are queued
+#     for the metadata fetcher
+#   - no probe hits -> the block is skipped; while blocks stay empty the block
+#     size doubles (coarser sampling of dead ranges), a live block resets it
+#   - past the highest known song id, ID_EMPTY_TAIL empty ids in a row end the sweep
+# The cursor (next block, block size, empty tail) is saved in meta after every
+# window, so a rerun continues where the last one stopped and a finished sweep
+# sends no probes, unless search has since found songs past the cursor.
+def id_row(i, discovered_by):
+    # form URL using id; slug can be dummy
+    return (f"{BASE}/{i}/x.html", discovered_by, 0, None, None, None, None, 0, 0, 0, i)
+
+async def probe_id(writer, fetcher, i):
+    """True if id i is a song page, False if not, None if the fetch failed"""
+    url = f"{BASE}/{i}/x.html"
+    writer.insert_ids([id_row(i, f"id-probe:{i}")])
+    html = await fetcher.get(url)
+    if html is None:
+        return None     # stays processed=0, retried by the metadata fetcher
+    meta = extract_metadata_from_song_page(html, url)
+    save_extracted(writer, url, meta)
+    return bool(meta["title"] or meta["lyrics"])
+
+async def sweep_block(writer, fetcher, ids, song_ids, start, end, rng):
+    """(found songs in the block?, #probes, #ids queued)"""
+    unknown = [i for i in range(start, end + 1) if i not in ids]
+    sample = sorted(rng.sample(unknown, min(ID_SAMPLES, len(unknown))))
+    results = await asyncio.gather(*(probe_id(writer, fetcher, i) for i in sample))
+    ids.update(sample)
+    hits = sum(1 for r in results if r)
+    has_songs = any(i in song_ids for i in range(start, end + 1))
+    queued = 0
+    if hits:
+        rest = [i for i in unknown if i not in ids]
+        writer.insert_ids([id_row(i, f"id:{i}") for i in rest])
+        ids.update(rest)
+        queued = len(rest)
+    return bool(hits) or has_songs, len(sample), queued
+
+def id_sweep_state(conn, start_id, end_id):
+    """cursor saved by an earlier sweep of the same range, or None"""
+    row = conn.execute("SELECT v FROM meta WHERE k=?", (ID_SWEEP_META,)).fetchone()
+    if row is None:
+        return None
+    state = json.loads(row[0])
+    if (state["start_id"], state["end_id"]) != (start_id, end_id):
+        return None
+    return state
+
+def save_id_sweep_state(writer, start_id, end_id, start, size, empty_tail, top):
+    writer.set_meta(ID_SWEEP_META, json.dumps({"start_id": start_id, "end_id": end_id, "next": start,
+                                               "size": size, "empty_tail": empty_tail, "top": top}))
+
+async def id_sweep_async(conn, writer, start_id=1, end_id=MAX_ID):
     cur = conn.cursor()
-    count = 0
-    for start in range(start_id, end_id+1, batch):
-        batch_end = min(end_id, start + batch - 1)
-        to_insert = []
-        for i in range(start, batch_end+1):
-            # form URL using id; slug can be dummy
-            url = f"{BASE}/{i}/x.html"
-            to_insert.append((url, f"id:{i}", 0, None, None, None, None, 0, 0, 0, i))
-        with LOCK:
-            cur.executemany("INSERT OR IGNORE INTO urls(url, discovered_by, processed, last_error, title, artist, lyrics, has_audio, has_karaoke, has_sheet, id_num) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", to_insert)
-            conn.commit()
-        count += len(to_insert)
-        # small pause after batch
-        time.sleep(0.2 + random.random()*0.5)
-    print(f"[*] ID sweep inserted batches up to {end_id}")
+    ids = {i for (i,) in cur.execute("SELECT id_num FROM urls WHERE id_num IS NOT NULL")}
+    song_ids = {i for (i,) in cur.execute(
+        "SELECT id_num FROM urls WHERE id_num IS NOT NULL AND (title IS NOT NULL OR discovered_by NOT LIKE 'id%')")}
+    top = max(song_ids, default=0)
+    print(f"[*] Starting ID sweep {start_id}..{end_id} ({len(song_ids)} known song ids, highest {top})")
+
+    # placeholder rows of earlier runs whose id was found by search since: never fetch them twice
+    writer.execute("""UPDATE urls SET processed=1, last_error='dup_id'
+        WHERE processed=0 AND discovered_by LIKE 'id%' AND id_num IN
+        (SELECT id_num FROM urls WHERE discovered_by NOT LIKE 'id%' AND id_num IS NOT NULL)""", ())
+
+    rng = random.Random(start_id)
+    start, size, empty_tail = start_id, ID_BLOCK_SIZE, 0    # empty_tail: empty ids in a row past top
+    state = id_sweep_state(conn, start_id, end_id)
+    if state:
+        # resume after the last saved window; songs found past it since reopen a finished sweep
+        start, size = state["next"], state["size"]
+        empty_tail = state["empty_tail"] if top < start else 0
+        top = max(top, state["top"])
+        print(f"[*] ID sweep resumes at {start}")
+    probes = queued = skipped = 0
+    async with make_fetcher() as fetcher:
+        while start <= end_id and empty_tail < ID_EMPTY_TAIL and not STOP_EVENT.is_set():
+            blocks = []
+            for _ in range(ID_WINDOW):
+                if start > end_id:
+                    break
+                blocks.append((start, min(end_id, start + size - 1)))
+                start = blocks[-1][1] + 1
+            results = await asyncio.gather(*(
+                sweep_block(writer, fetcher, ids, song_ids, s, e, rng) for s, e in blocks))
+
+            for (s, e), (live, n_probes, n_queued) in zip(blocks, results):
+                probes += n_probes
+                queued += n_queued
+                if not live:
+                    skipped += e - s + 1
+                if live:
+                    top = max(top, e)
+                    empty_tail = 0
+                elif s > top:
+                    empty_tail += e - s + 1
+            size = ID_BLOCK_SIZE if any(r[0] for r in results) else min(size * 2, ID_MAX_BLOCK)
+            # the window's rows and the cursor past it are committed together
+            save_id_sweep_state(writer, start_id, end_id, start, size, empty_tail, top)
+            await flush_writer(writer)
+            print(f"[*] ID sweep at {start - 1}: {probes} probes, {queued} ids queued, {skipped} ids skipped")
+    print(f"[*] ID sweep stopped at {start - 1} ({probes + queued} requests instead of {end_id - start_id + 1})")
+
+def id_sweep(conn, writer, start_id=1, end_id=MAX_ID):
+    asyncio.run(id_sweep_async(conn, writer, start_id, end_id))
 
 # METADATA FETCHER
 def extract_metadata_from_song_page(html, url):
     """Return dict with title, artist, lyrics, has_audio, has_karaoke, has_sheet"""
     r = {"title": None, "artist": None, "lyrics": None, "has_audio": 0, "has_karaoke": 0, "has_sheet": 0}
-    if not html:
+    doc = parse_html(html)
+    if doc is None:
         return r
-    soup = BeautifulSoup(html, "html.parser")
     # title
-    t = soup.find("h3", class_="h3-title-song")
+    t = _TITLE(doc)
     if t:
-        r["title"] = t.get_text(strip=True)
+        r["title"] = text_of(t[0])
     # artist
-    a = soup.find("div", class_="div-author")
+    a = _AUTHOR(doc)
     if a:
-        r["artist"] = a.get_text(strip=True)
+        r["artist"] = text_of(a[0])
     # lyrics
-    lyrics_div = soup.find("div", class_="div-content-lyric")
+    lyrics_div = _LYRICS(doc)
     if lyrics_div:
-        r["lyrics"] = "\n".join([s.strip() for s in lyrics_div.stripped_strings])
-
-    # heuristics for audio / karaoke / sheet music:
-    # audio: presence of play buttons, "DownloadMp3.aspx", or audio tags
-    if soup.find("audio") is not None:
+        r["lyrics"] = text_of(lyrics_div[0], "\n")
+
+    # heuristics for audio / karaoke / sheet music, one pass over hrefs and one over strings:
+    # audio: <audio> tag, play button (.btn-play / .play-btn) or "DownloadMp3.aspx" link
+    # karaoke: "KaraokeLyric.aspx" link or words "Karaoke"
+    # sheet music: "ViewMusicSheet.aspx" link or text like "nốt nhạc"
+    hrefs = "\n".join(_HREFS(doc))
+    if _AUDIO(doc) or MP3_HREF.search(hrefs):
         r["has_audio"] = 1
-    if soup.find(href=re.compile(r"DownloadMp3\.aspx")):
-        r["has_audio"] = 1
-    # karaoke: presence of "KaraokeLyric.aspx" link or words "Karaoke"
-    if soup.find(href=re.compile(r"KaraokeLyric\.aspx")) or soup.find(string=re.compile(r"Karaoke", re.I)):
+    strings = None
+    if KARAOKE_HREF.search(hrefs):
         r["has_karaoke"] = 1
-    # sheet music: ViewMusicSheet.aspx or text like "nốt nhạc"
-    if soup.find(href=re.compile(r"ViewMusicSheet\.aspx")) or soup.find(string=re.compile(r"nốt nhạc|nốt nhạc", re.I)):
+    else:
+        strings = strings or _page_strings(doc)
+        if KARAOKE_TEXT.search(strings):
+            r["has_karaoke"] = 1
+    if SHEET_HREF.search(hrefs):
         r["has_sheet"] = 1
-
-    # fallback: sometimes audio icon class or data attributes
-    # check for common classes/ids (site specific; tweak if you find patterns)
-    if soup.select_one(".btn-play") or soup.select_one(".play-btn"):
-        r["has_audio"] = 1
+    else:
+        strings = strings or _page_strings(doc)
+        if SHEET_TEXT.search(strings):
+            r["has_sheet"] = 1
 
     return r
 
-def worker_fetch_metadata(conn, url_row):
+def _page_strings(doc):
+    """Every text node and comment of the page, one per line"""
+    return "\n".join(n if isinstance(n, str) else (n.text or "") for n in _ALL_STRINGS(doc))
+
+async def worker_fetch_metadata(writer, fetcher, url_row, pool=None):
     """
     url_row: tuple from DB: (url, discovered_by, processed, last_error, title, artist, lyrics, has_audio, has_karaoke, has_sheet, id_num)
     returns True if fetched/updated, False on skip/failure
     """
     url = url_row[0]
-    for attempt in range(MAX_RETRIES):
-        html = get_url(url)
-        time.sleep(SLEEP_BETWEEN_REQ + random.random()*0.6)  # polite pause
-        if html is None:
-            continue
-        # check if page looks like valid song (has lyric container)
-        meta = extract_metadata_from_song_page(html, url)
-        # if no title and no lyrics, treat as non-existing (or 404)
-        if not meta["title"] and not meta["lyrics"]:
-            # mark processed but empty
-            with LOCK:
-                conn.execute("UPDATE urls SET processed=1, last_error=? WHERE url=?", ("no_content", url))
-                conn.commit()
-            return False
-        # else update DB
-        with LOCK:
-            conn.execute("""
-                UPDATE urls SET processed=1, last_error=NULL, title=?, artist=?, lyrics=?, has_audio=?, has_karaoke=?, has_sheet=? WHERE url=?
-            """, (meta["title"], meta["artist"], meta["lyrics"], meta["has_audio"], meta["has_karaoke"], meta["has_sheet"], url))
-            conn.commit()
-        return True
-    # exhausted retries
-    with LOCK:
-        conn.execute("UPDATE urls SET last_error=? WHERE url=?", ("failed_retries", url))
-        conn.commit()
-    return False
-
-def fetch_all_metadata(conn, limit=None, concurrency=CONCURRENCY):
+    # the fetcher retries errors, 429 and 5xx itself; None = every attempt failed
+    html = await fetcher.get(url)
+    if html is None:
+        # exhausted retries: stays processed=0, fetched again on the next pass
+        writer.mark_error(url, "failed_retries")
+        return False
+    # check if page looks like valid song (has lyric container)
+    meta = await run_parse(pool, extract_metadata_from_song_page, html, url)
+    # if no title and no lyrics, treat as non-existing (or 404)
+    if not meta["title"] and not meta["lyrics"]:
+        # mark processed but empty
+        writer.mark_no_content(url)
+        return False
+    # else update DB
+    writer.save_metadata(url, meta)
+    return True
+
+async def fetch_metadata_async(writer, rows, concurrency=CONCURRENCY):
+    with ProcessPoolExecutor(PARSE_WORKERS) as pool:
+        async with make_fetcher(concurrency=concurrency) as fetcher:
+            async def run(row):
+                if STOP_EVENT.is_set():
+                    return False
+                try:
+                    return await worker_fetch_metadata(writer, fetcher, row, pool)
+                except Exception as e:
+                    # store error
+                    writer.mark_error(row[0], str(e))
+                    return False
+
+            # all rows are scheduled at once; the fetcher bounds in-flight requests and rate
+            for fut in tqdm(asyncio.as_completed([run(r) for r in rows]), total=len(rows), desc="fetching metadata"):
+                await fut
+
+def fetch_all_metadata(conn, writer, limit=None, concurrency=CONCURRENCY):
     """Fetch metadata for unprocessed urls. limit = max items to fetch this run."""
     cur = conn.cursor()
     # select unprocessed rows
@@ -313,17 +602,43 @@ def fetch_all_metadata(conn, limit=None, concurrency=CONCURRENCY):
     print(f"[*] Metadata fetcher - {len(rows)} items to process (concurrency={concurrency})")
     if not rows:
         return
-    with ThreadPoolExecutor(max_workers=concurrency) as exe:
-        futures = {exe.submit(worker_fetch_metadata, conn, r): r[0] for r in rows}
-        for fut in tqdm(as_completed(futures), total=len(futures), desc="fetching metadata"):
-            try:
-                fut.result()
-            except Exception as e:
-                # store error
-                url = futures[fut]
-                with LOCK:
-                    conn.execute("UPDATE urls SET last_error=? WHERE url=?", (str(e), url))
-                    conn.commit()
+    try:
+        asyncio.run(fetch_metadata_async(writer, rows, concurrency))
+    finally:
+        # checkpoint: the batch is committed before processed=0 is queried again
+        writer.flush()
+
+def save_extracted(writer, url, meta):
+    if not meta["title"] and not meta["lyrics"]:
+        writer.mark_no_content(url)
+    else:
+        writer.save_metadata(url, meta)
+
+def reextract_from_cache(writer):
+    """Re-run extract_metadata_from_song_page on every stored song page (no network)"""
+    print(f"[*] Re-extracting metadata from {len(PAGE_CACHE)} stored pages")
+    def flush(urls, bodies):
+        # urls missing from tkaraoke.db (new or rebuilt DB) are added first
+        writer.insert_links(urls, "cache")
+        for url, meta in zip(urls, pool.map(extract_metadata_from_song_page, bodies, urls, chunksize=50)):
+            save_extracted(writer, url, meta)
+        urls.clear()
+        bodies.clear()
+
+    n = 0
+    urls, bodies = [], []
+    with ProcessPoolExecutor(PARSE_WORKERS) as pool:
+        for url, page in tqdm(PAGE_CACHE.iter_pages(BASE + "/"), desc="re-extracting"):
+            if not SONG_URL_PATTERN.search(url):
+                continue
+            urls.append(url)
+            bodies.append(page.body)
+            n += 1
+            if len(urls) >= REEXTRACT_CHUNK:
+                flush(urls, bodies)
+        flush(urls, bodies)
+    writer.flush()
+    print(f"[*] Re-extracted {n} song pages")
 
 def export_to_csv(conn, output=OUTPUT_CSV):
     cur = conn.cursor()
@@ -346,41 +661,53 @@ signal.signal(signal.SIGTERM, signal_handler)
 
 # Main orchestration
 def main():
+    global PAGE_CACHE
     print("WARNING: This script will aggressively crawl lyric.tkaraoke.com if configured. Use responsibly.")
     conn = init_db()
+    writer = DBWriter(DB_FILE)
+    PAGE_CACHE = PageCache()
 
-    # Step A: run search-prefix crawler (fills DB with discovered URLs)
-    search_prefix_crawl(conn)
-
-    if STOP_EVENT.is_set():
-        print("[*] Stopped after search phase")
-        export_to_csv(conn)
-        return
-
-    # Step B: ID sweep fallback - insert candidate URLs formed by id
-    id_sweep(conn, start_id=1, end_id=MAX_ID)
-
-    if STOP_EVENT.is_set():
-        print("[*] Stopped after id sweep")
+    try:
+        if "--reextract" in sys.argv:
+            reextract_from_cache(writer)
+            return
+
+        # Step A: run search-prefix crawler (fills DB with discovered URLs)
+        search_prefix_crawl(conn, writer)
+
+        if STOP_EVENT.is_set():
+            print("[*] Stopped after search phase")
+            return
+
+        # Step B: ID sweep fallback - insert candidate URLs formed by id
+        id_sweep(conn, writer, start_id=1, end_id=MAX_ID)
+
+        if STOP_EVENT.is_set():
+            print("[*] Stopped after id sweep")
+            return
+
+        # Step C: Fetch metadata in batches until all processed
+        # loop: fetch metadata for a chunk, then re-evaluate until no unprocessed left
+        while not STOP_EVENT.is_set():
+            # fetch up to a batch (limit optional)
+            fetch_all_metadata(conn, writer, limit=CONCURRENCY * 50, concurrency=CONCURRENCY)
+            # check if any unprocessed remains
+            cur = conn.cursor()
+            remaining = cur.execute("SELECT COUNT(*) FROM urls WHERE processed=0").fetchone()[0]
+            print(f"[*] Remaining unprocessed: {remaining}")
+            if remaining == 0:
+                break
+            # if still many remain, sleep a bit and continue
+            time.sleep(1.0)
+    finally:
+        # everything queued is committed before the export reads the DB
+        writer.close()
+        print(f"[*] Page store: {PAGE_CACHE.hits} served from disk, {PAGE_CACHE.revalidated} revalidated (304), "
+              f"{PAGE_CACHE.stored} stored")
+        PAGE_CACHE.close()
+        # Final export
         export_to_csv(conn)
-        return
-
-    # Step C: Fetch metadata in batches until all processed
-    # loop: fetch metadata for a chunk, then re-evaluate until no unprocessed left
-    while not STOP_EVENT.is_set():
-        # fetch up to a batch (limit optional)
-        fetch_all_metadata(conn, limit=CONCURRENCY * 50, concurrency=CONCURRENCY)
-        # check if any unprocessed remains
-        cur = conn.cursor()
-        remaining = cur.execute("SELECT COUNT(*) FROM urls WHERE processed=0").fetchone()[0]
-        print(f"[*] Remaining unprocessed: {remaining}")
-        if remaining == 0:
-            break
-        # if still many remain, sleep a bit and continue
-        time.sleep(1.0)
-    # Final export
-    export_to_csv(conn)
-    conn.close()
+        conn.close()
     print("[*] Done.")
 
 if __name__ == "__main__":
@@ -0,0 +1,340 @@
+"""
+lyrics_lsh.py
+Near-duplicate lyrics for merge_by_lyrics (merge_data.ipynb, "Merge cách 2").
+
+Instead of comparing every pair with fuzz.partial_ratio (O(n²)) or bucketing
+by md5 of the first 100 characters (exact prefixes only):
+
+    1. every song -> set of character 5-gram shingles (lowercase, spaces collapsed)
+    2. shingles -> MinHash signature (NUM_PERM hashes, numpy, process pool)
+    3. LSH: signature split in BANDS bands of ROWS rows; songs sharing any band
+       bucket become candidate pairs (Jaccard ~0.42 is caught with p = 0.5,
+       ~0.6 with p > 0.95)
+    4. containment: partial_ratio also matches a short lyric (a chorus) inside
+       a much longer one, where the Jaccard of the two shingle sets is low and
+       LSH misses the pair. Every song keeps a sketch of SKETCH_SIZE of its
+       shingles (bottom-k of a mixing hash = a uniform sample); the sketches
+       are indexed shingle -> songs, and every song is queried with all of its
+       shingles. A shorter song with at least MIN_CONTAINMENT of its sketch
+       found in the longer one becomes a candidate too.
+    5. candidates verified with the same rule as before,
+       fuzz.partial_ratio >= lyric_threshold (rapidfuzz cpdist, all cores)
+    6. the same greedy pass as the brute-force loop: row i is merged with the
+       first unmerged j > i that passed verification
+
+Candidates are a superset of what LSH alone finds, not a proof that every
+pair reaching the threshold is found: check_recall() runs the brute-force
+comparison on a sample to measure how many verified pairs are missed.
+
+Usage (from merge_data.ipynb):
+    from lyrics_lsh import merge_by_lyrics
+    merged_df = merge_by_lyrics(df, output_path='merged_final_lyric.csv', lyric_threshold=70)
+"""
+
+import logging
+import multiprocessing as mp
+import os
+import random
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+import pandas as pd
+from rapidfuzz import fuzz
+from rapidfuzz.process import cpdist
+
+logger = logging.getLogger(__name__)
+
+SHINGLE_SIZE = 5
+NUM_PERM = 128
+BANDS = 32
+ROWS = NUM_PERM // BANDS
+CHUNK_SIZE = 2000           # songs per task in the signature pool
+VERIFY_BATCH = 200_000      # candidate pairs per cpdist call
+SKETCH_SIZE = 64            # shingles per song in the containment index
+MIN_CONTAINMENT = 0.2       # share of the shorter song's sketch found in the longer song
+MAX_POSTINGS = 1000         # sketch shingles shared by more songs are too common to index
+
+_SEED = 20240601
+_rng = np.random.default_rng(_SEED)
+_PERM_A = _rng.integers(1, 2**63, size=NUM_PERM, dtype=np.uint64) | np.uint64(1)
+_PERM_B = _rng.integers(0, 2**63, size=NUM_PERM, dtype=np.uint64)
+_BASE = np.uint64(1_000_003)
+_EMPTY = np.full(NUM_PERM, np.iinfo(np.uint32).max, dtype=np.uint32)
+
+
+# =========================
+# HELPERS (same as the notebook)
+# =========================
+def merge_unique_case_insensitive(a, b):
+    """Merge 2 list, loại bỏ trùng lặp (case-insensitive)"""
+    merged = []
+    seen = set()
+    for lst in (a, b):
+        if lst:
+            for item in lst:
+                if not isinstance(item, str):
+                    continue
+                key = item.lower().strip()
+                if key not in seen and key != '':
+                    seen.add(key)
+                    merged.append(item.strip())
+    return merged
+
+
+def is_empty(x):
+    """Kiểm tra giá trị rỗng"""
+    if x is None:
+        return True
+    if isinstance(x, (list, tuple, set)):
+        return len(x) == 0
+    if isinstance(x, str):
+        return x.strip() == ''
+    try:
+        return pd.isna(x)
+    except Exception:
+        return False
+
+
+def pick(a, b):
+    """Chọn giá trị không rỗng"""
+    return a if not is_empty(a) else b
+
+
+def merge_rows_lyric(r1, r2):
+    """Gộp 2 dòng dựa trên lyric giống nhau"""
+    return {
+        'title': pick(r1.get('title'), r2.get('title')),
+        'composers': merge_unique_case_insensitive(r1.get('composers'), r2.get('composers')),
+        'lyricists': merge_unique_case_insensitive(r1.get('lyricists'), r2.get('lyricists')),
+        'year': pick(r1.get('year'), r2.get('year')),
+        'genres': merge_unique_case_insensitive(r1.get('genres'), r2.get('genres')),
+        'lyrics': pick(r1.get('lyrics'), r2.get('lyrics')),
+        'urls': merge_unique_case_insensitive(r1.get('urls'), r2.get('urls')),
+        'source': pick(r1.get('source'), r2.get('source')),
+        'note': pick(r1.get('note'), r2.get('note'))
+    }
+
+
+def lyrics_text(x) -> str:
+    """Lyrics as compared by partial_ratio; missing lyrics are empty (never merged)"""
+    if is_empty(x):
+        return ''
+    return str(x).strip()
+
+
+# =========================
+# MINHASH
+# =========================
+def shingle_hashes(text: str, k: int = SHINGLE_SIZE) -> np.ndarray:
+    """Distinct 64-bit rolling hashes of the character k-grams of text"""
+    text = ' '.join(text.lower().split())
+    if not text:
+        return np.empty(0, dtype=np.uint64)
+    codes = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32).astype(np.uint64)
+    if len(codes) <= k:
+        k = len(codes)
+    h = np.zeros(len(codes) - k + 1, dtype=np.uint64)
+    for j in range(k):
+        h = h * _BASE + codes[j:len(codes) - k + 1 + j]
+    return np.unique(h)
+
+
+def minhash(text: str) -> np.ndarray:
+    """NUM_PERM uint32 MinHash values (multiply-shift hashing of the shingles)"""
+    x = shingle_hashes(text)
+    if not len(x):
+        return _EMPTY
+    hashed = (_PERM_A[:, None] * x[None, :] + _PERM_B[:, None]) >> np.uint64(32)
+    return hashed.min(axis=1).astype(np.uint32)
+
+
+def sketch(x: np.ndarray, k: int = SKETCH_SIZE) -> np.ndarray:
+    """k of the shingle hashes x, the smallest under a mixing hash (uniform sample of the set)"""
+    if len(x) <= k:
+        return x
+    return x[np.argpartition(x * _PERM_A[0] + _PERM_B[0], k)[:k]]
+
+
+def _signature_chunk(texts: List[str]) -> np.ndarray:
+    return np.stack([minhash(t) for t in texts]) if texts else np.empty((0, NUM_PERM), np.uint32)
+
+
+def signatures(texts: List[str], workers: Optional[int] = None) -> np.ndarray:
+    """[n, NUM_PERM] MinHash signatures, computed in a process pool"""
+    workers = workers or os.cpu_count() or 1
+    chunks = [texts[i:i + CHUNK_SIZE] for i in range(0, len(texts), CHUNK_SIZE)]
+    if workers <= 1 or len(chunks) <= 1:
+        parts = [_signature_chunk(c) for c in chunks]
+    else:
+        with mp.get_context().Pool(workers) as pool:
+            parts = pool.map(_signature_chunk, chunks)
+    return np.concatenate(parts) if parts else np.empty((0, NUM_PERM), np.uint32)
+
+
+# =========================
+# LSH CANDIDATES + VERIFY
+# =========================
+def candidate_pairs(sigs: np.ndarray, has_text: np.ndarray) -> Set[Tuple[int, int]]:
+    """(i, j), i < j, for songs sharing at least one LSH band bucket"""
+    pairs = set()
+    rows = np.flatnonzero(has_text)
+    for band in range(BANDS):
+        block = np.ascontiguousarray(sigs[rows, band * ROWS:(band + 1) * ROWS])
+        buckets: Dict[bytes, List[int]] = defaultdict(list)
+        for row, key in zip(rows.tolist(), block.view(f'V{block.itemsize * ROWS}').ravel().tolist()):
+            buckets[key].append(row)
+        for members in buckets.values():
+            if len(members) < 2:
+                continue
+            for a in range(len(members)):
+                for b in range(a + 1, len(members)):
+                    pairs.add((members[a], members[b]))
+    return pairs
+
+
+def containment_pairs(texts: List[str], has_text: np.ndarray) -> Set[Tuple[int, int]]:
+    """(i, j), i < j, where the shorter text has >= MIN_CONTAINMENT of its sketch in the longer one"""
+    rows = np.flatnonzero(has_text)
+    if not len(rows):
+        return set()
+    sketches = [sketch(shingle_hashes(texts[r])) for r in rows]
+    hashes = np.concatenate(sketches)
+    songs = np.repeat(rows, [len(sk) for sk in sketches])
+    order = np.argsort(hashes, kind='stable')
+    hashes, songs = hashes[order], songs[order]
+    keys, starts, counts = np.unique(hashes, return_index=True, return_counts=True)
+
+    # shingle quá phổ biến (vd. "anh y") chỉ sinh ứng viên rác -> không index
+    keep = counts <= MAX_POSTINGS
+    kept = np.bincount(songs[np.repeat(keep, counts)], minlength=len(texts))
+    need = np.maximum(np.ceil(MIN_CONTAINMENT * kept), np.minimum(2, kept))
+    keys, starts, counts = keys[keep], starts[keep], counts[keep]
+    lengths = np.array([len(t) for t in texts])
+
+    pairs = set()
+    if not len(keys):
+        return pairs
+    for j in rows.tolist():
+        x = shingle_hashes(texts[j])
+        pos = np.minimum(np.searchsorted(keys, x), len(keys) - 1)
+        pos = pos[keys[pos] == x]
+        if not len(pos):
+            continue
+        st, ct = starts[pos], counts[pos]
+        offsets = np.arange(ct.sum()) - np.repeat(np.cumsum(ct) - ct, ct)
+        ids, hits = np.unique(songs[np.repeat(st, ct) + offsets], return_counts=True)
+        ok = (kept[ids] > 0) & (hits >= need[ids]) & (ids != j) & (lengths[ids] <= lengths[j])
+        for i in ids[ok].tolist():
+            pairs.add((min(i, j), max(i, j)))
+    return pairs
+
+
+def verify_pairs(texts: List[str], pairs, lyric_threshold: int,
+                 max_len_diff: Optional[float] = None, workers: int = -1) -> Dict[int, List[int]]:
+    """i -> sorted j > i with fuzz.partial_ratio(texts[i], texts[j]) >= lyric_threshold"""
+    pairs = sorted(pairs)
+    if max_len_diff is not None:
+        pairs = [(i, j) for i, j in pairs
+                 if abs(len(texts[i]) - len(texts[j])) / max(len(texts[i]), len(texts[j])) <= max_len_diff]
+
+    matches: Dict[int, List[int]] = defaultdict(list)
+    for start in range(0, len(pairs), VERIFY_BATCH):
+        batch = pairs[start:start + VERIFY_BATCH]
+        scores = cpdist([texts[i] for i, _ in batch], [texts[j] for _, j in batch],
+                        scorer=fuzz.partial_ratio, score_cutoff=lyric_threshold, workers=workers)
+        for (i, j), score in zip(batch, scores):
+            if score >= lyric_threshold:
+                matches[i].append(j)
+    return matches
+
+
+def similar_pairs(texts: List[str], lyric_threshold: int = 70,
+                  max_len_diff: Optional[float] = None,
+                  workers: Optional[int] = None) -> Dict[int, List[int]]:
+    """LSH + containment candidates verified with partial_ratio, as i -> [j, ...] (j > i, ascending)"""
+    has_text = np.array([bool(t) for t in texts], dtype=bool)
+    sigs = signatures(texts, workers)
+    pairs = candidate_pairs(sigs, has_text)
+    contained = containment_pairs(texts, has_text)
+    logger.info(f"🔧 LSH: {len(pairs):,} cặp ứng viên, containment: {len(contained - pairs):,} cặp thêm "
+                f"cho {int(has_text.sum()):,} lyric")
+    pairs |= contained
+    matches = verify_pairs(texts, pairs, lyric_threshold, max_len_diff, workers or -1)
+    logger.info(f"✅ {sum(len(v) for v in matches.values()):,} cặp đạt partial_ratio ≥ {lyric_threshold}%")
+    return matches
+
+
+def check_recall(texts: List[str], lyric_threshold: int = 70, sample: int = 2000,
+                 max_len_diff: Optional[float] = None, seed: int = 0) -> float:
+    """
+    Brute-force all pairs of a random sample and return the share of verified
+    pairs that the LSH candidates also find (1.0 = nothing missed)
+    """
+    idx = sorted(random.Random(seed).sample(range(len(texts)), min(sample, len(texts))))
+    sub = [texts[i] for i in idx]
+    found = similar_pairs(sub, lyric_threshold, max_len_diff)
+    truth = verify_pairs(sub, ((i, j) for i in range(len(sub)) if sub[i]
+                               for j in range(i + 1, len(sub)) if sub[j]),
+                         lyric_threshold, max_len_diff)
+    n_truth = sum(len(v) for v in truth.values())
+    if not n_truth:
+        return 1.0
+    hit = sum(len(set(v) & set(found.get(i, []))) for i, v in truth.items())
+    logger.info(f"🎯 Recall trên {len(sub):,} bài: {hit:,}/{n_truth:,} cặp")
+    return hit / n_truth
+
+
+# =========================
+# MERGE
+# =========================
+def merge_by_lyrics(df: pd.DataFrame, output_path: str = 'merged_final_lyric.csv',
+                    lyric_threshold: int = 70, max_len_diff: Optional[float] = None,
+                    workers: Optional[int] = None) -> pd.DataFrame:
+    """
+    Same merge rule as the brute-force merge_by_lyrics: row i is merged with the
+    first later row j (not merged yet) whose lyrics reach lyric_threshold,
+    among the candidate pairs (see check_recall for what the candidates miss).
+    max_len_diff=0.5 reproduces the length filter of the optimized cell.
+    """
+    start_time = datetime.now()
+    logger.info("=" * 60)
+    logger.info("🎵 BẮT ĐẦU MERGE LYRICS (MinHash + LSH)")
+    logger.info(f"📊 Dữ liệu: {len(df)} dòng")
+    logger.info(f"🎯 Ngưỡng: {lyric_threshold}%")
+    logger.info("=" * 60)
+
+    df = df.reset_index(drop=True)
+    texts = [lyrics_text(x) for x in df['lyrics']] if 'lyrics' in df.columns else [''] * len(df)
+    matches = similar_pairs(texts, lyric_threshold, max_len_diff, workers)
+
+    records = df.to_dict('records')
+    merged_rows = []
+    merged_idx = set()
+    total_merge = 0
+    for i, row_i in enumerate(records):
+        if i in merged_idx:
+            continue
+        j = next((j for j in matches.get(i, ()) if j not in merged_idx), None)
+        if j is None:
+            merged_rows.append(row_i)
+            continue
+        merged_rows.append(merge_rows_lyric(row_i, records[j]))
+        merged_idx.add(j)
+        total_merge += 1
+        logger.debug(f"✓ Merged pair: {i} + {j}")
+
+    merged_df = pd.DataFrame(merged_rows)
+    merged_df.to_csv(output_path, index=False, encoding='utf-8-sig')
+
+    elapsed = datetime.now() - start_time
+    logger.info("=" * 60)
+    logger.info(f"✅ HOÀN TẤT MERGE LYRICS")
+    logger.info(f"   - Đã merge: {total_merge} cặp")
+    logger.info(f"   - Trước: {len(df)} bài")
+    logger.info(f"   - Sau: {len(merged_df)} bài")
+    logger.info(f"⏱️  Thời gian: {elapsed}")
+    logger.info(f"💾 File: {output_path}")
+    logger.info("=" * 60)
+    return merged_df
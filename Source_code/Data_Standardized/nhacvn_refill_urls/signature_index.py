@@ -0,0 +1,85 @@
+"""
+signature_index.py
+Blocked fuzzy matcher for refill_nhacvn_urls.ipynb.
+
+process.extractOne(sig, ref_signatures, scorer=fuzz.token_set_ratio) scans
+the whole nhac.vn reference for every target row. Here the reference
+signatures (make_signature / signature_from_parts) are indexed once:
+
+    1. character 3-gram TF-IDF vectors (sparse, L2-normalized)
+    2. per query, the top_k references by cosine = sparse dot product,
+       computed for a whole batch of queries at once
+    3. the final score is still fuzz.token_set_ratio, computed on the
+       (query, candidate) pairs with rapidfuzz cpdist across worker threads
+
+The best candidate (ties -> lowest reference position, like extractOne) is
+returned with its score; thresholds are applied by the caller as before.
+
+Usage:
+    index = SignatureIndex(ref_signatures)
+    for pos, score in index.best_matches(query_signatures):
+        ...   # pos = -1 when no reference shares a 3-gram with the query
+"""
+
+from typing import List, Sequence, Tuple
+
+import numpy as np
+from rapidfuzz import fuzz
+from rapidfuzz.process import cpdist
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+NGRAM = 3
+TOP_K = 50          # candidates verified per query
+BATCH_SIZE = 2000   # queries per sparse product / cpdist call
+
+
+class SignatureIndex:
+    def __init__(self, signatures: Sequence[str], ngram: int = NGRAM):
+        self.signatures = [s if isinstance(s, str) else '' for s in signatures]
+        self.vectorizer = TfidfVectorizer(analyzer='char_wb', ngram_range=(ngram, ngram),
+                                          lowercase=False, dtype=np.float32)
+        self.matrix_t = self.vectorizer.fit_transform(self.signatures).T.tocsr()
+
+    def __len__(self) -> int:
+        return len(self.signatures)
+
+    def candidates(self, queries: Sequence[str], top_k: int = TOP_K) -> List[np.ndarray]:
+        """Reference positions of the top_k most similar signatures for every query"""
+        out = []
+        for start in range(0, len(queries), BATCH_SIZE):
+            batch = [q if isinstance(q, str) else '' for q in queries[start:start + BATCH_SIZE]]
+            sims = (self.vectorizer.transform(batch) @ self.matrix_t).tocsr()
+            for row in range(sims.shape[0]):
+                lo, hi = sims.indptr[row], sims.indptr[row + 1]
+                cols, vals = sims.indices[lo:hi], sims.data[lo:hi]
+                if len(cols) > top_k:
+                    keep = np.argpartition(-vals, top_k - 1)[:top_k]
+                    cols = cols[keep]
+                out.append(np.sort(cols))
+        return out
+
+    def best_matches(self, queries: Sequence[str], top_k: int = TOP_K,
+                     scorer=fuzz.token_set_ratio, workers: int = -1) -> List[Tuple[int, float]]:
+        """(reference position, score) of the best candidate per query, (-1, 0) if none"""
+        results = []
+        for start in range(0, len(queries), BATCH_SIZE):
+            batch = list(queries[start:start + BATCH_SIZE])
+            cands = self.candidates(batch, top_k)
+            lengths = [len(c) for c in cands]
+            flat = np.concatenate(cands) if cands else np.empty(0, dtype=np.int64)
+            scores = cpdist(
+                [q for q, n in zip(batch, lengths) for _ in range(n)],
+                [self.signatures[i] for i in flat.tolist()],
+                scorer=scorer, workers=workers,
+            ) if len(flat) else np.empty(0)
+
+            offset = 0
+            for n in lengths:
+                if not n:
+                    results.append((-1, 0))
+                    continue
+                seg = scores[offset:offset + n]
+                best = int(np.argmax(seg))      # candidates are sorted -> first max = lowest position
+                results.append((int(flat[offset + best]), float(seg[best])))
+                offset += n
+        return results
@@ -1,12 +1,13 @@
+import asyncio
+import csv
 import pandas as pd
-import requests
-import time
-import re
 import logging
 from tqdm import tqdm
 from datetime import datetime
 import os
 
+from year_lookup import FAILED, LookupCache, YearLookup, lookup_many
+
 # ==================== LOGGING CONFIG ====================
 logging.basicConfig(
     level=logging.INFO,
@@ -20,7 +21,10 @@ logger.info("=== Bắt đầu điền cột 'year' sử dụng MusicBrainz + Wik
 # ==================== FILE I/O ====================
 input_file = "l3/nhacvn.csv"
 output_file = "yearFiller/yearFiller_nhacvn_output.csv"
-checkpoint_file = "yearFiller/checkpoint_years.csv"
+journal_file = "yearFiller/year_journal.csv"    # append-only: idx,title,year,source,status mỗi bài xong 1 dòng
+cache_file = "yearFiller/year_cache.db"         # kết quả từng provider theo title + nhạc sĩ đầu (year_lookup.LookupCache)
+JOURNAL_FIELDS = ["idx", "title", "year", "source", "status"]
+# status: found / not_found (mọi provider đều trả lời) / failed (provider lỗi, timeout, bị chặn)
 
 # Đọc dữ liệu
 try:
@@ -37,169 +41,102 @@ for col in ["year", "note"]:
         df[col] = ""
 df["note"] = df["note"].astype(str)
 
-# ==================== HÀM 1: MusicBrainz ====================
-def get_song_year_musicbrainz(title, artist=None):
-    try:
-        query = title
-        if artist:
-            query += f" AND artist:{artist}"
-
-        url = f"https://musicbrainz.org/ws/2/recording/?query={query}&fmt=json&limit=1"
-        headers = {"User-Agent": "NhacVN-YearFiller/1.0 (example@gmail.com)"}
-        r = requests.get(url, headers=headers, timeout=15)
-        r.raise_for_status()
-        data = r.json()
-
-        recordings = data.get("recordings", [])
-        if not recordings:
-            return None
-
-        rec = recordings[0]
-        releases = rec.get("releases", [])
-        if not releases:
-            return None
-
-        date = releases[0].get("date", "")
-        if not date:
-            return None
-
-        match = re.search(r"\b(19|20)\d{2}\b", date)
-        if match:
-            return int(match.group(0))
-        return None
-    except Exception as e:
-        logger.warning(f"[MusicBrainz] Lỗi truy vấn {title}: {e}")
-        return None
-
-# ==================== HÀM 2: Wikipedia (có User-Agent và fallback) ====================
-def get_song_year_wikipedia(title):
-    try:
-        headers = {
-            "User-Agent": "NhacVN-YearFiller/1.0 (https://github.com/duynguyen or contact@example.com)"
-        }
-
-        base_urls = [
-            "https://vi.wikipedia.org/w/api.php",
-            "https://en.wikipedia.org/w/api.php",  # fallback nếu tiếng Việt bị chặn
-        ]
-
-        for base_url in base_urls:
-            params = {
-                "action": "query",
-                "list": "search",
-                "srsearch": title,
-                "format": "json",
-                "utf8": 1,
-                "srlimit": 1,
-            }
-            r = requests.get(base_url, params=params, headers=headers, timeout=15)
-            if r.status_code == 403:
-                logger.warning(f"[Wikipedia] {base_url} bị chặn, thử fallback khác...")
-                continue
 
-            r.raise_for_status()
-            data = r.json()
-            search_results = data.get("query", {}).get("search", [])
-            if not search_results:
-                continue
+def result_status(year):
+    if year is FAILED:
+        return "failed"
+    return "found" if year else "not_found"
+
 
-            page_title = search_results[0]["title"]
+def apply_result(idx, year, source):
+    if year is FAILED:
+        df.loc[idx, "note"] = "lỗi khi tra cứu năm phát hành (chạy lại để thử lại)"
+    elif year:
+        df.loc[idx, "year"] = year
+        df.loc[idx, "note"] = f"đã fill 'year' sử dụng {source}"
+    else:
+        df.loc[idx, "note"] = "không tìm thấy thông tin năm phát hành"
 
-            extract_url = f"{base_url.replace('/w/api.php', '')}/api/rest_v1/page/summary/{page_title}"
-            r = requests.get(extract_url, headers=headers, timeout=10)
-            if r.status_code == 403:
-                logger.warning(f"[Wikipedia Summary] {base_url} bị chặn, bỏ qua.")
+
+# ==================== RESUME TỪ JOURNAL ====================
+# Lần chạy trước bị dừng giữa chừng: áp lại các kết quả đã có, chỉ tra cứu phần còn lại.
+# Dòng nào có title không khớp (file input đã đổi) thì bỏ qua. Bài "failed" được tra cứu lại;
+# journal cũ (không có cột status) không phân biệt lỗi với không tìm thấy nên chỉ giữ bài đã có năm
+# (bài thật sự không tìm thấy vẫn nằm trong cache, tra lại không tốn request).
+resumed = set()
+if os.path.exists(journal_file):
+    with open(journal_file, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            try:
+                idx = int(row["idx"])
+            except (TypeError, ValueError):
+                continue    # dòng cuối ghi dở
+            status = row.get("status") or ("found" if row["year"] else "failed")
+            if status == "failed":
                 continue
-            r.raise_for_status()
-            summary_data = r.json()
-            extract = summary_data.get("extract", "")
-
-            match = re.search(r"\b(19|20)\d{2}\b", extract)
-            if match:
-                return int(match.group(0))
-
-        return None
-    except Exception as e:
-        logger.warning(f"[Wikipedia] Lỗi truy vấn {title}: {e}")
-        return None
-
-
-# ==================== HÀM 3: iTunes (Apple Music) ====================
-def get_song_year_itunes(title, artist=None):
-    try:
-        query = title
-        if artist:
-            query += f" {artist}"
-        url = f"https://itunes.apple.com/search"
-        params = {"term": query, "entity": "song", "limit": 1, "country": "us"}
-        r = requests.get(url, params=params, timeout=10)
-        r.raise_for_status()
-        data = r.json()
-
-        results = data.get("results", [])
-        if not results:
-            return None
-
-        release_date = results[0].get("releaseDate", "")
-        if not release_date:
-            return None
-
-        match = re.search(r"\b(19|20)\d{2}\b", release_date)
-        if match:
-            return int(match.group(0))
-        return None
-    except Exception as e:
-        logger.warning(f"[iTunes] Lỗi truy vấn {title}: {e}")
-        return None
+            if idx in df.index and str(df.loc[idx, "title"]) == row["title"]:
+                apply_result(idx, int(row["year"]) if row["year"] else None, row["source"] or None)
+                resumed.add(idx)
+    logger.info(f"📥 Resume {len(resumed)} bài từ journal: {journal_file}")
 
 # ==================== QUY TRÌNH FILL DỮ LIỆU ====================
+# Tra cứu song song (year_lookup.py): mỗi provider có rate limiter riêng,
+# vẫn ưu tiên MusicBrainz > Wikipedia > iTunes
 need_fill = df["year"].isna() | (df["year"].astype(str).str.strip() == "")
-indices = df[need_fill].index.tolist()
+indices = [idx for idx in df[need_fill].index if idx not in resumed]
 logger.info(f"Cần điền 'year' cho {len(indices)} bài hát")
 
-for idx in tqdm(indices, desc="Filling year"):
+songs = []
+for idx in indices:
     title = df.loc[idx, "title"]
     artist = None
     if "composers" in df.columns and isinstance(df.loc[idx, "composers"], str):
         artist = df.loc[idx, "composers"].split(",")[0]
+    songs.append((title, artist))
 
-    # --- Ưu tiên 1: MusicBrainz ---
-    year = get_song_year_musicbrainz(title, artist)
-    source = "MusicBrainz"
+pbar = tqdm(total=len(indices), desc="Filling year")
+new_journal = not os.path.exists(journal_file)
+journal = open(journal_file, "a", newline="", encoding="utf-8")
+journal_writer = csv.DictWriter(journal, fieldnames=JOURNAL_FIELDS)
+if new_journal:
+    journal_writer.writeheader()
 
-    # --- Ưu tiên 2: Wikipedia ---
-    if not year:
-        time.sleep(0.4)
-        year = get_song_year_wikipedia(title)
-        source = "Wikipedia" if year else None
 
-    # --- Ưu tiên 3: iTunes ---
-    if not year:
-        time.sleep(0.4)
-        year = get_song_year_itunes(title, artist)
-        source = "iTunes" if year else None
+failed = []
 
-    # --- Cập nhật kết quả ---
-    if year:
-        df.loc[idx, "year"] = year
-        df.loc[idx, "note"] = f"đã fill 'year' sử dụng {source}"
-    else:
-        df.loc[idx, "note"] = "không tìm thấy thông tin năm phát hành"
 
-    # --- Ghi checkpoint mỗi 10 dòng ---
-    if (idx + 1) % 10 == 0:
-        df.to_csv(checkpoint_file, index=False, encoding="utf-8-sig")
+def on_result(i, year, source):
+    idx = indices[i]
+    apply_result(idx, year, source)
+    # --- Ghi journal: 1 dòng / bài, thay cho ghi lại cả DataFrame mỗi 10 dòng ---
+    status = result_status(year)
+    journal_writer.writerow({"idx": idx, "title": str(df.loc[idx, "title"]),
+                             "year": year if status == "found" else "", "source": source or "", "status": status})
+    if status == "failed":
+        failed.append(idx)
+    journal.flush()
+    pbar.update(1)
+
 
-    # --- Giới hạn tốc độ ---
-    time.sleep(1.0)
+cache = LookupCache(cache_file)
+try:
+    asyncio.run(lookup_many(songs, on_result=on_result, lookup=YearLookup(cache=cache)))
+finally:
+    cache.close()
+    journal.close()
+    pbar.close()
 
 # ==================== GHI FILE CUỐI ====================
 df.to_csv(output_file, index=False, encoding="utf-8-sig")
 logger.info(f"✅ Đã ghi file kết quả: {output_file}")
 
-if os.path.exists(checkpoint_file):
-    os.remove(checkpoint_file)
-    logger.info("🗑️ Đã xóa checkpoint file")
+if failed:
+    # giữ journal: lần chạy sau chỉ tra cứu lại các bài lỗi
+    logger.warning(f"⚠️ {len(failed)} bài lỗi khi tra cứu (không ghi là 'không tìm thấy'), "
+                   f"giữ journal {journal_file}: chạy lại để thử lại")
+elif os.path.exists(journal_file):
+    os.remove(journal_file)
+    logger.info("🗑️ Đã xóa journal file")
 
 elapsed = datetime.now() - start_time
 logger.info(f"⏱️ Thời gian chạy: {elapsed}")
@@ -0,0 +1,317 @@
+"""
+year_lookup.py
+Concurrent release-year lookup for yearFiller.py.
+
+Same providers, queries and year parsing as the old sequential functions
+(MusicBrainz > Wikipedia vi/en > iTunes), but:
+
+    - many songs are looked up at once (asyncio, one aiohttp session)
+    - every provider has its own token bucket matched to its published limit,
+      instead of fixed time.sleep() between calls
+    - for one song all providers start together; the answer is still taken in
+      priority order (MusicBrainz wins over Wikipedia over iTunes), and as soon
+      as a higher-priority provider returns a year the lower ones are cancelled.
+      A cancelled request that is still waiting for its bucket costs nothing,
+      so slow-quota providers (iTunes) are only spent on songs the others miss.
+
+With a LookupCache every provider answer is kept on disk per (normalized
+title + first composer, provider): years forever, "not found" for
+NEGATIVE_TTL seconds, errors never. lookup_many() also queries each distinct
+key once, however many rows share it.
+
+A song with no year is "not found" only if every provider answered; when any
+of them failed (error, timeout, blocked) the result is (FAILED, None), so the
+caller can retry it instead of recording it as not found.
+
+Base URLs can be pointed at local stand-in servers (constructor or env:
+YEAR_MUSICBRAINZ_URL, YEAR_WIKIPEDIA_URLS (comma separated), YEAR_ITUNES_URL).
+
+Usage:
+    cache = LookupCache("yearFiller/year_cache.db")
+    results = asyncio.run(lookup_many([(title, artist), ...], on_result=callback,
+                                      lookup=YearLookup(cache=cache)))
+    # callback(i, year, source) is called as soon as song i is resolved; year is FAILED on errors
+"""
+
+import asyncio
+import logging
+import os
+import re
+import sqlite3
+import sys
+import time
+import unicodedata
+from typing import Callable, List, Optional, Sequence, Tuple
+from urllib.parse import quote
+
+import aiohttp
+
+try:
+    from token_bucket import TokenBucket
+except ImportError:     # launched from inside the repo: token_bucket.py lives in Source_code/
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+    from token_bucket import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+MUSICBRAINZ_URL = os.environ.get("YEAR_MUSICBRAINZ_URL", "https://musicbrainz.org/ws/2/recording/")
+WIKIPEDIA_URLS = os.environ.get(
+    "YEAR_WIKIPEDIA_URLS",
+    "https://vi.wikipedia.org/w/api.php,https://en.wikipedia.org/w/api.php",  # en: fallback nếu tiếng Việt bị chặn
+).split(",")
+ITUNES_URL = os.environ.get("YEAR_ITUNES_URL", "https://itunes.apple.com/search")
+
+# requests/second (burst) per provider, theo giới hạn công bố
+RATES = {
+    "MusicBrainz": (1.0, 1),    # 1 req/s mỗi IP
+    "Wikipedia": (5.0, 5),      # API không giới hạn cứng, giữ lịch sự
+    "iTunes": (20 / 60, 1),     # ~20 req/phút
+}
+PRIORITY = ["MusicBrainz", "Wikipedia", "iTunes"]
+SONG_CONCURRENCY = 20   # số bài tra cứu cùng lúc
+REQUEST_TIMEOUT = 15
+NEGATIVE_TTL = 30 * 24 * 3600   # "không tìm thấy" được tin trong 30 ngày, sau đó hỏi lại
+
+MB_HEADERS = {"User-Agent": "NhacVN-YearFiller/1.0 (example@gmail.com)"}
+WIKI_HEADERS = {"User-Agent": "NhacVN-YearFiller/1.0 (https://github.com/duynguyen or contact@example.com)"}
+
+YEAR_PATTERN = re.compile(r"\b(19|20)\d{2}\b")
+FAILED = object()   # provider error / blocked: not an answer, not cached
+
+
+def parse_year(text: str) -> Optional[int]:
+    match = YEAR_PATTERN.search(text or "")
+    return int(match.group(0)) if match else None
+
+
+def normalize(text) -> str:
+    if not isinstance(text, str):
+        return ""
+    return " ".join(unicodedata.normalize("NFC", text).lower().split())
+
+
+def song_key(title, artist=None) -> str:
+    """normalized title + first composer"""
+    return f"{normalize(title)}|{normalize(artist)}"
+
+
+class LookupCache:
+    """(song key, provider) -> year or None (not found), SQLite"""
+
+    def __init__(self, path: str, negative_ttl: float = NEGATIVE_TTL):
+        self.negative_ttl = negative_ttl
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+        CREATE TABLE IF NOT EXISTS lookups (
+            key TEXT,
+            provider TEXT,
+            year INTEGER,
+            fetched_at REAL,
+            PRIMARY KEY (key, provider)
+        )""")
+        self.conn.commit()
+
+    def get(self, key: str, provider: str) -> Tuple[bool, Optional[int]]:
+        """(hit, year); an expired negative answer is a miss"""
+        row = self.conn.execute("SELECT year, fetched_at FROM lookups WHERE key=? AND provider=?",
+                                (key, provider)).fetchone()
+        if row is None:
+            return False, None
+        year, fetched_at = row
+        if year is None and time.time() - fetched_at > self.negative_ttl:
+            return False, None
+        return True, year
+
+    def put(self, key: str, provider: str, year: Optional[int]):
+        self.conn.execute("REPLACE INTO lookups(key, provider, year, fetched_at) VALUES (?, ?, ?, ?)",
+                          (key, provider, year, time.time()))
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+class YearLookup:
+    def __init__(self, musicbrainz_url: str = MUSICBRAINZ_URL, wikipedia_urls: Sequence[str] = WIKIPEDIA_URLS,
+                 itunes_url: str = ITUNES_URL, rates: Optional[dict] = None, timeout: float = REQUEST_TIMEOUT,
+                 cache: Optional[LookupCache] = None):
+        self.musicbrainz_url = musicbrainz_url
+        self.wikipedia_urls = list(wikipedia_urls)
+        self.itunes_url = itunes_url
+        self.buckets = {name: TokenBucket(rate, burst) for name, (rate, burst) in {**RATES, **(rates or {})}.items()}
+        self.timeout = timeout
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.cache = cache
+        self.requests = {name: 0 for name in PRIORITY}
+        self.cache_hits = 0
+        self.cancelled = 0
+
+    async def __aenter__(self) -> "YearLookup":
+        self.session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.session.close()
+
+    async def _get(self, provider: str, url: str, params=None, headers=None):
+        """(status, json or None); waits for the provider's bucket first"""
+        await self.buckets[provider].acquire()
+        self.requests[provider] += 1
+        async with self.session.get(url, params=params, headers=headers) as r:
+            if r.status == 403:
+                return r.status, None
+            r.raise_for_status()
+            return r.status, await r.json(content_type=None)
+
+    # ==================== HÀM 1: MusicBrainz ====================
+    async def musicbrainz(self, title, artist=None) -> Optional[int]:
+        try:
+            query = title
+            if artist:
+                query += f" AND artist:{artist}"
+            _, data = await self._get("MusicBrainz", self.musicbrainz_url,
+                                      params={"query": query, "fmt": "json", "limit": 1}, headers=MB_HEADERS)
+            recordings = (data or {}).get("recordings", [])
+            if not recordings:
+                return None
+            releases = recordings[0].get("releases", [])
+            if not releases:
+                return None
+            return parse_year(releases[0].get("date", ""))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"[MusicBrainz] Lỗi truy vấn {title}: {e}")
+            return FAILED
+
+    # ==================== HÀM 2: Wikipedia (có User-Agent và fallback) ====================
+    async def wikipedia(self, title, artist=None) -> Optional[int]:
+        try:
+            blocked = False
+            for base_url in self.wikipedia_urls:
+                params = {"action": "query", "list": "search", "srsearch": title,
+                          "format": "json", "utf8": 1, "srlimit": 1}
+                status, data = await self._get("Wikipedia", base_url, params=params, headers=WIKI_HEADERS)
+                if status == 403:
+                    logger.warning(f"[Wikipedia] {base_url} bị chặn, thử fallback khác...")
+                    blocked = True
+                    continue
+                search_results = (data or {}).get("query", {}).get("search", [])
+                if not search_results:
+                    continue
+
+                page_title = search_results[0]["title"]
+                extract_url = f"{base_url.replace('/w/api.php', '')}/api/rest_v1/page/summary/{quote(page_title)}"
+                status, summary_data = await self._get("Wikipedia", extract_url, headers=WIKI_HEADERS)
+                if status == 403:
+                    logger.warning(f"[Wikipedia Summary] {base_url} bị chặn, bỏ qua.")
+                    blocked = True
+                    continue
+                year = parse_year((summary_data or {}).get("extract", ""))
+                if year:
+                    return year
+            return FAILED if blocked else None
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"[Wikipedia] Lỗi truy vấn {title}: {e}")
+            return FAILED
+
+    # ==================== HÀM 3: iTunes (Apple Music) ====================
+    async def itunes(self, title, artist=None) -> Optional[int]:
+        try:
+            query = title
+            if artist:
+                query += f" {artist}"
+            _, data = await self._get("iTunes", self.itunes_url,
+                                      params={"term": query, "entity": "song", "limit": 1, "country": "us"})
+            results = (data or {}).get("results", [])
+            if not results:
+                return None
+            return parse_year(results[0].get("releaseDate", ""))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"[iTunes] Lỗi truy vấn {title}: {e}")
+            return FAILED
+
+    # ==================== RESOLVER ====================
+    async def lookup(self, title, artist=None) -> Tuple[Optional[int], Optional[str]]:
+        """
+        (year, source) with the old priority; lower-priority lookups are cancelled once
+        it is decided. (None, None) = not found, (FAILED, None) = no year and a provider failed
+        """
+        providers = {"MusicBrainz": self.musicbrainz, "Wikipedia": self.wikipedia, "iTunes": self.itunes}
+        key = song_key(title, artist)
+
+        # cached answers first: providers below a cached year are never started
+        cached = {}
+        if self.cache is not None:
+            for name in PRIORITY:
+                hit, year = self.cache.get(key, name)
+                if hit:
+                    self.cache_hits += 1
+                    cached[name] = year
+                    if year:
+                        break
+
+        async def ask(name):
+            if name in cached:
+                return cached[name]
+            year = await providers[name](title, artist)
+            if year is FAILED:
+                return FAILED
+            if self.cache is not None:
+                self.cache.put(key, name, year)
+            return year
+
+        stop = next((i + 1 for i, name in enumerate(PRIORITY) if cached.get(name)), len(PRIORITY))
+        tasks = [(name, asyncio.ensure_future(ask(name))) for name in PRIORITY[:stop]]
+        failed = False
+        try:
+            for i, (name, task) in enumerate(tasks):
+                year = await task
+                if year is FAILED:
+                    failed = True
+                elif year:
+                    for _, lower in tasks[i + 1:]:
+                        if not lower.done():
+                            lower.cancel()
+                            self.cancelled += 1
+                    return year, name
+            return (FAILED, None) if failed else (None, None)
+        finally:
+            for _, task in tasks:
+                task.cancel()
+
+
+async def lookup_many(songs: List[Tuple[str, Optional[str]]], concurrency: int = SONG_CONCURRENCY,
+                      on_result: Optional[Callable[[int, Optional[int], Optional[str]], None]] = None,
+                      lookup: Optional[YearLookup] = None) -> List[Tuple[Optional[int], Optional[str]]]:
+    """
+    (year, source) for every (title, artist); on_result(i, year, source) as each song finishes.
+    Songs with the same key (normalized title + first composer) are looked up once.
+    """
+    lookup = lookup or YearLookup()
+    results: List[Tuple[Optional[int], Optional[str]]] = [(None, None)] * len(songs)
+    groups = {}
+    for i, (title, artist) in enumerate(songs):
+        groups.setdefault(song_key(title, artist), []).append(i)
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(rows):
+        title, artist = songs[rows[0]]
+        async with sem:
+            res = await lookup.lookup(title, artist)
+        for i in rows:
+            results[i] = res
+            if on_result is not None:
+                on_result(i, *res)
+
+    async with lookup:
+        await asyncio.gather(*(one(rows) for rows in groups.values()))
+    logger.info(f"📡 {len(groups)} key khác nhau / {len(songs)} bài | requests: {lookup.requests}, "
+                f"cache hit: {lookup.cache_hits}, huỷ {lookup.cancelled} lookup ưu tiên thấp")
+    return results
@@ -0,0 +1,647 @@
+#!/usr/bin/env python3
+"""
+pipeline.py
+Stage-cached runner for Crawl -> Standardize -> Merge -> Label -> Analyze.
+
+Every existing step is declared once in STAGES with its inputs and outputs
+(paths relative to the data dir, instead of the hardcoded /Users/copy/...
+paths and hand-named CSVs of the notebooks):
+
+    python   a function below that calls the repo modules
+             (converter, fused_normalizer, dict_bundle + fused_labeler,
+             token_store, token_index, analysis_matrices)
+    notebook the listed cells of a notebook, run top to bottom in one
+             namespace (like "Run All" on those cells). File names that were
+             edited by hand between runs are given as per-cell replacements;
+             a replacement that no longer matches the cell is an error.
+    script   a script run as __main__ (yearFiller.py)
+
+Stages whose inputs no other stage produces (crawler output, the N0x_*_final
+CSVs, hand-cleaned datasets) are the sources of the graph and must already be
+in the data dir.
+
+Fingerprint of a stage = sha256 over
+    code:    source of the selected cells / the stage function + the module files it uses
+    inputs:  bytes of every input file (directories: every file inside)
+    dicts:   bytes of the thuvien dictionaries it reads
+A stage is skipped when its fingerprint equals the one of its last successful
+run and its outputs are still the files that run wrote. File digests are cached
+by (size, mtime), so unchanged files are not re-read. Editing english.csv only
+changes the fingerprint of `label`; the stages after it rerun only if its
+outputs actually changed, the crawl / standardize / merge stages stay cached.
+
+Each stage runs in its own process (cwd = its work dir, log in
+.pipeline/logs/<stage>.log); stages whose upstream stages are done run in
+parallel, up to --jobs at a time (e.g. standardize_nhacvn / standardize_tkaraoke,
+token_index / matrices).
+
+Usage:
+    python pipeline.py list
+    python pipeline.py status --data-dir /path/to/Labeling      # what would run and why
+    python pipeline.py run --data-dir /path/to/Labeling
+    python pipeline.py run label matrices                      # these stages + what they need
+    python pipeline.py run standardize --force                  # every stage of a group, ignoring the cache
+"""
+
+import argparse
+import hashlib
+import inspect
+import json
+import os
+import runpy
+import subprocess
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.environ.get("LYRICS_DATA_DIR", os.path.join(HERE, "data"))
+STATE_DIR_NAME = ".pipeline"
+STATE_FILE = "state.json"
+JOBS = 4                # số stage chạy song song
+LOG_TAIL = 15           # số dòng log in ra khi stage lỗi
+
+STANDARDIZE_DIR = os.path.join(HERE, "Data_Standardized")
+CALCULATE_DIR = os.path.join(HERE, "Calculate_and_Analysis", "Calculate_Analysis")
+CONVERTER = os.path.join(HERE, "Data_Crawler", "tkaraoke", "converter.py")
+PROCESSING_NB = os.path.join(STANDARDIZE_DIR, "tkaraoke_nhacvn_standardized", "Processing.ipynb")
+MERGE_NB = os.path.join(STANDARDIZE_DIR, "merge_data", "merge_data.ipynb")
+REFILL_NB = os.path.join(STANDARDIZE_DIR, "nhacvn_refill_urls", "refill_nhacvn_urls.ipynb")
+CALCULATE_NB = os.path.join(CALCULATE_DIR, "calculate.ipynb")
+YEAR_FILLER = os.path.join(STANDARDIZE_DIR, "year_filler", "yearFiller.py")
+
+# imports của CELL 1 (Processing.ipynb) mà các cell được chọn dùng tới
+NOTEBOOK_PRELUDE = "import ast\nimport re\n\nimport numpy as np\nimport pandas as pd\n"
+CALCULATE_PREFIX = "/Users/copy/Downloads/TDTU/Labeling/Calculate_Analysis/"
+
+# từ điển trong thuvien mà từng bước đọc
+NORMALIZER_DICTS = ("teencode.csv", "noise.csv")
+LABELER_DICTS = ("phien_am.csv", "ten_rieng_no_common.csv", "han_viet_filtered.csv",
+                 "vietnamese.csv", "english.csv", "llm_labels.csv")
+
+
+class Stage(NamedTuple):
+    name: str
+    group: str                          # crawl | standardize | merge | labeling | analyze
+    inputs: Tuple[str, ...]             # relative to the data dir
+    outputs: Tuple[str, ...]
+    workdir: str = "."
+    run: Optional[Callable[[str, str], None]] = None     # python: run(data_dir, thuvien_dir)
+    notebook: Optional[str] = None
+    cells: Tuple[int, ...] = ()
+    replace: Dict[int, Dict[str, str]] = {}             # cell -> {old: new}
+    script: Optional[str] = None
+    code: Tuple[str, ...] = ()                          # module files the stage uses
+    dicts: Tuple[str, ...] = ()                         # thuvien file names
+
+    @property
+    def kind(self) -> str:
+        return "notebook" if self.notebook else "script" if self.script else "python"
+
+
+# =========================
+# PYTHON STAGES
+# =========================
+_print_lock = threading.Lock()
+
+
+def log(msg: str):
+    """one progress line; stages report from several threads"""
+    with _print_lock:
+        sys.stdout.write(msg + "\n")
+        sys.stdout.flush()
+
+
+def _import_from(path: str):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+
+def export_tkaraoke(data: str, thuvien: str):
+    _import_from(os.path.dirname(CONVERTER))
+    from converter import export_to_csv
+    export_to_csv(os.path.join(data, "crawl", "tkaraoke.db"), "urls",
+                  os.path.join(data, "standardize", "normalize_tkaraoke_output.csv"))
+
+
+def normalize(data: str, thuvien: str):
+    _import_from(CALCULATE_DIR)
+    from fused_normalizer import load_normalizer, normalize_csv
+    normalizer = load_normalizer(thuvien)
+    normalize_csv(os.path.join(data, "refill", "final_dataset_cleaned_v3.csv"),
+                  os.path.join(data, "labeling", "final_dataset_step2_noise.csv"), normalizer)
+
+
+def label(data: str, thuvien: str):
+    """CELL 18 của calculate.ipynb"""
+    _import_from(CALCULATE_DIR)
+    import pandas as pd
+    from dict_bundle import load_labeler_bundle
+    from fused_labeler import label_dataframe
+    from token_store import save_labeled
+
+    labeler = load_labeler_bundle(thuvien)
+    df = pd.read_csv(os.path.join(data, "labeling", "final_dataset_step2_noise.csv"))
+    print(f"✅ Loaded {len(df):,} rows from Step 2")
+
+    df = label_dataframe(df, labeler, workers=os.cpu_count())
+    save_labeled(df["labeled_tokens"].tolist(), os.path.join(data, "labeling", "token_store"),
+                 texts=df["lyrics"])
+    df.to_csv(os.path.join(data, "labeling", "final_dataset_step3e_english.csv"), index=False)
+
+
+def _read_meta(data: str, columns: Sequence[str]):
+    import pandas as pd
+    path = os.path.join(data, "labeling", "final_dataset_with_period.csv")
+    return pd.read_csv(path, usecols=lambda c: c in columns, low_memory=False)
+
+
+def token_index(data: str, thuvien: str):
+    _import_from(CALCULATE_DIR)
+    from token_index import build_index
+    from token_store import TokenStore
+
+    meta = _read_meta(data, ("lyrics", "title", "year", "period", "genres", "composers"))
+    store = TokenStore.open(os.path.join(data, "labeling", "token_store"))
+    store.check_alignment(meta["lyrics"])
+    build_index(meta, os.path.join(data, "labeling", "token_index.db"), labeled_tokens=store.iter_songs())
+
+
+def matrices(data: str, thuvien: str):
+    _import_from(CALCULATE_DIR)
+    from analysis_matrices import build_matrices, matrices_key
+    from token_store import load_labeled
+
+    store_dir = os.path.join(data, "labeling", "token_store")
+    key = matrices_key(store_dir, os.path.join(data, "labeling", "final_dataset_with_period.csv"))
+    meta = _read_meta(data, ("lyrics", "year", "period", "genres", "composers"))
+    mats = build_matrices(load_labeled(store_dir), meta)
+    mats.save(os.path.join(data, "labeling", "analysis_matrices"), key)
+
+
+# =========================
+# STAGES
+# =========================
+STAGES = [
+    # ---- crawl ----
+    Stage("export_tkaraoke", "crawl",
+          inputs=("crawl/tkaraoke.db",),
+          outputs=("standardize/normalize_tkaraoke_output.csv",),
+          run=export_tkaraoke, code=(CONVERTER,)),
+
+    # ---- standardize: mỗi nguồn một nhánh (Processing.ipynb) ----
+    Stage("standardize_nhacvn", "standardize",
+          inputs=("standardize/normalize_Nhacvn_output.csv",),
+          outputs=("standardize/normalized_Nhacvn_standard.csv", "standardize/normalized_Nhacvn_standard_clean.csv",
+                   "standardize/done_lyrics_nhacvn.csv", "standardize/refill_lyricists_nhacvn.csv",
+                   "standardize/filled_source_nhacvn.csv"),
+          workdir="standardize", notebook=PROCESSING_NB, cells=(4, 11, 16, 20, 27),
+          replace={
+              # CELL 11 được chạy lại cho Nhacvn bằng cách đổi tên file
+              11: {"normalized_tkaraoke_standard": "normalized_Nhacvn_standard"},
+              20: {'fill_missing_lyricists("done_tkaraoke_nhacvn.csv", "refill_lyricists_tkaraoke.csv")': ""},
+          }),
+    Stage("standardize_tkaraoke", "standardize",
+          inputs=("standardize/normalize_tkaraoke_output.csv",),
+          outputs=("standardize/normalized_tkaraoke_standard.csv", "standardize/normalized_tkaraoke_standard_clean.csv",
+                   "standardize/done_tkaraoke_nhacvn.csv", "standardize/refill_lyricists_tkaraoke.csv",
+                   "standardize/filled_source_tkaraoke.csv"),
+          workdir="standardize", notebook=PROCESSING_NB, cells=(7, 11, 18, 20, 31),
+          replace={
+              # CELL 7 ghi ra _2, CELL 11 đọc tên không có _2; converter.py xuất cột url (không có s)
+              7: {"normalized_tkaraoke_standard_2.csv": "normalized_tkaraoke_standard.csv",
+                  'row.get("urls", "")': 'row.get("urls", row.get("url", ""))'},
+              20: {'fill_missing_lyricists("done_lyrics_nhacvn.csv", "refill_lyricists_nhacvn.csv")': ""},
+          }),
+    Stage("merge_sources", "standardize",
+          inputs=("standardize/filled_source_nhacvn.csv", "standardize/filled_source_tkaraoke.csv"),
+          outputs=("standardize/merged_nhacvnAndTkaraoke_result.csv",),
+          workdir="standardize", notebook=PROCESSING_NB, cells=(34, 35)),
+    Stage("year_fill", "standardize",
+          inputs=("standardize/l3/nhacvn.csv",),
+          outputs=("standardize/yearFiller/yearFiller_nhacvn_output.csv",),
+          workdir="standardize", script=YEAR_FILLER,
+          code=(os.path.join(STANDARDIZE_DIR, "year_filler", "year_lookup.py"),)),
+
+    # ---- merge (merge_data.ipynb, refill_nhacvn_urls.ipynb) ----
+    Stage("merge_final", "merge",
+          inputs=("merge/N01_hopamviet_final.csv", "merge/N02_timbaihat_final.csv", "merge/N03_loibaihat_final.csv",
+                  "merge/N04_nhacvn_final.csv", "merge/N04_tkaraoke_final.csv", "merge/N05_timbaihat_final.csv"),
+          outputs=("merge/merged_final.csv",),
+          workdir="merge", notebook=MERGE_NB, cells=(5,)),
+    Stage("merge_lyrics", "merge",
+          inputs=("merge/merged_final.csv",),
+          outputs=("merge/merged_final_lyric.csv",),
+          workdir="merge", notebook=MERGE_NB, cells=(11,),
+          code=(os.path.join(STANDARDIZE_DIR, "merge_data", "lyrics_lsh.py"),)),
+    Stage("refill_nhacvn_urls", "merge",
+          inputs=("refill/final_dataset_cleaned_v2.csv", "refill/outputNhacvn2.csv"),
+          outputs=("refill/final_dataset_no_nhacvn.csv", "refill/preview_replace_title_comp_lyrics.csv",
+                   "refill/final_dataset_cleaned_v3.csv"),
+          workdir="refill", notebook=REFILL_NB, cells=(1, 2, 3, 4),
+          replace={4: {"vietnamese-stopwords/": ""}},
+          code=(os.path.join(STANDARDIZE_DIR, "nhacvn_refill_urls", "signature_index.py"),)),
+
+    # ---- labeling (calculate.ipynb) ----
+    Stage("normalize", "labeling",
+          inputs=("refill/final_dataset_cleaned_v3.csv",),
+          outputs=("labeling/final_dataset_step2_noise.csv",),
+          run=normalize, code=(os.path.join(CALCULATE_DIR, "fused_normalizer.py"),),
+          dicts=NORMALIZER_DICTS),
+    Stage("label", "labeling",
+          inputs=("labeling/final_dataset_step2_noise.csv",),
+          outputs=("labeling/token_store", "labeling/final_dataset_step3e_english.csv"),
+          run=label, code=tuple(os.path.join(CALCULATE_DIR, f) for f in
+                                ("fused_labeler.py", "dict_bundle.py", "token_store.py")),
+          dicts=LABELER_DICTS),
+    Stage("finalize", "labeling",
+          inputs=("labeling/final_dataset_step3e_english.csv", "labeling/token_store"),
+          outputs=("labeling/final_dataset_complete.csv",),
+          workdir="labeling", notebook=CALCULATE_NB, cells=(19, 20),
+          replace={19: {CALCULATE_PREFIX: ""}, 20: {CALCULATE_PREFIX: ""}},
+          code=(os.path.join(CALCULATE_DIR, "token_store.py"),)),
+
+    # ---- analyze (analysis.ipynb) ----
+    Stage("token_index", "analyze",
+          inputs=("labeling/final_dataset_with_period.csv", "labeling/token_store"),
+          outputs=("labeling/token_index.db",),
+          run=token_index, code=tuple(os.path.join(CALCULATE_DIR, f) for f in ("token_index.py", "token_store.py"))),
+    Stage("matrices", "analyze",
+          inputs=("labeling/final_dataset_with_period.csv", "labeling/token_store"),
+          outputs=("labeling/analysis_matrices",),
+          run=matrices, code=tuple(os.path.join(CALCULATE_DIR, f) for f in ("analysis_matrices.py", "token_store.py"))),
+]
+STAGE_BY_NAME = {st.name: st for st in STAGES}
+
+
+def upstream(stages: Sequence[Stage]) -> Dict[str, List[str]]:
+    """stage -> stages producing its inputs; checks outputs are unique and the graph has no cycle"""
+    producer = {}
+    for st in stages:
+        for out in st.outputs:
+            if out in producer:
+                raise ValueError(f"{out} is an output of both {producer[out]} and {st.name}")
+            producer[out] = st.name
+    ups = {st.name: sorted({producer[i] for i in st.inputs if i in producer}) for st in stages}
+
+    # Kahn: mọi stage phải được xếp thứ tự
+    indegree = {name: len(u) for name, u in ups.items()}
+    queue = deque(name for name, d in indegree.items() if d == 0)
+    seen = 0
+    while queue:
+        name = queue.popleft()
+        seen += 1
+        for other, u in ups.items():
+            if name in u:
+                indegree[other] -= 1
+                if indegree[other] == 0:
+                    queue.append(other)
+    if seen != len(ups):
+        raise ValueError("Stage graph has a cycle")
+    return ups
+
+
+def select(names: Sequence[str], ups: Dict[str, List[str]]) -> List[str]:
+    """names (stage or group) + every stage they depend on, in declaration order"""
+    if not names:
+        return [st.name for st in STAGES]
+    wanted = set()
+    for name in names:
+        group = [st.name for st in STAGES if st.group == name]
+        if name in STAGE_BY_NAME:
+            wanted.add(name)
+        elif group:
+            wanted.update(group)
+        else:
+            raise SystemExit(f"❌ Không có stage / nhóm '{name}' (xem: python pipeline.py list)")
+    todo = list(wanted)
+    while todo:
+        for u in ups[todo.pop()]:
+            if u not in wanted:
+                wanted.add(u)
+                todo.append(u)
+    return [st.name for st in STAGES if st.name in wanted]
+
+
+# =========================
+# FINGERPRINTS
+# =========================
+def notebook_cells(stage: Stage) -> List[Tuple[int, str]]:
+    """(cell index, source after the replacements) of the selected cells"""
+    with open(stage.notebook, encoding="utf-8") as f:
+        cells = json.load(f)["cells"]
+    sources = []
+    for i in stage.cells:
+        if cells[i]["cell_type"] != "code":
+            raise ValueError(f"{os.path.basename(stage.notebook)} cell {i} is not a code cell")
+        src = "".join(cells[i]["source"])
+        for old, new in stage.replace.get(i, {}).items():
+            if old not in src:
+                raise ValueError(f"{os.path.basename(stage.notebook)} cell {i} no longer contains {old!r}")
+            src = src.replace(old, new)
+        # bỏ magic của notebook (%pip, !ls)
+        src = "\n".join(line for line in src.splitlines() if not line.lstrip().startswith(("%", "!")))
+        sources.append((i, src))
+    return sources
+
+
+class State:
+    """.pipeline/state.json: digest cache of files + last successful run of every stage"""
+
+    def __init__(self, data_dir: str):
+        self.data_dir = data_dir
+        self.path = os.path.join(data_dir, STATE_DIR_NAME, STATE_FILE)
+        self.lock = threading.Lock()
+        self.files: Dict[str, list] = {}
+        self.stages: Dict[str, dict] = {}
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as f:
+                saved = json.load(f)
+            self.files = saved.get("files", {})
+            self.stages = saved.get("stages", {})
+
+    def save(self):
+        with self.lock:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"files": self.files, "stages": self.stages}, f, ensure_ascii=False, indent=1)
+            os.replace(tmp, self.path)
+
+    def file_digest(self, path: str) -> str:
+        """sha256 of a file, re-read only when its size or mtime changed"""
+        st = os.stat(path)
+        with self.lock:
+            cached = self.files.get(path)
+        if cached and cached[0] == st.st_size and cached[1] == st.st_mtime_ns:
+            return cached[2]
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+        digest = h.hexdigest()
+        with self.lock:
+            self.files[path] = [st.st_size, st.st_mtime_ns, digest]
+        return digest
+
+    def digest(self, path: str) -> Optional[str]:
+        """file digest, or one digest over the relative paths + digests of a directory; None when missing"""
+        if os.path.isdir(path):
+            h = hashlib.sha256()
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    full = os.path.join(root, name)
+                    h.update(os.path.relpath(full, path).encode("utf-8") + b"\0")
+                    h.update(self.file_digest(full).encode("ascii"))
+            return h.hexdigest()
+        if os.path.exists(path):
+            return self.file_digest(path)
+        return None
+
+
+def code_digest(stage: Stage, state: State) -> str:
+    h = hashlib.sha256(stage.kind.encode("utf-8"))
+    if stage.notebook:
+        h.update(NOTEBOOK_PRELUDE.encode("utf-8"))
+        for i, src in notebook_cells(stage):
+            h.update(f"\0{i}\0".encode("utf-8") + src.encode("utf-8"))
+    elif stage.script:
+        h.update(state.file_digest(stage.script).encode("ascii"))
+    else:
+        h.update(inspect.getsource(stage.run).encode("utf-8"))
+    for path in stage.code:
+        h.update(f"\0{os.path.basename(path)}\0{state.digest(path)}".encode("utf-8"))
+    return h.hexdigest()
+
+
+def fingerprint_parts(stage: Stage, state: State, thuvien: str) -> dict:
+    return {
+        "code": code_digest(stage, state),
+        "inputs": {p: state.digest(os.path.join(state.data_dir, p)) for p in stage.inputs},
+        "dicts": {d: state.digest(os.path.join(thuvien, d)) for d in stage.dicts},
+    }
+
+
+def fingerprint(parts: dict) -> str:
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def rerun_reasons(stage: Stage, state: State, parts: dict) -> List[str]:
+    """why the stage cannot be skipped ([] = cached)"""
+    last = state.stages.get(stage.name)
+    if last is None:
+        return ["chưa chạy lần nào"]
+    reasons = []
+    old = last["parts"]
+    if old["code"] != parts["code"]:
+        reasons.append("code thay đổi")
+    reasons += [f"input thay đổi: {p}" for p, d in parts["inputs"].items() if old["inputs"].get(p) != d]
+    reasons += [f"từ điển thay đổi: {d}" for d, v in parts["dicts"].items() if old["dicts"].get(d) != v]
+    for p, d in last["outputs"].items():
+        now = state.digest(os.path.join(state.data_dir, p))
+        if now is None:
+            reasons.append(f"thiếu output: {p}")
+        elif now != d:
+            reasons.append(f"output bị sửa: {p}")
+    return reasons
+
+
+def missing_inputs(stage: Stage, data_dir: str) -> List[str]:
+    return [p for p in stage.inputs if not os.path.exists(os.path.join(data_dir, p))]
+
+
+# =========================
+# RUN
+# =========================
+def exec_stage(stage: Stage, data_dir: str, thuvien: str):
+    """Run one stage in this process (called in the child process by run_stage)"""
+    for out in stage.outputs:
+        os.makedirs(os.path.dirname(os.path.join(data_dir, out)), exist_ok=True)
+    os.chdir(os.path.join(data_dir, stage.workdir))
+
+    if stage.notebook:
+        _import_from(os.path.dirname(stage.notebook))
+        namespace = {"__name__": "__main__", "display": print}
+        exec(NOTEBOOK_PRELUDE, namespace)
+        name = os.path.basename(stage.notebook)
+        for i, src in notebook_cells(stage):
+            print(f"\n▶️ {name} [cell {i}]")
+            exec(compile(src, f"{name}[cell {i}]", "exec"), namespace)
+    elif stage.script:
+        sys.path.insert(0, os.path.dirname(stage.script))
+        runpy.run_path(stage.script, run_name="__main__")
+    else:
+        stage.run(data_dir, thuvien)
+
+
+def run_stage(stage: Stage, state: State, thuvien: str, force: bool) -> str:
+    """ok | cached | failed | missing"""
+    data_dir = state.data_dir
+    missing = missing_inputs(stage, data_dir)
+    if missing:
+        log(f"⏭️ {stage.name}: thiếu input {', '.join(missing)}")
+        return "missing"
+
+    try:
+        parts = fingerprint_parts(stage, state, thuvien)
+    except ValueError as e:     # notebook đã đổi, khai báo cell không còn đúng
+        log(f"❌ {stage.name}: {e}")
+        return "failed"
+    reasons = ["--force"] if force else rerun_reasons(stage, state, parts)
+    if not reasons:
+        log(f"✅ {stage.name}: cached")
+        return "cached"
+
+    log(f"▶️ {stage.name}: {'; '.join(reasons[:3])}{' ...' if len(reasons) > 3 else ''}")
+    log_path = os.path.join(data_dir, STATE_DIR_NAME, "logs", f"{stage.name}.log")
+    os.makedirs(os.path.dirname(log_path), exist_ok=True)
+    start = time.time()
+    with open(log_path, "w", encoding="utf-8") as log_file:
+        proc = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "_exec", stage.name,
+             "--data-dir", data_dir, "--thuvien", thuvien],
+            stdout=log_file, stderr=subprocess.STDOUT,
+            env={**os.environ, "MPLBACKEND": "Agg", "PYTHONUNBUFFERED": "1"},
+        )
+    elapsed = time.time() - start
+
+    produced = {p: state.digest(os.path.join(data_dir, p)) for p in stage.outputs}
+    absent = [p for p, d in produced.items() if d is None]
+    if proc.returncode != 0 or absent:
+        with open(log_path, encoding="utf-8", errors="replace") as f:
+            tail = f.readlines()[-LOG_TAIL:]
+        why = f"exit {proc.returncode}" if proc.returncode else f"không tạo ra {', '.join(absent)}"
+        log(f"❌ {stage.name}: {why} ({elapsed:.1f}s) — log: {log_path}\n" + "".join("   " + l for l in tail))
+        return "failed"
+
+    with state.lock:
+        state.stages[stage.name] = {
+            "fingerprint": fingerprint(parts),
+            "parts": parts,
+            "outputs": produced,
+            "finished": datetime.now().isoformat(timespec="seconds"),
+            "seconds": round(elapsed, 1),
+        }
+    state.save()
+    log(f"✅ {stage.name}: xong trong {elapsed:.1f}s")
+    return "ok"
+
+
+def run(names: Sequence[str], state: State, thuvien: str, force: bool, jobs: int) -> Dict[str, str]:
+    ups = upstream(STAGES)
+    selected = select(names, ups)
+    forced = set(select(names, {n: [] for n in ups})) if force else set()
+    status: Dict[str, str] = {}
+    pending = list(selected)
+    running = {}
+
+    with ThreadPoolExecutor(jobs) as pool:
+        while pending or running:
+            for name in list(pending):
+                deps = [u for u in ups[name] if u in selected]
+                if any(status.get(u) in ("failed", "missing", "blocked") for u in deps):
+                    log(f"⏭️ {name}: bỏ qua vì stage trước lỗi")
+                    status[name] = "blocked"
+                    pending.remove(name)
+                elif all(u in status for u in deps):
+                    running[pool.submit(run_stage, STAGE_BY_NAME[name], state, thuvien, name in forced)] = name
+                    pending.remove(name)
+            if not running:
+                continue
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for fut in finished:
+                status[running.pop(fut)] = fut.result()
+    return status
+
+
+def dry_run(names: Sequence[str], state: State, thuvien: str, force: bool):
+    """status: the plan of `run` without running anything"""
+    ups = upstream(STAGES)
+    selected = select(names, ups)
+    forced = set(select(names, {n: [] for n in ups})) if force else set()
+    plan: Dict[str, str] = {}
+    for name in selected:
+        stage = STAGE_BY_NAME[name]
+        rerun_ups = [u for u in ups[name] if plan.get(u) in ("run", "blocked")]
+        blocked_ups = [u for u in ups[name] if plan.get(u) == "blocked"]
+        missing = [p for p in missing_inputs(stage, state.data_dir)
+                   if not any(p in STAGE_BY_NAME[u].outputs for u in rerun_ups)]
+        if blocked_ups or missing:
+            plan[name] = "blocked"
+            why = f"thiếu input: {', '.join(missing)}" if missing else f"stage trước không chạy được: {', '.join(blocked_ups)}"
+            log(f"⏭️ {name:<20} {why}")
+        elif rerun_ups:
+            plan[name] = "run"
+            log(f"▶️ {name:<20} chạy lại sau: {', '.join(rerun_ups)}")
+        else:
+            try:
+                reasons = ["--force"] if name in forced else rerun_reasons(
+                    stage, state, fingerprint_parts(stage, state, thuvien))
+            except ValueError as e:
+                plan[name] = "blocked"
+                log(f"❌ {name:<20} {e}")
+                continue
+            plan[name] = "run" if reasons else "cached"
+            log(f"{'▶️' if reasons else '✅'} {name:<20} {'; '.join(reasons) if reasons else 'cached'}")
+    state.save()    # giữ digest vừa tính cho lần sau
+
+
+def list_stages():
+    ups = upstream(STAGES)
+    for st in STAGES:
+        target = os.path.relpath(st.notebook or st.script, HERE) if st.kind != "python" else f"pipeline.py:{st.run.__name__}"
+        cells = f" cells {list(st.cells)}" if st.cells else ""
+        print(f"[{st.group}] {st.name}  ({st.kind}: {target}{cells})")
+        print(f"    sau:    {', '.join(ups[st.name]) or '-'}")
+        print(f"    input:  {', '.join(st.inputs)}")
+        if st.dicts:
+            print(f"    từ điển: {', '.join(st.dicts)}")
+        print(f"    output: {', '.join(st.outputs)}")
+
+
+def main():
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--data-dir", default=DATA_DIR, help="thư mục dữ liệu (mặc định $LYRICS_DATA_DIR hoặc ./data)")
+    common.add_argument("--thuvien", help="thư mục từ điển (mặc định <data-dir>/thuvien)")
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[2])
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("list", help="các stage cùng input / output")
+    for cmd, help_text in (("run", "chạy các stage có fingerprint thay đổi"), ("status", "xem stage nào sẽ chạy và vì sao")):
+        p = sub.add_parser(cmd, help=help_text, parents=[common])
+        p.add_argument("stages", nargs="*", help="tên stage hoặc nhóm (mặc định: tất cả)")
+        p.add_argument("--force", action="store_true", help="chạy lại các stage được chọn dù cache còn đúng")
+        if cmd == "run":
+            p.add_argument("--jobs", type=int, default=JOBS)
+    p = sub.add_parser("_exec", parents=[common])
+    p.add_argument("stage")
+    args = parser.parse_args()
+    if args.cmd == "list":
+        list_stages()
+        return 0
+
+    data_dir = os.path.abspath(args.data_dir)
+    thuvien = os.path.abspath(args.thuvien or os.path.join(data_dir, "thuvien"))
+    if args.cmd == "_exec":
+        exec_stage(STAGE_BY_NAME[args.stage], data_dir, thuvien)
+        return 0
+
+    state = State(data_dir)
+    if args.cmd == "status":
+        dry_run(args.stages, state, thuvien, args.force)
+        return 0
+
+    start = time.time()
+    status = run(args.stages, state, thuvien, args.force, max(1, args.jobs))
+    counts = {s: sum(1 for v in status.values() if v == s) for s in ("ok", "cached", "failed", "missing", "blocked")}
+    print(f"\n📊 {counts['ok']} chạy | {counts['cached']} cached | {counts['failed']} lỗi | "
+          f"{counts['missing'] + counts['blocked']} bỏ qua | {time.time() - start:.1f}s")
+    return 1 if counts["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
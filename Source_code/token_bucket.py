@@ -0,0 +1,54 @@
+"""
+token_bucket.py
+Token bucket rate limiter shared by the asyncio clients:
+
+    Data_Crawler/tkaraoke/async_fetch.py          one bucket per host
+    Data_Standardized/year_filler/year_lookup.py  one bucket per provider
+    Calculate_and_Analysis/chia_output/llm_labeler.py  request/token budgets per model
+
+rate tokens are added per second, at most capacity are stored. acquire()
+waits for tokens itself (waiters served in FIFO order); wait_time() / take()
+let a caller that picks between several buckets check them without waiting.
+
+The clients import it by name and only fall back to adding Source_code/ to
+sys.path when that fails, so a copy deployed next to a client (e.g.
+token_bucket.py + llm_labeler.py on Drive for the Colab notebook) is used as is.
+"""
+
+import asyncio
+import time
+
+
+class TokenBucket:
+    """rate tokens/second, at most capacity stored; waiters are served in FIFO order"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = max(1.0, float(capacity))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, n: float = 1) -> float:
+        """seconds until n tokens are available (n larger than capacity waits for a full bucket)"""
+        self._refill()
+        n = min(n, self.capacity)
+        return 0.0 if self.tokens >= n else (n - self.tokens) / self.rate
+
+    def take(self, n: float = 1):
+        self._refill()
+        self.tokens -= min(n, self.capacity)
+
+    async def acquire(self, n: float = 1):
+        async with self.lock:
+            while True:
+                wait = self.wait_time(n)
+                if wait <= 0:
+                    self.take(n)
+                    return
+                await asyncio.sleep(wait)